@@ -1,61 +1,221 @@
 import os
 import google.generativeai as genai
-from google.generativeai.types import GenerationConfig
 from datetime import datetime
 import json
+import time
+import logging
+import metrics
+from llm_cache import cache_key, create_analysis_cache, cache_stats as analysis_cache_stats
+from fast_extractor import caller_speech, extract_fields, min_confidence, confident_values
+from llm_batcher import MicroBatcher
+from llm_client import LLMClient
+
+logger = logging.getLogger(__name__)
 
 # Initialize Gemini
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-def analyze_transcript_with_llm(transcript):
+MODEL_NAME = 'gemini-2.0-flash'
+# Bump whenever the prompt changes so cached results from the old prompt are ignored
+PROMPT_VERSION = 'v2'
+
+# Compact instructions; the response schema carries the output format
+PROMPT_TEMPLATES = {
+    'v2': {
+        'single': (
+            "Extract from this call transcript: customer_name, loan_number, "
+            "consent_type (email or mobile), consent_status (Opt-in or Opt-out). "
+            "Use Unknown for anything not stated.\n\n{transcript}"
+        ),
+        'batch': (
+            "For each numbered call transcript extract: customer_name, loan_number, "
+            "consent_type (email or mobile), consent_status (Opt-in or Opt-out). "
+            "Use Unknown for anything not stated. Return one object per transcript with id set "
+            "to its number.\n\n{transcripts}"
+        ),
+    },
+}
+
+ANALYSIS_FIELDS = ('customer_name', 'loan_number', 'consent_type', 'consent_status')
+ANALYSIS_PROPERTIES = {
+    'customer_name': {'type': 'string'},
+    'loan_number': {'type': 'string'},
+    'consent_type': {'type': 'string', 'enum': ['email', 'mobile', 'Unknown']},
+    'consent_status': {'type': 'string', 'enum': ['Opt-in', 'Opt-out', 'Unknown']},
+}
+ANALYSIS_SCHEMA = {'type': 'object', 'properties': ANALYSIS_PROPERTIES, 'required': list(ANALYSIS_FIELDS)}
+BATCH_ANALYSIS_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': dict(ANALYSIS_PROPERTIES, id={'type': 'integer'}),
+        'required': ['id'] + list(ANALYSIS_FIELDS)
+    }
+}
+# Four short fields fit comfortably; a runaway reply is cut off early
+MAX_OUTPUT_TOKENS = 96
+
+analysis_cache = create_analysis_cache()
+
+# One client per process: reuses models and bounds every Gemini call
+llm_client = LLMClient.from_env(MODEL_NAME)
+
+# Skip the LLM when the local extractor is at least this sure of every field
+FAST_PATH_THRESHOLD = float(os.getenv('LLM_FAST_PATH_THRESHOLD', '0.8'))
+# Extracted fields at least this sure replace "Unknown" when the LLM fails
+FALLBACK_MIN_CONFIDENCE = 0.6
+
+# Calls answered locally vs handed to the cache/LLM
+FAST_PATH = metrics.counter(
+    'ivr_llm_fast_path_total', 'Analyses answered by the local extractor or deferred to the cache and LLM',
+    ('result',))
+FAST_PATH_ANSWERED, FAST_PATH_DEFERRED = FAST_PATH.labels('answered'), FAST_PATH.labels('deferred')
+
+def local_analysis(fields=None):
+    """Analysis built from locally extracted fields, "Unknown" where unsure"""
+    analysis = {
+        "customer_name": "Unknown",
+        "loan_number": "Unknown",
+        "consent_type": "Unknown",
+        "consent_status": "Unknown",
+        "call_date": datetime.now().isoformat()
+    }
+    if fields:
+        analysis.update(confident_values(fields, FALLBACK_MIN_CONFIDENCE))
+    return analysis
+
+def trim_transcript(transcript):
+    """Only what the caller said; the IVR's own lines cost tokens and add nothing"""
+    return caller_speech(transcript)
+
+def parse_json_reply(text):
+    content = text.strip()
+    if content.startswith("```json"):
+        content = content[7:-3]  # Remove ```json and ``` markers
+    return json.loads(content)
+
+def read_fields(item):
+    """The analysis fields of one reply object, None if any is missing"""
+    if not isinstance(item, dict) or not all(k in item for k in ANALYSIS_FIELDS):
+        return None
+    analysis = {k: str(item[k]) for k in ANALYSIS_FIELDS}
+    analysis['call_date'] = datetime.now().isoformat()
+    return analysis
+
+def request_analysis(transcript):
+    """Ask Gemini for the analysis of a trimmed transcript. Raises on API or parse errors."""
+    prompt = PROMPT_TEMPLATES[PROMPT_VERSION]['single'].format(transcript=transcript)
+    text = llm_client.generate(prompt, max_output_tokens=MAX_OUTPUT_TOKENS, response_schema=ANALYSIS_SCHEMA)
+    logger.debug("Gemini response: %s", text)
+
+    analysis = read_fields(parse_json_reply(text))
+    if analysis is None:
+        raise ValueError(f"reply is missing analysis fields: {text}")
+    return analysis
+
+def request_batch_analysis(transcripts):
+    """Analyze several trimmed transcripts in one Gemini request.
+
+    Returns one analysis per transcript, None where the reply had no usable
+    entry for it. Raises on API or parse errors.
+    """
+    sections = "\n\n".join(f"### {i}\n{transcript}" for i, transcript in enumerate(transcripts))
+    prompt = PROMPT_TEMPLATES[PROMPT_VERSION]['batch'].format(transcripts=sections)
+    text = llm_client.generate(
+        prompt,
+        max_output_tokens=MAX_OUTPUT_TOKENS * len(transcripts),
+        response_schema=BATCH_ANALYSIS_SCHEMA
+    )
+    items = parse_json_reply(text)
+    if not isinstance(items, list):
+        raise ValueError("batch reply is not a JSON array")
+
+    results = [None] * len(transcripts)
+    for item in items:
+        # Skip entries with an unknown id or missing fields, those calls are retried singly
+        analysis = read_fields(item)
+        if analysis is None:
+            continue
+        try:
+            index = int(item['id'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < len(results):
+            results[index] = analysis
+    return results
+
+def create_analysis_batcher():
+    """Batcher for concurrent LLM requests, None when LLM_BATCH_MAX_SIZE is 1"""
+    max_size = int(os.getenv('LLM_BATCH_MAX_SIZE', '8'))
+    if max_size <= 1:
+        return None
+    return MicroBatcher(
+        request_batch_analysis,
+        window=float(os.getenv('LLM_BATCH_WINDOW_MS', '50')) / 1000,
+        max_size=max_size,
+        concurrency=int(os.getenv('LLM_BATCH_CONCURRENCY', '4'))
+    )
+
+analysis_batcher = create_analysis_batcher()
+
+def fetch_analysis(transcript):
+    """Analysis from a shared batch request when other calls are pending, else on its own"""
+    if analysis_batcher is not None:
+        analysis = analysis_batcher.submit(transcript).result()
+        if analysis is not None:
+            return analysis
+    return request_analysis(transcript)
+
+def analyze_transcript_with_llm(transcript, fallback_on_error=True):
+    """Extract consent details from a transcript with Gemini.
+
+    Well-structured calls are answered by the local rule-based extractor.
+    LLM results are cached on the normalized caller speech, prompt version
+    and model. With fallback_on_error=False errors are raised so the caller can
+    retry, otherwise the confident local fields (or "Unknown") are returned.
+    """
+    fields = extract_fields(transcript)
+    if min_confidence(fields) >= FAST_PATH_THRESHOLD:
+        FAST_PATH_ANSWERED.inc()
+        return local_analysis(fields)
+    FAST_PATH_DEFERRED.inc()
+
+    trimmed = trim_transcript(transcript)
+    if not trimmed:
+        # The caller never said anything the LLM could use
+        return local_analysis(fields)
+
+    key = cache_key(trimmed, PROMPT_VERSION, MODEL_NAME)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        # The call date belongs to this call, not the one that filled the cache
+        cached['call_date'] = datetime.now().isoformat()
+        return cached
+
     try:
-        generation_config = GenerationConfig(
-            temperature=0.7,
-            max_output_tokens=1000,
-            top_p=1,
-            top_k=1
-        )
-        # Configure the model
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
-            generation_config=generation_config
-        )
-        
-        prompt = f"""
-        Please analyze the following call transcript and extract:
-        1. Customer Name
-        2. Loan Number
-        3. Consent Type (if mentioned as email or mobile/phone/cell)
-        4. Consent Status (Opt-in/Opt-out)
-        5. Today's date
-
-        Transcript:
-        {transcript}
-
-        Return ONLY a JSON object with these exact keys:
-        customer_name, loan_number, consent_type, consent_status, call_date
-        """
-
-        response = model.generate_content(prompt)
-        print(f"Gemini Response: {response.text}")  # Debug logging
-        
-        # Extract JSON from response
-        content = response.text.strip()
-        if content.startswith("```json"):
-            content = content[7:-3]  # Remove ```json and ``` markers
-        
-        analysis = json.loads(content)
+        start = time.perf_counter()
+        analysis = fetch_analysis(trimmed)
+        analysis_cache.set(key, analysis, time.perf_counter() - start)
         return analysis
 
     except Exception as e:
-        print(f"LLM Analysis error: {str(e)}")
-        return {
-            "customer_name": "Unknown",
-            "loan_number": "Unknown",
-            "consent_type": "Unknown",
-            "consent_status": "Unknown",
-            "call_date": datetime.now().isoformat()
-        }
+        logger.warning("LLM analysis error: %s", e)
+        if not fallback_on_error:
+            raise
+        return local_analysis(fields)
+
+def cache_stats():
+    """Cache, fast path and batching figures for the whole deployment, the same numbers /metrics serves"""
+    samples = metrics.deployment_samples()
+    stats = analysis_cache_stats(samples)
+    fast_path = {values[0]: value for values, value in samples[FAST_PATH.name].items()}
+    stats['fast_path'] = {result: fast_path.get(result, 0) for result in ('answered', 'deferred')}
+    if analysis_batcher is not None:
+        stats['batching'] = analysis_batcher.stats(samples)
+    return stats
+
+def client_stats():
+    return llm_client.stats()
     
 #acc_number phone_number consent_flag
 #transcript print on ui
@@ -63,4 +223,4 @@ def analyze_transcript_with_llm(transcript):
 #rag
 #email to back-office/and email to customer to validate
 #create a request ticket
-#sms for confirmation
\ No newline at end of file
+#sms for confirmation
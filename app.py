@@ -3,77 +3,113 @@ import json
 import time
 import sqlite3
 import re
-import random
-import string
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import speech_recognition as sr
-from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-from ai_service import analyze_transcript_with_llm
-from twilio.base.exceptions import TwilioRestException  
 from flask import url_for
-from dialer_file_processor import process_consent_data
+from dialer_file_processor import EXPORT_MODE, start_compaction_scheduler
+from job_queue import enqueue_analysis, start_worker_pool, queue_stats, get_job
+from session_store import create_session_store
+import transcript
+from transcript import CallTranscripts
+import db
+import metrics
+import call_queries
+import call_stats
+import migrations
+from otp_service import create_otp_store, generate_otp, start_purge_thread
 
-# Initialize Twilio client
-from twilio.rest import Client
 import logging
-client = Client(
-    os.getenv('TWILIO_ACCOUNT_SID'),
-    os.getenv('TWILIO_AUTH_TOKEN')
-)
+from logging_setup import configure_logging, set_call_sid, reset_call_sid
+from risk_detector import RiskDetector, DEFAULT_LEXICON_PATH
+from ai_service import cache_stats as llm_cache_stats, client_stats as llm_client_stats
+from fast_extractor import extract_loan_number
+from sms_dispatcher import SMSDispatcher, update_delivery_status, get_message_status
+from twiml_cache import twiml, xml_response
+from call_flow import compile_flow
+from call_reaper import FINAL_CALL_STATUSES, finalize_abandoned_call, start_reaper
+
+# Once per process, before anything below logs
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 SPEECH_CONFIDENCE_THRESHOLD = 0.6
+# A plus, then up to 15 digits without a leading zero
+E164_NUMBER = re.compile(r'\+[1-9]\d{1,14}')
 
-call_transcripts = {}  # Format: {call_sid: transcript_text}
+# Compiled once, reloaded when the lexicon file changes
+risk_detector = RiskDetector(os.getenv('RISK_LEXICON_PATH', DEFAULT_LEXICON_PATH))
+RISK_MIN_SEVERITY = os.getenv('RISK_MIN_SEVERITY', 'low')
+
+# Live sessions and their transcript segments, shared between workers, see SESSION_STORE in session_store.py
+# Calls that end without completing the flow are finalized by /call_status or the reaper
+call_transcripts = CallTranscripts(create_session_store())
+
+# Issues and checks caller OTPs, see OTP_STORE in otp_service.py
+otp_store = create_otp_store()
+
+REQUEST_SECONDS = metrics.histogram(
+    'ivr_http_request_seconds', 'Webhook and admin API latency by route', ('route', 'method', 'status'))
+# Read from the (possibly shared) session store at scrape time
+CALLS_IN_FLIGHT = metrics.gauge(
+    'ivr_calls_in_flight', 'Calls with an open session, from /incoming_call until completed or abandoned',
+    function=call_transcripts.count)
 
 @app.errorhandler(404)
 def not_found_error(error):
-    print("Error: {}".format(error))
+    logger.info("Not found: %s", request.path)
     return jsonify({"error": "Not found"}), 404
 
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({"error": "Internal server error"}), 500
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Every record logged while handling a webhook carries its CallSid
+    g.call_sid_token = set_call_sid(request.values.get('CallSid'))
+
+@app.teardown_request
+def clear_call_sid(exception):
+    token = g.pop('call_sid_token', None)
+    if token is not None:
+        reset_call_sid(token)
+
+# One latency sample per request, labelled by URL rule (and flow state) to keep the label set bounded
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.labels(route_label(), request.method, str(response.status_code)).observe(time.perf_counter() - start)
+    return response
+
+def route_label():
+    if request.url_rule is None:
+        return 'unmatched'
+    if request.endpoint == 'ivr_step' and request.view_args.get('state') in call_flow.states:
+        return f"/ivr/{request.view_args['state']}"
+    return request.url_rule.rule
+
+# Return this thread's pooled DB connection once the request is done
+@app.teardown_appcontext
+def release_db_connection(exception):
+    db.release_connection()
+
 # Initialize database
 def init_db():
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS calls (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        call_sid TEXT,
-        caller_number TEXT,
-        timestamp TEXT,
-        full_transcript TEXT,
-        customer_name TEXT,
-        account_number TEXT,
-        issue_type TEXT,
-        issue_description TEXT,
-        priority TEXT,
-        status TEXT DEFAULT 'new',
-        consent_type TEXT,  -- Add this column
-        consent_status TEXT  -- Add this column
-    )
-    ''')
-    
-    # Add OTP table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS otp_verification (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        phone_number TEXT,
-        otp TEXT,
-        created_at TEXT,
-        verified BOOLEAN DEFAULT FALSE
-    )
-    ''')
-    conn.commit()
-    conn.close()
+    migrations.migrate()
 
 init_db()
+analysis_workers = start_worker_pool()
+start_purge_thread(otp_store)
+start_reaper(call_transcripts)
+sms_dispatcher = SMSDispatcher.from_env().start()
+metrics.start_publisher()
+if EXPORT_MODE == 'incremental':
+    start_compaction_scheduler()
 
 # Main IVR entry point
 @app.route("/incoming_call", methods=['GET', 'POST'])
@@ -82,412 +118,172 @@ def incoming_call():
     call_sid = request.form.get('CallSid')
     
     # Initialize empty transcript for this call
-    call_transcripts[call_sid] = ""
+    call_transcripts.create(call_sid)
 
     if caller and caller.startswith("client:"):
         default_number = os.getenv('DEFAULT_CALLER_NUMBER', '+1234567890')
-        print(f"Client caller detected, using default number: {default_number}")
+        logger.debug("Client caller detected, using default number: %s", default_number)
         caller = default_number
         # Add to transcript
-        call_transcripts[call_sid] += f"Client caller, using number: {default_number}\n"
+        call_transcripts.add(call_sid, 'system', f"Client caller, using number: {default_number}")
     elif not caller:
-        print("No caller number received")
+        logger.warning("No caller number received")
         caller = os.getenv('DEFAULT_CALLER_NUMBER', '+1234567890')
-        call_transcripts[call_sid] += f"No caller ID, using default: {caller}\n"
-    
-    call_sid = request.form.get('CallSid')
-    call_transcripts[call_sid]+=call_sid
+        call_transcripts.add(call_sid, 'system', f"No caller ID, using default: {caller}")
 
-    response = VoiceResponse()
     caller = request.form.get('From')
-
     
-    # Debug: Print caller number format
-    print(f"Received call from: {caller}")
+    logger.info("Received call from: %s", caller)
     
     # Handle case where caller number is not provided
     if not caller:
-        print("No caller number received")
-        response.say("We're unable to verify your number. Please ensure you're not blocking your caller ID.")
-        response.hangup()
-        return str(response)
+        logger.warning("No caller number received")
+        return twiml('no_caller_id')
     
+    # Client and SIP callers ("client:alice", "sip:...") have no number to text the OTP to
+    sms_to = os.getenv('OTP_SMS_TO') or (caller if caller.startswith('+') else f"+{caller}")
+    if not E164_NUMBER.fullmatch(sms_to):
+        logger.warning("Caller %s has no phone number to text the OTP to", caller)
+        call_transcripts.add(call_sid, 'system', "No phone number to text the OTP to")
+        return twiml('no_caller_id')
+
     # Generate and store OTP
     otp = generate_otp()
     store_otp(caller, otp)
     
-    try:
-        # Debug: Print Twilio configuration
-        print(f"Using Twilio number: {os.getenv('TWILIO_PHONE_NUMBER')}")
-        print(f"Account SID length: {len(os.getenv('TWILIO_ACCOUNT_SID'))}")
-        print(f"Auth Token length: {len(os.getenv('TWILIO_AUTH_TOKEN'))}")
-        
-        # Verify phone number format
-        caller = f"+{caller}" if not caller.startswith('+') else caller
-        
-        # Send SMS
-        message = client.messages.create(
-            to="+918130773883",
-            from_=os.getenv('TWILIO_PHONE_NUMBER'),
-            body=f"Your IVR authentication code is: {otp}"
-        )
-        
-        # Debug: Print message SID if successful
-        print(f"Message sent successfully with SID: {message.sid}")
-        
-    except TwilioRestException as e:
-        print(f"Twilio Error Code: {e.code}")
-        print(f"Twilio Error Message: {e.msg}")
-        
-        error_messages = {
-            21211: "Invalid 'To' phone number",
-            21606: "The 'From' phone number is not a valid SMS-enabled Twilio number",
-            20003: "Authentication error - check credentials",
-            20404: "Resource not found - check phone numbers"
-        }
-        
-        error_msg = error_messages.get(e.code, "Unknown error")
-        print(f"Interpreted error: {error_msg}")
-        
-        response.say(f"We encountered a technical issue: {error_msg}. Please try again later.")
-        response.hangup()
-        return str(response)
-    
-    # gather = Gather(num_digits=1, action='/menu_selection', method='POST')
-    # gather.say("Authentication successful. For account inquiries, press 1. For technical support, press 2. For billing questions, press 3. For all other inquiries, press 4.")
-    # response.append(gather)
-        
-    # Continue with normal flow if SMS sent successfully
-    gather = Gather(
-        num_digits=6, 
-        action='/verify_otp', 
-        method='POST',
-        timeout=200,  # Extend timeout to 30 seconds
-        finish_on_key='#'  # Allow user to submit early with #
+    # Queue the SMS, the sender threads deliver it while the caller hears the prompt
+    message_id = sms_dispatcher.send(
+        sms_to,
+        f"Your IVR authentication code is: {otp}",
+        call_sid=call_sid
     )
-    gather.say("Please enter the 6-digit code sent to your phone, then press pound.")
-    response.append(gather)
-
+    if message_id is None:
+        logger.error("SMS queue is full, unable to send OTP")
+        return twiml('sms_unavailable')
         
-    return str(response)
-
-# Verify OTP and route to menu selection
-@app.route("/verify_otp", methods=['POST'])
-def verify_otp_route():
-    caller = request.form.get('From')
-    entered_otp = request.form.get('Digits')
-    
-    response = VoiceResponse()
-    
-    if verify_otp(caller, entered_otp):
-        # Continue with main menu
-        gather = Gather(num_digits=1, action='/menu_selection', method='POST')
-        gather.say("Authentication successful. For account inquiries, press 1. For technical support, press 2. For billing questions, press 3. For all other inquiries, press 4.")
-        response.append(gather)
-    else:
-        # Failed verification
-        response.say("Invalid or expired code. Please call again.")
-        response.hangup()
-    
-    return str(response)
+    # Continue with normal flow if SMS sent successfully
+    return xml_response(call_flow.start())
 
-# Process menu selection
-@app.route("/menu_selection", methods=['POST'])
-def menu_selection():
-    print("\n=== Menu Selection ===")
-    selected_option = request.form.get('Digits', None)
-    call_sid = request.form.get('CallSid')
-    caller = request.form.get('From')
-    
-    print(f"Selected Option: {selected_option}")
-    print(f"CallSid: {call_sid}")
-    
-    response = VoiceResponse()
-    
-    if selected_option == '1':
-        print("Selected account inquiry")
-        gather = Gather(
-            input='speech',
-            action='/collect_account_info',
-            method='POST',
-            language='en-IN',
-            speech_model='phone_call',
-            timeout=10,
-            speech_timeout='auto'
-        )
-        gather.say(
-            "Please say your full name followed by your account number.",
-            voice='Polly.Raveena',
-            language='en-IN'
-        )
-        response.append(gather)
-    
-    print("Sending response from menu_selection")
-    return str(response)
+# Call flow steps, referenced by name from call_flow.json
+def otp_validator(call):
+    return None if verify_otp(call.caller, call.value) else 'invalid'
 
-# Update collect_account_info route
-@app.route("/collect_account_info", methods=['POST'])
-def collect_account_info():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Check for risks
-    has_risks, found_risks = check_for_risks(speech_result)
+def risk_validator(call):
+    has_risks, found_risks = check_for_risks(call.value)
     if has_risks:
-        print(f"RISK ALERT - Call SID: {call_sid}, Risks: {found_risks}")
-        response = VoiceResponse()
-        handle_risky_speech(response, found_risks)
-        return str(response)
-    
-    # Append to transcript
-    if call_sid in call_transcripts:
-        call_transcripts[call_sid] += f"User: {speech_result}\n"
-    
-    print(f"Current transcript: {call_transcripts.get(call_sid, '')}")
-
-    
-    response = VoiceResponse()
-    gather = create_gather(
-        '/collect_technical_issue',
-        "Thank you. Please describe your account-related issue.",
-        input_type='speech'
+        logger.warning("RISK ALERT - Risks: %s", found_risks, extra={'risks': found_risks})
+        return 'risk'
+    return None
+
+def record_account_info(call):
+    record_segment(call, 'caller')
+    log_transcript(call.call_sid)
+
+def record_technical_issue(call):
+    record_segment(call, 'technical_issue')
+    log_transcript(call.call_sid)
+
+# Add what the caller said in this state to the transcript
+def record_segment(call, kind, text=None):
+    call_transcripts.add(
+        call.call_sid, kind, call.value if text is None else text,
+        confidence=call.form.get('Confidence'), source=call.state
     )
-    response.append(gather)
-    return str(response)
 
-# Process technical issues
-@app.route("/collect_technical_issue", methods=['POST'])
-def collect_technical_issue():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Check for risks
-    has_risks, found_risks = check_for_risks(speech_result)
-    if has_risks:
-        print(f"RISK ALERT - Call SID: {call_sid}, Risks: {found_risks}")
-        response = VoiceResponse()
-        handle_risky_speech(response, found_risks)
-        return str(response)
-    
-    if call_sid in call_transcripts:
-        call_transcripts[call_sid] += f"Technical issue: {speech_result}\n"
-    
-    print(f"Current transcript: {call_transcripts.get(call_sid, '')}")
-    
-    response = VoiceResponse()
-    gather = Gather(num_digits=1, action='/collect_priority', method='POST')
-    gather.say("Thank you. On a scale of 1 to 3, with 1 being urgent and 3 being non-urgent, how would you rate this issue?")
-    response.append(gather)
-    return str(response)
-
-# Process billing issues
-@app.route("/collect_billing_issue", methods=['POST'])
-def collect_billing_issue():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Store the issue description
-    store_issue_description(call_sid, speech_result)
-    
-    response = VoiceResponse()
-    gather = Gather(input='speech', action='/collect_account_for_billing', method='POST')
-    gather.say("Thank you for describing your billing issue. Please provide your account number so we can locate your billing information.")
-    response.append(gather)
-    
-    return str(response)
+def log_transcript(call_sid):
+    # The transcript is only rendered when DEBUG is on for this module
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Current transcript: %s", call_transcripts.text(call_sid))
 
-# Process other issues
-@app.route("/collect_other_issue", methods=['POST'])
-def collect_other_issue():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Store the issue description
-    store_issue_description(call_sid, speech_result)
-    
-    response = VoiceResponse()
-    gather = Gather(input='speech', action='/collect_name', method='POST')
-    gather.say("Thank you for describing your issue. Please tell us your full name.")
-    response.append(gather)
-    
-    return str(response)
-
-# Store issue description
-def store_issue_description(call_sid, description):
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE calls SET issue_description = ? WHERE call_sid = ?",
-        (description, call_sid)
-    )
-    conn.commit()
-    conn.close()
+# The issue segments double as the call's issue description (transcript.flow_fields)
+def record_billing_issue(call):
+    record_segment(call, 'billing_issue')
 
-# Collect account number for billing issues
-@app.route("/collect_account_for_billing", methods=['POST'])
-def collect_account_for_billing():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Extract account number
-    account_match = re.search(r'(\d{4,})', speech_result)
-    account = account_match.group(1) if account_match else "Unknown"
-    
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE calls SET account_number = ? WHERE call_sid = ?",
-        (account, call_sid)
-    )
-    conn.commit()
-    conn.close()
-    
-    response = VoiceResponse()
-    gather = Gather(num_digits=1, action='/collect_priority', method='POST')
-    gather.say("Thank you. On a scale of 1 to 3, with 1 being urgent and 3 being non-urgent, how would you rate the priority of this billing issue?")
-    response.append(gather)
-    
-    return str(response)
+def record_other_issue(call):
+    record_segment(call, 'other_issue')
+
+# Collect account number for billing issues. The calls row is only written once
+# the call is analysed, so the answer is kept as a field segment until then.
+def record_billing_account(call):
+    record_segment(call, 'caller')
+    # Extract account number (also handles digits spoken with pauses)
+    account, _ = extract_loan_number(call.value)
+    if account != 'Unknown':
+        record_segment(call, 'account_number', account)
 
 # Collect name for other issues
-@app.route("/collect_name", methods=['POST'])
-def collect_name():
-    call_sid = request.form.get('CallSid')
-    speech_result = request.form.get('SpeechResult', '')
-    
-    # Store the name
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE calls SET customer_name = ? WHERE call_sid = ?",
-        (speech_result.strip(), call_sid)
-    )
-    conn.commit()
-    conn.close()
-    
-    response = VoiceResponse()
-    gather = Gather(num_digits=1, action='/collect_priority', method='POST')
-    gather.say("Thank you. On a scale of 1 to 3, with 1 being urgent and 3 being non-urgent, how would you rate the priority of your issue? Please enter the priority")
-    response.append(gather)
-    
-    return str(response)
+def record_name(call):
+    record_segment(call, 'caller')
+    record_segment(call, 'customer_name', call.value)
 
 # Collect priority information
-@app.route("/collect_priority", methods=['POST'])
-def collect_priority():
-    try:
-        print("\n=== Collect Priority ===")
-        call_sid = request.form.get('CallSid')
-        digit = request.form.get('Digits', '3')
-        
-        print(f"Call SID: {call_sid}")
-        print(f"Priority Digit: {digit}")
-        
-        priority_mapping = {
-            '1': 'Urgent',
-            '2': 'Medium',
-            '3': 'Low'
-        }
-        
-        priority = priority_mapping.get(digit, 'Low')
-        print(f"Mapped Priority: {priority}")
-        
-        if call_sid in call_transcripts:
-            # Fix: Use dictionary access instead of calling it as a function
-            call_transcripts[call_sid] += f"Priority: {priority}\n"
+def record_priority(call):
+    priority_mapping = {
+        '1': 'Urgent',
+        '2': 'Medium',
+        '3': 'Low'
+    }
     
-        print(f"Current transcript: {call_transcripts.get(call_sid, '')}")
-        
-        response = VoiceResponse()
-        response.say("Thank you for providing that information. We will register the issue.")
-        response.record(max_length=300, action='/process_complete_call')
-        
-        print("Sending response from collect_priority")
-        return str(response)
-        
-    except Exception as e:
-        print(f"Error in collect_priority: {str(e)}")
-        response = VoiceResponse()
-        response.say("We encountered a technical issue. Please try your call again.")
-        response.hangup()
-        return str(response)
-
-# Process the complete call recording and transcript
-@app.route("/process_complete_call", methods=['POST'])
-def process_complete_call():
-    call_sid = request.form.get('CallSid')
-    caller = request.form.get('From')
+    priority = priority_mapping.get(call.value, 'Low')
+    logger.debug("Priority digit %s mapped to %s", call.value, priority)
+    
+    record_segment(call, 'priority', priority)
+
+# Hand the complete transcript to the analysis workers
+def complete_call(call):
+    call_sid = call.call_sid
+    caller = call.caller
 
     if caller and caller.startswith("client:"):
         default_number = os.getenv('DEFAULT_CALLER_NUMBER', '+1234567890')
-        print(f"Client caller detected, using default number: {default_number}")
+        logger.debug("Client caller detected, using default number: %s", default_number)
         caller = default_number
     
-    if call_sid in call_transcripts:
+    # Close the session and render the transcript; pop so a racing /call_status can't also finalize it
+    transcript = call_transcripts.pop(call_sid)
+    if transcript is not None:
         try:
-            # Get the full transcript
-            transcript = call_transcripts[call_sid]
-            
-            # Analyze with LLM
-            analysis = analyze_transcript_with_llm(transcript)
-            print("LLM Analysis:", analysis)
-            
-            # Store in database
-            conn = sqlite3.connect('call_data.db')
-            cursor = conn.cursor()
-            
-            # Insert or update the call record
-            cursor.execute('''
-                INSERT OR REPLACE INTO calls (
-                    call_sid, 
-                    caller_number,
-                    timestamp,
-                    full_transcript,
-                    customer_name,
-                    account_number,
-                    issue_type,
-                    issue_description,
-                    priority,
-                    status,
-                    consent_type,
-                    consent_status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                call_sid,
-                caller,
-                datetime.now().isoformat(),
-                transcript,
-                analysis.get('customer_name', 'Unknown'),
-                analysis.get('loan_number', 'Unknown'),
-                'consent',
-                transcript,
-                'Low',
-                'new',
-                analysis.get('consent_type', 'Unknown'),
-                analysis.get('consent_status', 'Unknown')
-            ))
-            
-            conn.commit()
-            print(f"Saved call data for SID: {call_sid}")
-            
-            # Process consent data and update file
-            try:
-                process_consent_data()
-                print("Consent data processed and file updated")
-            except Exception as e:
-                print(f"Error processing consent data: {str(e)}")
-            
-            # Clean up
-            conn.close()
-            del call_transcripts[call_sid]
+            # Analysis, DB insert and consent export run in the background workers
+            job_id = enqueue_analysis(call_sid, caller, transcript)
+            logger.info("Queued analysis job %s", job_id)
             
         except Exception as e:
-            print(f"Error processing call: {str(e)}")
-    
-    response = VoiceResponse()
-    response.say("Thank you for calling. Your information has been recorded. Goodbye.")
-    response.hangup()
-    return str(response)
+            logger.exception("Error processing call: %s", e)
+            # Reopen the session for the reaper so the transcript is still saved
+            call_transcripts.create(call_sid)
+
+FLOW_VALIDATORS = {
+    'otp': otp_validator,
+    'no_risk': risk_validator,
+}
+FLOW_HANDLERS = {
+    'record_account_info': record_account_info,
+    'record_technical_issue': record_technical_issue,
+    'record_billing_issue': record_billing_issue,
+    'record_other_issue': record_other_issue,
+    'record_billing_account': record_billing_account,
+    'record_name': record_name,
+    'record_priority': record_priority,
+    'complete_call': complete_call,
+}
+
+# States, prompts and transitions live in call_flow.json (CALL_FLOW_PATH)
+call_flow = compile_flow(FLOW_HANDLERS, FLOW_VALIDATORS)
+
+# Every step after incoming_call posts here
+@app.route("/ivr/<state>", methods=['POST'])
+def ivr_step(state):
+    if state not in call_flow.states:
+        return twiml('technical_error')
+    attempt = request.args.get('attempt', 0, type=int)
+    return xml_response(call_flow.handle(state, request.form, attempt))
+
+# Old webhook URLs, for calls that started before the flow engine was deployed
+for legacy_route, legacy_state in call_flow.aliases.items():
+    app.add_url_rule(
+        legacy_route, f"legacy_{legacy_state}",
+        lambda legacy_state=legacy_state: ivr_step(legacy_state), methods=['POST']
+    )
 
 # Simulate transcription (in production, you would use a real transcription service)
 def simulate_transcription(recording_url):
@@ -498,12 +294,8 @@ def simulate_transcription(recording_url):
 
 # Extract any missing information from the full transcript
 def extract_missing_information(call_sid, transcript):
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    
     # Get current call data
-    cursor.execute("SELECT * FROM calls WHERE call_sid = ?", (call_sid,))
-    call_data = cursor.fetchone()
+    call_data = db.query_one("SELECT * FROM calls WHERE call_sid = ?", (call_sid,))
     
     # This would be more sophisticated in a real application
     # Here we're just doing some basic checks
@@ -511,7 +303,7 @@ def extract_missing_information(call_sid, transcript):
         # Try to extract name using more sophisticated patterns
         name_match = re.search(r'my name is ([\w\s]+)', transcript, re.IGNORECASE)
         if name_match:
-            cursor.execute(
+            db.execute(
                 "UPDATE calls SET customer_name = ? WHERE call_sid = ?",
                 (name_match.group(1).strip(), call_sid)
             )
@@ -520,40 +312,71 @@ def extract_missing_information(call_sid, transcript):
         # Try to extract account number
         account_match = re.search(r'account (?:number|#)?\s*(?:is|:)?\s*(\d{4,})', transcript, re.IGNORECASE)
         if account_match:
-            cursor.execute(
+            db.execute(
                 "UPDATE calls SET account_number = ? WHERE call_sid = ?",
                 (account_match.group(1), call_sid)
             )
-    
-    conn.commit()
-    conn.close()
 
 # Admin API to get call data
 @app.route("/api/calls", methods=['GET'])
 def get_calls():
-    conn = sqlite3.connect('call_data.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM calls ORDER BY timestamp DESC")
-    calls = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    return jsonify(calls)
+    """List calls newest first.
+
+    Query parameters: status, priority, consent_status, caller_number,
+    since/until (ISO timestamps), fields (comma separated columns),
+    limit, cursor (from the X-Next-Cursor header) and format=ndjson
+    to stream every matching call.
+    """
+    args = request.args
+    try:
+        fields = call_queries.parse_fields(args.get('fields'))
+        query = {
+            'filters': {name: args[name] for name in call_queries.FILTER_COLUMNS if name in args},
+            'since': args.get('since'),
+            'until': args.get('until'),
+            'after': call_queries.decode_cursor(args['cursor']) if args.get('cursor') else None
+        }
+        limit = int(args.get('limit', call_queries.DEFAULT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if args.get('format') == 'ndjson':
+        rows = call_queries.iter_calls(fields, **query)
+        lines = (json.dumps(row) + "\n" for row in rows)
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    
+    calls, next_cursor = call_queries.fetch_calls_page(fields, limit=limit, **query)
+    response = jsonify(calls)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    # Lets dashboards poll with If-None-Match and get a 304 when nothing changed
+    response.add_etag()
+    return response.make_conditional(request)
 
 # Admin API to get a specific call
 @app.route("/api/calls/<call_id>", methods=['GET'])
 def get_call(call_id):
-    conn = sqlite3.connect('call_data.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM calls WHERE id = ?", (call_id,))
-    call = dict(cursor.fetchone())
-    
-    conn.close()
+    row = db.query_one("SELECT * FROM calls WHERE id = ?", (call_id,))
+    if row is None:
+        return jsonify({"error": "Not found"}), 404
+    call = dict(row)
+    # Decompressed from transcript_archives; calls itself only keeps the preview
+    call['full_transcript'] = transcript.archived_text(call['call_sid'])
     return jsonify(call)
 
+# Admin API for a call's transcript turn by turn, with timing, confidence and flow state
+@app.route("/api/calls/<call_id>/transcript", methods=['GET'])
+def get_call_transcript(call_id):
+    call = db.query_one("SELECT call_sid FROM calls WHERE id = ?", (call_id,))
+    if call is None:
+        return jsonify({"error": "Not found"}), 404
+    segments = transcript.call_segments(call['call_sid'])
+    return jsonify({
+        "call_sid": call['call_sid'],
+        "segments": [segment.as_dict() for segment in segments],
+        "text": transcript.render(segments)
+    })
+
 # Admin API to update call status
 @app.route("/api/calls/<call_id>/status", methods=['PUT'])
 def update_call_status(call_id):
@@ -563,121 +386,112 @@ def update_call_status(call_id):
     if not new_status:
         return jsonify({"error": "No status provided"}), 400
     
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    cursor.execute(
+    db.execute(
         "UPDATE calls SET status = ? WHERE id = ?",
         (new_status, call_id)
     )
-    conn.commit()
-    conn.close()
     
     return jsonify({"success": True})
 
-def generate_otp():
-    return ''.join(random.choices(string.digits, k=6))
+# Twilio voice status callback (set the number's call status callback URL to this route)
+@app.route("/call_status", methods=['POST'])
+def call_status():
+    status = request.form.get('CallStatus')
+    if status in FINAL_CALL_STATUSES:
+        # A call that completed the flow has no session left, so this is a no-op for it
+        finalize_abandoned_call(
+            call_transcripts, request.form.get('CallSid'), caller=request.form.get('From'),
+            call_status=status
+        )
+    return ('', 204)
+
+# Twilio SMS status callback (set SMS_STATUS_CALLBACK_URL to this route's public URL)
+@app.route("/sms_status", methods=['POST'])
+def sms_status():
+    update_delivery_status(
+        request.form.get('MessageSid'),
+        request.form.get('MessageStatus'),
+        request.form.get('ErrorCode')
+    )
+    return ('', 204)
+
+# Admin API to get the delivery status of an SMS
+@app.route("/api/sms/<int:message_id>", methods=['GET'])
+def get_sms(message_id):
+    message = get_message_status(message_id)
+    if message is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(message)
+
+# Admin API to see how many LLM round-trips the analysis cache saved
+@app.route("/api/llm_cache", methods=['GET'])
+def get_llm_cache_stats():
+    return jsonify(llm_cache_stats())
+
+# Admin API for Gemini request latency, errors and circuit breaker state
+@app.route("/api/llm", methods=['GET'])
+def get_llm_client_stats():
+    return jsonify(llm_client_stats())
+
+# Admin API for per-state latency, timeouts and drop-offs in the call flow
+@app.route("/api/flow", methods=['GET'])
+def get_call_flow_stats():
+    return jsonify(call_flow.stats())
+
+# Admin API for the view_db report figures, read from the daily rollups
+@app.route("/api/stats", methods=['GET'])
+def get_stats():
+    try:
+        days = int(request.args.get('days', call_stats.DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    return jsonify(call_stats.summary(days))
+
+# Prometheus scrape endpoint, summed over every worker process
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Admin API to see the analysis queue
+@app.route("/api/jobs", methods=['GET'])
+def get_job_queue_stats():
+    return jsonify(queue_stats())
+
+# Admin API to get a specific analysis job
+@app.route("/api/jobs/<int:job_id>", methods=['GET'])
+def get_analysis_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(job)
 
 def store_otp(phone_number, otp):
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    created_at = datetime.now().isoformat()
-    cursor.execute(
-        "INSERT INTO otp_verification (phone_number, otp, created_at) VALUES (?, ?, ?)",
-        (phone_number, otp, created_at)
-    )
-    conn.commit()
-    conn.close()
+    otp_store.issue(phone_number, otp)
 
 def verify_otp(phone_number, otp):
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    # Check OTP within last 5 minutes
-    five_mins_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    
     try:
-        logger.info(f"Attempting OTP verification for phone: {phone_number}")
+        logger.debug("Attempting OTP verification for phone: %s", phone_number)
         
-        cursor.execute(
-            """SELECT * FROM otp_verification 
-               WHERE phone_number = ? AND otp = ? AND created_at > ? 
-               AND verified = FALSE""",
-            (phone_number, otp, five_mins_ago)
-        )
-        result = cursor.fetchone()
-        
-        if result:
-            logger.info(f"Valid OTP found for phone: {phone_number}")
-            cursor.execute(
-                "UPDATE otp_verification SET verified = TRUE WHERE id = ?",
-                (result[0],)
-            )
-            conn.commit()
-            conn.close()
+        if otp_store.verify(phone_number, otp):
+            logger.info("Valid OTP found for phone: %s", phone_number)
             return True
             
-        logger.warning(f"Invalid or expired OTP attempt for phone: {phone_number}")
-        conn.close()
+        logger.warning("Invalid or expired OTP attempt for phone: %s", phone_number)
         return False
         
     except sqlite3.Error as e:
-        logger.error(f"Database error during OTP verification: {str(e)}")
-        if conn:
-            conn.close()
+        logger.error("Database error during OTP verification: %s", e)
         return False
     except Exception as e:
-        logger.error(f"Unexpected error during OTP verification: {str(e)}")
-        if conn:
-            conn.close()
+        logger.error("Unexpected error during OTP verification: %s", e)
         return False
 
-def create_gather(action, prompt, input_type='speech'):
-    gather = Gather(
-        input=input_type,
-        action=action,
-        method='POST',
-        language='en-IN',
-        speech_model='phone_call',
-        timeout=10,         # Increase timeout
-        speech_timeout=3,   # Add specific speech timeout
-        hints=[            # Add speech hints
-            'account',
-            'number',
-            'my name is'
-        ]
-    )
-    
-    gather.say(
-        prompt,
-        voice='Polly.Raveena',  
-        language='en-IN'
-    )
-    return gather
-
 def check_for_risks(speech_text):
     """Check speech content for risky or abusive content"""
-    risk_words = {
-        'bomb', 'explosion', 'kill', 'damage', 'destroy', 'threat',
-        'murder', 'death', 'attack', 'weapon', 'gun', 'blast',
-        # Add abusive words here
-    }
-    
-    # Convert to lowercase and check for risk words
-    speech_lower = speech_text.lower()
-    found_risks = [word for word in risk_words if word in speech_lower]
+    matches = risk_detector.check(speech_text, min_severity=RISK_MIN_SEVERITY)
+    found_risks = [match.term for match in matches]
     
     return bool(found_risks), found_risks
 
-def handle_risky_speech(response, risks):
-    """Add warning message to response for risky speech"""
-    warning = (
-        "We have detected concerning language in your call. "
-        "This incident will be reported to authorities. "
-        "This call is being terminated."
-    )
-    response.say(warning, voice='Polly.Raveena', language='en-IN')
-    response.hangup()
-
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
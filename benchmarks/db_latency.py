@@ -0,0 +1,106 @@
+"""Compare webhook DB latency: connect-per-call (old helpers) vs the pooled db module.
+
+Run from the repo root:  python -m benchmarks.db_latency [iterations]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+import db
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, call_sid TEXT, caller_number TEXT,
+        timestamp TEXT, full_transcript TEXT, customer_name TEXT, account_number TEXT,
+        issue_type TEXT, issue_description TEXT, priority TEXT, status TEXT DEFAULT 'new',
+        consent_type TEXT, consent_status TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS otp_verification (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, phone_number TEXT, otp TEXT,
+        created_at TEXT, verified BOOLEAN DEFAULT FALSE)''',
+)
+
+
+def webhook_ops_connect_per_call(path, i):
+    """What store_otp / verify_otp / collect_name did before the db module"""
+    phone = f"+1555{i:07d}"
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO otp_verification (phone_number, otp, created_at) VALUES (?, ?, ?)",
+                 (phone, '123456', datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    five_mins_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
+    row = conn.execute("SELECT * FROM otp_verification WHERE phone_number = ? AND otp = ? "
+                       "AND created_at > ? AND verified = FALSE", (phone, '123456', five_mins_ago)).fetchone()
+    conn.execute("UPDATE otp_verification SET verified = TRUE WHERE id = ?", (row[0],))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE calls SET customer_name = ? WHERE call_sid = ?", ('Jane Doe', f"CA{i}"))
+    conn.commit()
+    conn.close()
+
+
+def webhook_ops_pooled(path, i):
+    """The same three webhook operations through the pooled WAL connection"""
+    phone = f"+1555{i:07d}"
+    db.execute("INSERT INTO otp_verification (phone_number, otp, created_at) VALUES (?, ?, ?)",
+               (phone, '123456', datetime.now().isoformat()))
+
+    five_mins_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
+    with db.transaction() as conn:
+        row = conn.execute("SELECT * FROM otp_verification WHERE phone_number = ? AND otp = ? "
+                           "AND created_at > ? AND verified = FALSE", (phone, '123456', five_mins_ago)).fetchone()
+        conn.execute("UPDATE otp_verification SET verified = TRUE WHERE id = ?", (row[0],))
+
+    db.execute("UPDATE calls SET customer_name = ? WHERE call_sid = ?", ('Jane Doe', f"CA{i}"))
+
+
+def run(variant, iterations):
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        setup = sqlite3.connect(path)
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.close()
+        db.configure(path)
+
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            variant(path, i)
+            samples.append((time.perf_counter() - start) * 1000)
+        db.configure(original_path)
+    return samples
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    return {
+        'variant': name,
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(p95, 3),
+    }
+
+
+def main(iterations=2000):
+    results = [
+        summarize('connect_per_call', run(webhook_ops_connect_per_call, iterations)),
+        summarize('pooled_wal', run(webhook_ops_pooled, iterations)),
+    ]
+    for result in results:
+        print(f"{result['variant']:<18} mean={result['mean_ms']}ms p50={result['p50_ms']}ms p95={result['p95_ms']}ms")
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
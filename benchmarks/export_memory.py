@@ -0,0 +1,96 @@
+"""Peak process memory (RSS) of the full consent export, by table size.
+
+Run from the repo root:  python -m benchmarks.export_memory [rows ...] [--cache-kib N]
+
+Each size runs in a fresh process: seed a scratch database, then read every
+batch of dialer_file_processor.iter_consent_batches and report how far the
+peak RSS rose. The rows are fetched batch by batch, so the rise should stay
+flat as the table grows. --cache-kib shrinks SQLite's page cache, and the
+in-memory budget for sorts with it, so a small table already shows a leak.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import db
+import migrations
+import dialer_file_processor
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def seed(rows):
+    """rows distinct consent records, inserted by SQLite itself so seeding doesn't raise the peak"""
+    with db.transaction() as conn:
+        # The rollup and change_seq triggers would only slow the seeding down
+        for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'calls'").fetchall():
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO calls (call_sid, caller_number, timestamp, customer_name, account_number,
+                               consent_type, consent_status, change_seq)
+            SELECT 'CA' || i, printf('+1555%07d', i), printf('2025-01-01T%02d:%02d:%02d.%06d', i / 3600 % 24,
+                   i / 60 % 60, i % 60, i), 'Ada Lovelace', printf('%08d', i), 'email', 'opt-in', i
+            FROM n
+        ''', (rows,))
+
+
+def measure(rows, cache_kib=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'call_data.db'))
+        migrations.migrate()
+        seed(rows)
+        if cache_kib:
+            db.get_connection().execute(f"PRAGMA cache_size=-{int(cache_kib)}")
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        exported = sum(len(records) for records in dialer_file_processor.iter_consent_batches())
+        seconds = time.perf_counter() - start
+        growth = peak_rss_mb() - before
+        db.configure(db.DB_PATH)
+    return {'rows': exported, 'rss_growth_mb': round(growth, 1), 'seconds': round(seconds, 2)}
+
+
+def measure_in_subprocess(rows, cache_kib=None):
+    """measure() in a fresh interpreter, whose peak RSS nothing else has raised"""
+    command = [sys.executable, '-m', 'benchmarks.export_memory', '--child', str(rows)]
+    if cache_kib:
+        command += ['--cache-kib', str(cache_kib)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('rows', nargs='*', type=int, default=[100000, 400000, 1200000])
+    parser.add_argument('--cache-kib', type=int)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if resource is None:
+        sys.exit("Needs the resource module (Linux or macOS)")
+
+    if args.child:
+        print(json.dumps(measure(args.rows[0], args.cache_kib)))
+        return
+    for rows in args.rows:
+        result = measure_in_subprocess(rows, args.cache_kib)
+        print(f"{result['rows']:>9} rows: peak RSS +{result['rss_growth_mb']:.1f} MB in {result['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Fast-path extractor on a labelled transcript corpus.
+
+Reports how many calls skip the LLM at the configured threshold, how
+accurate the skipped calls are, and the extraction cost per call.
+
+Run from the repo root:  python -m benchmarks.fast_extractor [llm_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+
+from fast_extractor import FIELDS, extract_fields, min_confidence
+from ai_service import FAST_PATH_THRESHOLD
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'labelled_transcripts.json')
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(llm_latency_ms=1500.0, threshold=FAST_PATH_THRESHOLD, rounds=200):
+    corpus = load_corpus()
+
+    answered = 0
+    correct_calls = 0
+    field_hits = {name: [0, 0] for name in FIELDS}  # Format: {field: [correct, confident]}
+    for item in corpus:
+        fields = extract_fields(item['transcript'])
+        for name in FIELDS:
+            value, confidence = fields[name]
+            if confidence >= threshold:
+                field_hits[name][1] += 1
+                field_hits[name][0] += value == item['expected'][name]
+        if min_confidence(fields) >= threshold:
+            answered += 1
+            correct_calls += all(fields[name][0] == item['expected'][name] for name in FIELDS)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item in corpus:
+            extract_fields(item['transcript'])
+    extract_ms = (time.perf_counter() - start) / (rounds * len(corpus)) * 1000
+
+    coverage = answered / len(corpus)
+    result = {
+        'corpus_size': len(corpus),
+        'threshold': threshold,
+        'llm_calls_skipped': answered,
+        'coverage': round(coverage, 3),
+        'skipped_call_accuracy': round(correct_calls / answered, 3) if answered else None,
+        'field_precision': {name: round(hits / seen, 3) if seen else None for name, (hits, seen) in field_hits.items()},
+        'extract_ms_per_call': round(extract_ms, 4),
+        # Expected analysis latency per call if every deferred call pays one LLM round-trip
+        'mean_latency_ms_before': llm_latency_ms,
+        'mean_latency_ms_after': round(extract_ms + (1 - coverage) * llm_latency_ms, 1),
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1500.0)
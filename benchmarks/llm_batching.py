@@ -0,0 +1,62 @@
+"""LLM analysis throughput with and without micro-batching, against a mock Gemini model.
+
+The mock (benchmarks.mock_gemini) charges a fixed per-request latency plus a
+small per-transcript cost and only serves a few requests at once, like a
+rate-limited quota. It can also drop entries from batch replies to exercise
+the single request fallback.
+
+Run from the repo root:  python -m benchmarks.llm_batching [calls] [drop_rate]
+"""
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_service
+import metrics
+from llm_batcher import MicroBatcher
+from benchmarks import mock_gemini
+from benchmarks.mock_gemini import MockModel
+
+
+def run(calls, callers, batcher):
+    ai_service.analysis_batcher = batcher
+    MockModel.requests = 0
+    transcripts = [f"User: calling about my account, reference {i}" for i in range(calls)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        results = list(pool.map(ai_service.fetch_analysis, transcripts))
+    elapsed = time.perf_counter() - start
+
+    assert all(result['loan_number'] == '12345' for result in results)
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'calls_per_s': round(calls / elapsed, 1),
+        'model_requests': MockModel.requests,
+        # Only the batched run sends batches, so the process totals are its own
+        'batching': batcher.stats(metrics.process_samples()) if batcher else None
+    }
+
+
+def main(calls=128, drop_rate=0.0, callers=32, window_ms=50, max_size=8):
+    original_batcher = ai_service.analysis_batcher
+    restore = mock_gemini.install(drop_rate=drop_rate)
+    try:
+        results = {
+            'single': run(calls, callers, None),
+            'batched': run(calls, callers, MicroBatcher(
+                ai_service.request_batch_analysis, window=window_ms / 1000, max_size=max_size)),
+        }
+    finally:
+        restore()
+        ai_service.analysis_batcher = original_batcher
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 128,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    )
@@ -0,0 +1,301 @@
+"""End-to-end load test: synthetic calls through the real webhook sequence.
+
+Starts app.py on a local threaded server. The Twilio Messages stub
+(benchmarks.twilio_stub) and the mock Gemini model (benchmarks.mock_gemini)
+stand in for the real services. Calls are then offered at increasing
+arrival rates.
+
+Each call runs /incoming_call and reads its OTP from the stub's inbox. It
+then follows the action URL in every TwiML response and answers the
+prompt after a random think time, until the call is hung up.
+
+For each stage it reports p50/p95/p99 latency per route, the error rate,
+and how many calls completed. The highest rate whose p95 and error rate
+stay within the limits is reported as the maximum sustainable rate. The
+load generator shares the process, and the GIL, with the app, so treat
+the numbers as a lower bound.
+
+Run from the repo root:
+    python -m benchmarks.load_test --rates 5,10,20,40 --stage-seconds 20
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import tempfile
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.twilio_stub import TwilioStub
+
+ACTION = re.compile(r'action="([^"]+)"')
+NUM_DIGITS = re.compile(r'numDigits="(\d+)"')
+OTP_PATTERN = re.compile(r'\b(\d{6})\b')
+
+# Digits a caller may press, per state; other one-digit prompts are priorities
+MENU_DIGITS = {'main_menu': '1234'}
+PRIORITY_DIGITS = '123'
+NAMES = ['Priya Sharma', 'Rahul Verma', 'Sara Lee', 'John Smith', 'Anita Desai']
+ISSUES = [
+    "I want to opt in for email updates",
+    "please stop calling my mobile, I want to opt out",
+    "my payment was deducted twice last month",
+    "I can't log in to the online portal",
+    "I would like to receive statements by email",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """Latency and outcome of every webhook request in a stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # Format: {route: [seconds, ...]}
+        self.errors = {}  # Format: {route: count}
+        self.outcomes = {}  # Format: {outcome: calls}
+
+    def request(self, route, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def outcome(self, name):
+        with self.lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    def summary(self):
+        routes = {}
+        all_latencies = []
+        for route, values in sorted(self.latencies.items()):
+            all_latencies.extend(values)
+            routes[route] = {
+                'requests': len(values),
+                'errors': self.errors.get(route, 0),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+            }
+        requests_total = len(all_latencies)
+        return {
+            'requests': requests_total,
+            'error_rate': round(sum(self.errors.values()) / requests_total, 4) if requests_total else 0.0,
+            'p50_ms': round(percentile(all_latencies, 50) * 1000, 1) if all_latencies else None,
+            'p95_ms': round(percentile(all_latencies, 95) * 1000, 1) if all_latencies else None,
+            'p99_ms': round(percentile(all_latencies, 99) * 1000, 1) if all_latencies else None,
+            'calls': dict(self.outcomes),
+            'routes': routes,
+        }
+
+
+def route_name(path):
+    return path.split('?', 1)[0]
+
+
+def answer(state, twiml, otp, rng):
+    """Form fields a caller would send for this prompt"""
+    if '<Record' in twiml:
+        return {'RecordingUrl': f"https://api.twilio.com/recordings/RE{uuid.uuid4().hex}"}
+    digits = NUM_DIGITS.search(twiml)
+    if digits and digits.group(1) == '6':
+        return {'Digits': otp}
+    if digits:
+        return {'Digits': rng.choice(MENU_DIGITS.get(state, PRIORITY_DIGITS))}
+    if 'name' in state or 'account' in state:
+        return {'SpeechResult': f"my name is {rng.choice(NAMES)} and my account number is {rng.randrange(10**7, 10**8)}",
+                'Confidence': '0.92'}
+    return {'SpeechResult': rng.choice(ISSUES), 'Confidence': '0.9'}
+
+
+def wait_for_otp(stub, caller, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        message = stub.last_message(caller)
+        if message:
+            match = OTP_PATTERN.search(message)
+            if match:
+                return match.group(1)
+        time.sleep(0.02)
+    return None
+
+
+def simulate_call(base_url, stub, recorder, think, seed):
+    rng = random.Random(seed)
+    caller = f"+1555{rng.randrange(10**7):07d}"
+    form = {'CallSid': 'CA' + uuid.uuid4().hex, 'From': caller}
+    session = requests.Session()
+
+    def post(path, extra=None):
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + path, data=dict(form, **(extra or {})), timeout=15)
+            ok = 200 <= response.status_code < 300
+            body = response.text
+        except requests.RequestException:
+            ok, body = False, ''
+        recorder.request(route_name(path), time.perf_counter() - start, ok)
+        return ok, body
+
+    try:
+        ok, twiml = post('/incoming_call')
+        if not ok:
+            return recorder.outcome('error')
+        otp = wait_for_otp(stub, caller, timeout=15)
+        if otp is None:
+            return recorder.outcome('otp_not_received')
+
+        while True:
+            match = ACTION.search(twiml)
+            if not match:
+                break
+            path = match.group(1)
+            state = route_name(path).rsplit('/', 1)[-1]
+            time.sleep(rng.uniform(*think))
+            ok, twiml = post(path, answer(state, twiml, otp, rng))
+            if not ok:
+                return recorder.outcome('error')
+        recorder.outcome('completed' if 'Goodbye.</Say>' in twiml else 'ended_early')
+    finally:
+        # Twilio's status callback once the call is over, whichever way it ended
+        post('/call_status', {'CallStatus': 'completed'})
+        session.close()
+
+
+def run_stage(base_url, stub, rate, seconds, think, seed):
+    recorder = Recorder()
+    calls = int(rate * seconds)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(64, calls)) as pool:
+        for i in range(calls):
+            # Open loop: arrivals keep coming whether or not earlier calls have finished
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(simulate_call, base_url, stub, recorder, think, seed * 100003 + i)
+    summary = recorder.summary()
+    summary['offered_calls_per_s'] = rate
+    summary['elapsed_s'] = round(time.perf_counter() - start, 1)
+    return summary
+
+
+def configure_environment(workdir, stub, args):
+    os.environ.update({
+        'CALL_DB_PATH': os.path.join(workdir, 'calls.db'),
+        'SESSION_STORE': 'memory',
+        'OTP_STORE': 'sqlite',
+        'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+        'TWILIO_AUTH_TOKEN': 'load-test',
+        'TWILIO_PHONE_NUMBER': '+15550000000',
+        'TWILIO_API_BASE_URL': stub.base_url,
+        'SMS_RATE_PER_SECOND': '1000',
+        'SMS_RATE_BURST': '1000',
+        'SMS_WORKERS': str(args.sms_workers),
+        'ANALYSIS_WORKER_MODE': 'thread',
+        'ANALYSIS_WORKERS': str(args.analysis_workers),
+        'LLM_CACHE_PERSISTENT': 'false',
+        # Per-request INFO lines would only compete with the calls for the GIL
+        'LOG_LEVEL': 'WARNING',
+        'LOG_LEVELS': 'werkzeug=ERROR',
+    })
+    os.environ.pop('OTP_SMS_TO', None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', default='2,5,10,20', help="calls per second offered in each stage")
+    parser.add_argument('--stage-seconds', type=float, default=15)
+    parser.add_argument('--think-ms', default='200,800', help="min,max pause before answering a prompt")
+    parser.add_argument('--sms-latency-ms', type=float, default=150)
+    parser.add_argument('--sms-failure-rate', type=float, default=0.02)
+    parser.add_argument('--llm-latency-ms', type=float, default=800)
+    parser.add_argument('--llm-failure-rate', type=float, default=0.05)
+    parser.add_argument('--sms-workers', type=int, default=8)
+    parser.add_argument('--analysis-workers', type=int, default=4)
+    parser.add_argument('--slo-p95-ms', type=float, default=500)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    rates = [float(rate) for rate in args.rates.split(',')]
+    think = tuple(float(ms) / 1000 for ms in args.think_ms.split(','))
+    workdir = tempfile.mkdtemp(prefix='ivr_load_')
+    stub = TwilioStub(latency_ms=args.sms_latency_ms, failure_rate=args.sms_failure_rate).start()
+    configure_environment(workdir, stub, args)
+
+    from werkzeug.serving import make_server
+    from benchmarks import mock_gemini
+    restore_model = mock_gemini.install(
+        request_latency=args.llm_latency_ms / 1000, failure_rate=args.llm_failure_rate, concurrency=8)
+    # Only the report goes to stdout; app logs and stray prints go to devnull
+    report = sys.stdout
+    devnull = open(os.devnull, 'w')
+    quiet = contextlib.redirect_stdout(devnull)
+    quiet.__enter__()
+    import app
+    from job_queue import queue_stats
+    original_cwd = os.getcwd()
+    os.chdir(workdir)  # Consent export files land here
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name='load-test-server').start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = {'config': vars(args), 'stages': [], 'max_sustainable_calls_per_s': None}
+    try:
+        for stage, rate in enumerate(rates):
+            summary = run_stage(base_url, stub, rate, args.stage_seconds, think, args.seed + stage)
+            summary['analysis_queue'] = queue_stats()
+            summary['sustainable'] = (
+                summary['p95_ms'] is not None
+                and summary['p95_ms'] <= args.slo_p95_ms
+                and summary['error_rate'] <= args.max_error_rate
+            )
+            results['stages'].append(summary)
+            print(f"{rate:>6.1f} calls/s  requests={summary['requests']:<6} p50={summary['p50_ms']}ms "
+                  f"p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms errors={summary['error_rate']:.2%} "
+                  f"calls={summary['calls']} {'OK' if summary['sustainable'] else 'OVER LIMIT'}", file=report)
+            if not summary['sustainable']:
+                break
+            results['max_sustainable_calls_per_s'] = rate
+    finally:
+        server.shutdown()
+        # Stop the analysis workers first, or their consent exports land in the original cwd
+        if app.analysis_workers is not None:
+            app.analysis_workers.stop()
+        stub.stop()
+        restore_model()
+        os.chdir(original_cwd)
+        quiet.__exit__(None, None, None)
+        devnull.close()
+
+    for summary in results['stages']:
+        print(f"\nPer-route latency at {summary['offered_calls_per_s']} calls/s:")
+        for route, stats in summary['routes'].items():
+            print(f"  {route:<28} n={stats['requests']:<6} p50={stats['p50_ms']:>7}ms "
+                  f"p95={stats['p95_ms']:>7}ms p99={stats['p99_ms']:>7}ms errors={stats['errors']}")
+    print(f"\nMax sustainable rate: {results['max_sustainable_calls_per_s']} calls/s "
+          f"(p95 <= {args.slo_p95_ms}ms, errors <= {args.max_error_rate:.0%})")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
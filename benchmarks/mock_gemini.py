@@ -0,0 +1,82 @@
+"""Local stand-in for google.generativeai.GenerativeModel.
+
+Each request costs a fixed latency plus a per-transcript cost. Only
+`concurrency` requests are served at once, like a rate-limited quota.
+Requests can fail outright, and batch replies can drop entries.
+"""
+import re
+import json
+import time
+import random
+import threading
+
+from google.api_core.exceptions import ServiceUnavailable
+
+import llm_client
+
+TRANSCRIPT_HEADER = re.compile(r'^### (\d+)$', re.MULTILINE)
+
+ANALYSIS = {
+    'customer_name': 'Test Caller', 'loan_number': '12345', 'consent_type': 'email',
+    'consent_status': 'Opt-in'
+}
+
+
+class MockResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class MockModel:
+    requests = 0
+    failures = 0
+    lock = threading.Lock()
+    quota = threading.Semaphore(4)
+    request_latency = 0.4
+    per_transcript_latency = 0.02
+    failure_rate = 0.0
+    drop_rate = 0.0
+    rng = random.Random(3)
+
+    def __init__(self, model_name=None, generation_config=None):
+        pass
+
+    @classmethod
+    def configure(cls, request_latency=0.4, per_transcript_latency=0.02, concurrency=4,
+                  failure_rate=0.0, drop_rate=0.0):
+        cls.request_latency = request_latency
+        cls.per_transcript_latency = per_transcript_latency
+        cls.quota = threading.Semaphore(concurrency)
+        cls.failure_rate = failure_rate
+        cls.drop_rate = drop_rate
+        cls.requests = 0
+        cls.failures = 0
+
+    def generate_content(self, prompt, request_options=None):
+        ids = [int(i) for i in TRANSCRIPT_HEADER.findall(prompt)]
+        with MockModel.quota:
+            with MockModel.lock:
+                MockModel.requests += 1
+                failed = MockModel.rng.random() < MockModel.failure_rate
+            time.sleep(MockModel.request_latency + MockModel.per_transcript_latency * max(len(ids), 1))
+        if failed:
+            with MockModel.lock:
+                MockModel.failures += 1
+            raise ServiceUnavailable("mock model unavailable")
+
+        if not ids:
+            return MockResponse(json.dumps(ANALYSIS))
+        with MockModel.lock:
+            kept = [i for i in ids if MockModel.rng.random() >= MockModel.drop_rate]
+        return MockResponse("```json" + json.dumps([dict(ANALYSIS, id=i) for i in kept]) + "```")
+
+
+def install(**config):
+    """Route llm_client's Gemini calls to the mock; returns a function that undoes it"""
+    MockModel.configure(**config)
+    original = llm_client.genai.GenerativeModel
+    llm_client.genai.GenerativeModel = MockModel
+
+    def restore():
+        llm_client.genai.GenerativeModel = original
+    return restore
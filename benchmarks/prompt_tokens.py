@@ -0,0 +1,84 @@
+"""Tokens per analysis request: the original free-text prompt vs the compact v2 prompt.
+
+Transcripts come from the labelled corpus, with the lines incoming_call
+adds in production put back in front. With GEMINI_API_KEY set the counts
+come from Gemini's count_tokens; otherwise they are estimated at four
+characters per token.
+
+Run from the repo root:  python -m benchmarks.prompt_tokens
+"""
+import os
+import json
+
+import ai_service
+from benchmarks.fast_extractor import load_corpus
+
+# The prompt ai_service sent before PROMPT_VERSION v2
+LEGACY_PROMPT = """
+    Please analyze the following call transcript and extract:
+    1. Customer Name
+    2. Loan Number
+    3. Consent Type (if mentioned as email or mobile/phone/cell)
+    4. Consent Status (Opt-in/Opt-out)
+    5. Today's date
+
+    Transcript:
+    {transcript}
+
+    Return ONLY a JSON object with these exact keys:
+    customer_name, loan_number, consent_type, consent_status, call_date
+    """
+LEGACY_REPLY = """```json
+{
+  "customer_name": "Priya Sharma",
+  "loan_number": "48213377",
+  "consent_type": "email",
+  "consent_status": "Opt-in",
+  "call_date": "2024-05-14"
+}
+```"""
+STRUCTURED_REPLY = ('{"customer_name":"Priya Sharma","loan_number":"48213377",'
+                    '"consent_type":"email","consent_status":"Opt-in"}')
+
+
+def token_counter():
+    if os.getenv('GEMINI_API_KEY'):
+        model = ai_service.llm_client.model(ai_service.MAX_OUTPUT_TOKENS)
+        return lambda text: model.count_tokens(text).total_tokens, 'gemini count_tokens'
+    return lambda text: max(1, round(len(text) / 4)), 'estimate (4 chars/token)'
+
+
+def production_transcript(transcript):
+    """Put back the caller-number line incoming_call writes"""
+    return f"Client caller, using number: +15550100200\n{transcript}"
+
+
+def main():
+    count, method = token_counter()
+    corpus = load_corpus()
+    before_in = after_in = 0
+    for item in corpus:
+        transcript = production_transcript(item['transcript'])
+        before_in += count(LEGACY_PROMPT.format(transcript=transcript))
+        template = ai_service.PROMPT_TEMPLATES[ai_service.PROMPT_VERSION]['single']
+        after_in += count(template.format(transcript=ai_service.trim_transcript(transcript)))
+
+    result = {
+        'method': method,
+        'transcripts': len(corpus),
+        'input_tokens_per_call_before': round(before_in / len(corpus), 1),
+        'input_tokens_per_call_after': round(after_in / len(corpus), 1),
+        'output_tokens_per_call_before': count(LEGACY_REPLY),
+        'output_tokens_per_call_after': count(STRUCTURED_REPLY),
+        'max_output_tokens_before': 1000,
+        'max_output_tokens_after': ai_service.MAX_OUTPUT_TOKENS,
+    }
+    total_before = result['input_tokens_per_call_before'] + result['output_tokens_per_call_before']
+    total_after = result['input_tokens_per_call_after'] + result['output_tokens_per_call_after']
+    result['total_reduction'] = round(1 - total_after / total_before, 3)
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
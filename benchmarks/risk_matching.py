@@ -0,0 +1,63 @@
+"""Risk matching cost as the lexicon grows: old substring scan vs the compiled lexicon.
+
+Run from the repo root:  python -m benchmarks.risk_matching
+"""
+import time
+import random
+import string
+
+from risk_detector import RiskLexicon
+
+UTTERANCES = [
+    "my name is priya sharma and my account number is 48213377",
+    "I want to opt out of phone calls, please stop calling my mobile",
+    "the payment was deducted twice from my savings account last week",
+    "yes I agree to receive emails about my loan statement",
+    "I need help resetting my online banking password",
+]
+
+
+def synthetic_terms(count, seed=7):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return sorted(words)
+
+
+def substring_matcher(terms):
+    """What check_for_risks did before: one substring test per term"""
+    term_set = set(terms)
+
+    def match(text):
+        lower = text.lower()
+        return [word for word in term_set if word in lower]
+    return match
+
+
+def time_per_utterance(match, rounds=200):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for utterance in UTTERANCES:
+            match(utterance)
+    return (time.perf_counter() - start) / (rounds * len(UTTERANCES)) * 1e6
+
+
+def main(sizes=(12, 100, 1000, 5000)):
+    results = []
+    for size in sizes:
+        terms = synthetic_terms(size)
+        lexicon = RiskLexicon([{'term': term, 'severity': 'high'} for term in terms])
+        results.append({
+            'lexicon_size': size,
+            'substring_us': round(time_per_utterance(substring_matcher(terms)), 2),
+            'compiled_us': round(time_per_utterance(lexicon.match), 2),
+        })
+    for result in results:
+        print(f"{result['lexicon_size']:>6} terms  substring={result['substring_us']:>8}us  "
+              f"compiled={result['compiled_us']:>6}us")
+    return results
+
+
+if __name__ == "__main__":
+    main()
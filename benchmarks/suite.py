@@ -0,0 +1,292 @@
+"""Offline micro-benchmark suite for the IVR hot functions.
+
+Cases:
+  risk.check                  check_for_risks' compiled-lexicon match
+  otp.generate                generate_otp
+  otp.store / otp.verify      SQLiteOTPStore against otp_verification tables of --otp-rows rows
+  twiml.speech_gather         a speech Gather prompt built fresh vs served from the call flow cache
+  consent.full_export         process_consent_data over --call-rows calls
+  view_db.report              view_db.view_database over --call-rows calls
+
+Each run writes JSON (median/p95/min per case plus run metadata) to
+benchmarks/results/ or --output. --compare BASELINE.json flags cases that
+got slower than --threshold and exits 1, so it can gate a release.
+--diff OLD NEW compares two saved runs without benchmarking.
+
+Run from the repo root:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --otp-rows 10000,10000000 --only otp
+    python -m benchmarks.suite --compare benchmarks/results/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+import db
+import migrations
+import transcript
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+UTTERANCES = [
+    "my name is priya sharma and my account number is 48213377",
+    "I want to opt out of phone calls, please stop calling my mobile",
+    "the payment was deducted twice from my savings account last week",
+    "this is a scam and I will report you",
+]
+TRANSCRIPT = (
+    "Client caller, using number: +15550100200\nUser: my name is Priya Sharma and my loan number is 48213377\n"
+    "Technical issue: I want to opt in for email updates about my statements\nPriority: Low\n"
+)
+
+
+def summarize(samples, ops_per_sample=1):
+    per_op = sorted(sample / ops_per_sample for sample in samples)
+    return {
+        'median_us': round(per_op[len(per_op) // 2] * 1e6, 3),
+        'p95_us': round(per_op[min(len(per_op) - 1, int(len(per_op) * 0.95))] * 1e6, 3),
+        'min_us': round(per_op[0] * 1e6, 3),
+        'samples': len(per_op),
+    }
+
+
+def measure(fn, repeat, inner=1, warmup=1):
+    """Time `inner` calls of fn per sample, `repeat` samples, after warm-up samples"""
+    samples = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        if i >= warmup:
+            samples.append(time.perf_counter() - start)
+    return summarize(samples, inner)
+
+
+@contextlib.contextmanager
+def scratch_database(workdir, name):
+    """Point db at a fresh, migrated database for the duration of a case"""
+    path = os.path.join(workdir, f"{name}.db")
+    original_path = db.DB_PATH
+    db.configure(path)
+    migrations.migrate()
+    try:
+        yield path
+    finally:
+        db.configure(original_path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def seed_otps(rows):
+    """Historical codes for many phones: mostly verified or expired, like a long-running system"""
+    now = time.time()
+    db.execute(f'''
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < {rows})
+        INSERT INTO otp_verification (phone_number, otp, created_at, verified, expires_at, attempts)
+        SELECT printf('+1555%07d', x % 1000000), printf('%06d', x % 1000000),
+               datetime({now} - x, 'unixepoch'), x % 3 = 0, {now} - x + 300, 0
+        FROM seq
+    ''')
+
+
+def seed_calls(rows):
+    segments = [transcript.Segment('text', TRANSCRIPT)]
+    db.execute(f'''
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < {rows})
+        INSERT INTO calls (call_sid, caller_number, timestamp, transcript_preview, transcript_length, customer_name,
+                           account_number, issue_type, priority, status, consent_type, consent_status)
+        SELECT printf('CA%032x', x), printf('+1555%07d', x % 200000),
+               strftime('%Y-%m-%dT%H:%M:%f', 'now', printf('-%d seconds', x * 7)),
+               ?, ?, CASE WHEN x % 9 = 0 THEN 'Unknown' ELSE printf('Caller %d', x) END,
+               CASE WHEN x % 11 = 0 THEN 'Unknown' ELSE printf('%08d', x) END,
+               'Consent', 'Low', 'new',
+               CASE x % 3 WHEN 0 THEN 'email' WHEN 1 THEN 'mobile' ELSE 'Unknown' END,
+               CASE x % 4 WHEN 0 THEN 'Opt-out' WHEN 3 THEN 'Unknown' ELSE 'Opt-in' END
+        FROM seq
+    ''', (transcript.preview(segments), len(TRANSCRIPT)))
+    db.execute(
+        "INSERT INTO transcript_archives (call_sid, codec, body, length) SELECT call_sid, ?, ?, ? FROM calls",
+        (transcript.TRANSCRIPT_CODEC, transcript.encode_segments(segments), len(TRANSCRIPT))
+    )
+
+
+def bench_risk(results, args):
+    from risk_detector import RiskDetector, DEFAULT_LEXICON_PATH
+    detector = RiskDetector(DEFAULT_LEXICON_PATH)
+    results['risk.check'] = measure(
+        lambda: [detector.check(text) for text in UTTERANCES], repeat=50, inner=200)
+    results['risk.check']['note'] = f"{len(UTTERANCES)} utterances per op"
+
+
+def bench_otp(results, args):
+    from otp_service import generate_otp, SQLiteOTPStore
+    results['otp.generate'] = measure(generate_otp, repeat=50, inner=1000)
+
+    store = SQLiteOTPStore()
+    for rows in args.otp_rows:
+        with scratch_database(args.workdir, f"otp_{rows}"):
+            seed_otps(rows)
+            db.execute("ANALYZE")
+            counter = iter(range(10 ** 9))
+
+            def issue():
+                store.issue(f"+1666{next(counter):07d}", '123456')
+
+            def verify():
+                # Every code is for a fresh number, so each verify finds and consumes one live row
+                store.verify(f"+1666{next(verify_counter):07d}", '123456')
+
+            results[f"otp.store[rows={rows}]"] = measure(issue, repeat=30, inner=50)
+            verify_counter = iter(range(10 ** 9))
+            results[f"otp.verify[rows={rows}]"] = measure(verify, repeat=30, inner=50)
+
+
+def bench_twiml(results, args):
+    from benchmarks.twiml_rendering import flow_states
+    state = flow_states()['account_issue']
+    results['twiml.speech_gather[built]'] = measure(
+        lambda: str(state.build()).encode('utf-8'), repeat=50, inner=200)
+    results['twiml.speech_gather[cached]'] = measure(lambda: state.responses[0], repeat=50, inner=2000)
+
+
+def bench_consent_export(results, args):
+    from dialer_file_processor import process_consent_data
+    for rows in args.call_rows:
+        with scratch_database(args.workdir, f"calls_{rows}"):
+            seed_calls(rows)
+            export_dir = tempfile.mkdtemp(dir=args.workdir)
+            original_cwd = os.getcwd()
+            os.chdir(export_dir)
+            try:
+                with quiet():
+                    results[f"consent.full_export[calls={rows}]"] = measure(
+                        process_consent_data, repeat=3 if rows >= 100000 else 10)
+            finally:
+                os.chdir(original_cwd)
+                shutil.rmtree(export_dir, ignore_errors=True)
+
+
+def bench_view_db(results, args):
+    from view_db import view_database
+    for rows in args.call_rows:
+        with scratch_database(args.workdir, f"report_{rows}"):
+            seed_calls(rows)
+            seed_otps(rows)
+            with quiet():
+                results[f"view_db.report[calls={rows}]"] = measure(
+                    view_database, repeat=3 if rows >= 100000 else 10)
+
+
+CASES = {
+    'risk': bench_risk,
+    'otp': bench_otp,
+    'twiml': bench_twiml,
+    'consent': bench_consent_export,
+    'view_db': bench_view_db,
+}
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': db.sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print the change per case and return the names of cases that regressed"""
+    regressions = []
+    print(f"\n{'case':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, stats in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {stats['median_us']:>10.2f}us {'new':>8}")
+            continue
+        change = stats['median_us'] / before['median_us'] - 1 if before['median_us'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<40} {before['median_us']:>10.2f}us {stats['median_us']:>10.2f}us {change:>+8.1%}{flag}")
+    return regressions
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sizes(text):
+    return [int(size) for size in text.split(',') if size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help=f"comma separated case groups: {', '.join(CASES)}")
+    parser.add_argument('--otp-rows', type=sizes, default=sizes('10000,100000,1000000'))
+    parser.add_argument('--call-rows', type=sizes, default=sizes('1000,100000,1000000'))
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', help="baseline results file to check this run against")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'), help="compare two saved runs and exit")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown before a case fails")
+    args = parser.parse_args(argv)
+
+    if args.diff:
+        regressions = compare(load(args.diff[0]), load(args.diff[1]), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    groups = args.only.split(',') if args.only else list(CASES)
+    args.workdir = tempfile.mkdtemp(prefix='ivr_bench_')
+    results = {}
+    try:
+        for group in groups:
+            start = time.perf_counter()
+            CASES[group](results, args)
+            print(f"{group:<10} done in {time.perf_counter() - start:.1f}s")
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    run = {'meta': run_metadata(), 'results': results}
+    for name, stats in results.items():
+        print(f"{name:<40} median={stats['median_us']:>12.2f}us  p95={stats['p95_us']:>12.2f}us")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{run['meta']['timestamp'].replace(':', '')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressions = compare(load(args.compare), run, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+    return run
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+"""Database bytes per saved call, by transcript codec.
+
+Run from the repo root:  python -m benchmarks.transcript_storage [calls] [codec ...]
+
+Each call is built from the labelled corpus as the IVR records it (a system
+note, one segment per answer with Twilio's confidence, source state and
+time), saved through job_queue.save_call_analysis, and the database is
+VACUUMed before measuring.
+"""
+import os
+import re
+import sys
+import json
+import random
+import tempfile
+
+import db
+import migrations
+import transcript
+from job_queue import save_call_analysis
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'labelled_transcripts.json')
+# Rendered label -> (segment kind, the state that records it)
+LABELS = {
+    'User': ('caller', 'account_info'),
+    'Technical issue': ('technical_issue', 'technical_issue'),
+    'Billing issue': ('billing_issue', 'billing_issue'),
+    'Other issue': ('other_issue', 'other_issue'),
+    'Priority': ('priority', 'issue_priority'),
+}
+TABLES = ('calls', 'transcript_archives', 'sqlite_autoindex_transcript_archives_1')  # No index once WITHOUT ROWID
+
+
+def corpus_calls(count, seed=1):
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        corpus = json.load(f)
+    rnd = random.Random(seed)
+    for i in range(count):
+        entry = corpus[i % len(corpus)]
+        text = re.sub(r'^CA[0-9a-f]{32}', '', entry['transcript'])
+        started = 1760000000 + i * 37.0
+        segments = []
+        if rnd.random() < 0.5:
+            segments.append(('system', 'Client caller, using number: +1234567890', None, None, started))
+        for line in text.splitlines():
+            label, _, said = line.partition(': ')
+            kind, source = LABELS.get(label, ('caller', 'account_info'))
+            started += rnd.uniform(3, 12)
+            confidence = None if kind == 'priority' else rnd.uniform(0.6, 0.99)
+            segments.append((kind, said, confidence, source, started))
+        yield f"CA{i:032x}", segments, entry['expected']
+
+
+def measure(count, codec):
+    transcript.TRANSCRIPT_CODEC = codec
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'call_data.db')
+        db.configure(path)
+        migrations.migrate()
+        for call_sid, segments, expected in corpus_calls(count):
+            db.get_connection().executemany(
+                f"INSERT INTO transcript_segments (call_sid, {transcript.SEGMENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [(call_sid,) + segment for segment in segments]
+            )
+            save_call_analysis(call_sid, '+15550000000', None, expected)
+        conn = db.get_connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        tables = dict(conn.execute(
+            f"SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(TABLES))}) GROUP BY name",
+            TABLES
+        ).fetchall())
+        archived = conn.execute("SELECT AVG(LENGTH(body)), AVG(length) FROM transcript_archives").fetchone()
+        size = os.path.getsize(path)
+        db.configure(db.DB_PATH)
+    return size, tables, archived
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    codecs = sys.argv[2:] or ['json', 'zlib', 'packed']
+    print(f"{count} calls")
+    for codec in codecs:
+        size, tables, (body, length) = measure(count, codec)
+        archives = tables.get('transcript_archives', 0) + tables.get('sqlite_autoindex_transcript_archives_1', 0)
+        print(f"{codec:>8}: file {size / 1e6:.2f} MB, calls {tables.get('calls', 0) / 1e6:.2f} MB, "
+              f"archives {archives / 1e6:.2f} MB, body {body:.0f} bytes/call for {length:.0f} chars")
+
+
+if __name__ == "__main__":
+    main()
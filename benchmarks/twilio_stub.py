@@ -0,0 +1,110 @@
+"""Local stand-in for the Twilio Messages API.
+
+Run it and point the app at it:
+    python -m benchmarks.twilio_stub --port 8099 --latency-ms 150 --failure-rate 0.05
+    TWILIO_API_BASE_URL=http://127.0.0.1:8099 flask run
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import uuid
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/([^/]+)/Messages\.json$')
+
+
+class TwilioStub:
+    """Accepts Messages.json creates with configurable latency and transient failures"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.inbox = {}  # Format: {to_number: [body, ...]}
+        self.failures = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so client connection reuse is visible
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                match = MESSAGES_PATH.match(self.path)
+                if not match:
+                    return self._reply(404, {'code': 20404, 'message': 'Not found', 'status': 404})
+
+                if stub.latency_ms:
+                    time.sleep(random.uniform(0.5, 1.5) * stub.latency_ms / 1000)
+                if random.random() < stub.failure_rate:
+                    with stub._lock:
+                        stub.failures += 1
+                    return self._reply(429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429})
+
+                sid = 'SM' + uuid.uuid4().hex
+                with stub._lock:
+                    stub.sent.append(form)
+                    stub.inbox.setdefault(form.get('To'), []).append(form.get('Body', ''))
+                self._reply(201, {
+                    'sid': sid,
+                    'account_sid': match.group(1),
+                    'to': form.get('To'),
+                    'from': form.get('From'),
+                    'body': form.get('Body'),
+                    'status': 'queued'
+                })
+
+        return Handler
+
+    def last_message(self, to):
+        with self._lock:
+            messages = self.inbox.get(to)
+            return messages[-1] if messages else None
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="twilio-stub").start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = TwilioStub(port=args.port, latency_ms=args.latency_ms, failure_rate=args.failure_rate)
+    print(f"Twilio stub listening on {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,51 @@
+"""Per-request CPU time for IVR responses: building the TwiML tree vs the cached bytes.
+
+Run from the repo root:  python -m benchmarks.twiml_rendering
+"""
+import time
+
+from twiml_cache import BUILDERS, TEMPLATES
+from call_flow import CallFlow, load_flow_definition
+
+
+def cpu_us(render, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        render()
+    return (time.process_time() - start) / rounds * 1e6
+
+
+def flow_states():
+    """The call flow's compiled states, with no-op steps standing in for app.py's"""
+    definition = load_flow_definition()
+    names = set()
+    for state in definition['states'].values():
+        names.update(state.get('validators', []))
+        names.add(state.get('handler'))
+    steps = {name: (lambda call: None) for name in names if name}
+    return CallFlow(definition, steps, steps).states
+
+
+def main(rounds=5000):
+    results = {}
+    for name, build in BUILDERS.items():
+        template = TEMPLATES[name]
+        results[name] = (cpu_us(lambda: str(build()).encode('utf-8'), rounds), cpu_us(template.render, rounds))
+
+    # Flow prompts are pre-rendered for each retry count in their action URL
+    for name, state in flow_states().items():
+        results[f"flow:{name}"] = (
+            cpu_us(lambda: str(state.build()).replace('{{attempt}}', '0').encode('utf-8'), rounds),
+            cpu_us(lambda: state.responses[0], rounds),
+        )
+
+    for name, (built, cached) in results.items():
+        print(f"{name:<24} built={built:>7.2f}us  cached={cached:>6.2f}us  {built / max(cached, 1e-3):>7.0f}x")
+    built_total = sum(built for built, _ in results.values())
+    cached_total = sum(cached for _, cached in results.values())
+    print(f"{'mean':<24} built={built_total / len(results):>7.2f}us  cached={cached_total / len(results):>6.2f}us")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import logging
+from collections import namedtuple
+
+from twilio.twiml.voice_response import VoiceResponse, Gather
+
+import metrics
+from twiml_cache import TwiMLTemplate, VOICE, LANGUAGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLOW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'call_flow.json')
+
+# Form field Twilio posts the caller's input in, per input type
+INPUT_FIELDS = {'dtmf': 'Digits', 'speech': 'SpeechResult', 'record': 'RecordingUrl'}
+SPEECH_DEFAULTS = {'language': LANGUAGE, 'speech_model': 'phone_call'}
+# Twilio's defaults for a <Record> maxLength and <Gather> timeout, in seconds
+RECORD_MAX_LENGTH = 3600
+GATHER_TIMEOUT = 5
+
+# What validators and handlers receive
+CallInput = namedtuple('CallInput', 'call_sid caller value form state')
+
+STATE_EVENTS = ('entered', 'exited', 'timeout', 'retry', 'error')
+FLOW_EVENTS = metrics.counter(
+    'ivr_flow_state_events_total', 'Call flow state events (entered, exited, timeout, retry, error)',
+    ('state', 'event'))
+FLOW_SECONDS = metrics.histogram(
+    'ivr_flow_state_seconds', 'Time to handle the input posted for a call flow state', ('state',))
+
+
+class FlowDefinitionError(ValueError):
+    pass
+
+
+class StateMetrics:
+    """A state's metric children, looked up once"""
+    __slots__ = STATE_EVENTS + ('seconds',)
+
+    def __init__(self, name):
+        for event in STATE_EVENTS:
+            setattr(self, event, FLOW_EVENTS.labels(name, event))
+        self.seconds = FLOW_SECONDS.labels(name)
+
+
+def state_stats(events, seconds):
+    """One state's /api/flow figures from its deployment-wide samples"""
+    counts, total = seconds if seconds is not None else ((), 0.0)
+    inputs = sum(counts)
+    return {
+        'entered': events.get('entered', 0),
+        'inputs': inputs,
+        'timeouts': events.get('timeout', 0),
+        'retries': events.get('retry', 0),
+        'errors': events.get('error', 0),
+        # Calls that heard this prompt and never moved on, including calls still on it
+        'drop_offs': events.get('entered', 0) - events.get('exited', 0),
+        'avg_ms': round(total / inputs * 1000, 3) if inputs else 0.0
+    }
+
+
+class CompiledState:
+    def __init__(self, name, definition, validators, handler, transitions, max_retries):
+        self.name = name
+        self.input = definition.get('input', 'none')
+        self.field = INPUT_FIELDS.get(self.input)
+        self.validators = validators
+        self.handler = handler
+        self.transitions = transitions
+        # retry (replay the prompt), continue (hand the empty input to the handler) or a state name
+        self.on_timeout = definition.get('on_timeout', 'continue' if self.input == 'record' else 'retry')
+        self.max_retries = max_retries
+        self.build = lambda: build_state_response(name, definition)
+        self.template = TwiMLTemplate(self.build())
+        # Every attempt number the state can be served with, rendered up front
+        self.responses = tuple(self.template.render(attempt=i) for i in range(max_retries + 1))
+
+
+def build_state_response(name, definition):
+    """TwiML for a state's prompt; {{attempt}} in the action URL counts replays"""
+    action = f"/ivr/{name}?attempt={{{{attempt}}}}"
+    say_options = {'voice': definition.get('voice', VOICE), 'language': definition.get('language', LANGUAGE)}
+    response = VoiceResponse()
+    input_type = definition.get('input', 'none')
+
+    if input_type in ('dtmf', 'speech'):
+        options = dict(SPEECH_DEFAULTS) if input_type == 'speech' else {}
+        options.update(definition.get('gather', {}))
+        gather = Gather(input=input_type, action=action, method='POST', **options)
+        gather.say(definition['prompt'], **say_options)
+        response.append(gather)
+        # Twilio only reaches this when the caller gave no input before the timeout
+        response.redirect(action, method='POST')
+    elif input_type == 'record':
+        response.say(definition['prompt'], **say_options)
+        response.record(action=action, method='POST', **definition.get('record', {}))
+        # Reached when nothing was recorded, so the call is still completed
+        response.redirect(action, method='POST')
+    else:
+        response.say(definition['prompt'], **say_options)
+        response.hangup()
+    return response
+
+
+def load_flow_definition(path=None):
+    path = path or os.getenv('CALL_FLOW_PATH', DEFAULT_FLOW_PATH)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def longest_input_wait(definition):
+    """Longest any state's <Record> or <Gather> waits on the caller before Twilio posts back, in seconds"""
+    waits = [0]
+    for state in definition['states'].values():
+        input_type = state.get('input', 'none')
+        if input_type == 'record':
+            waits.append(state.get('record', {}).get('max_length', RECORD_MAX_LENGTH))
+        elif input_type in ('dtmf', 'speech'):
+            waits.append(state.get('gather', {}).get('timeout', GATHER_TIMEOUT))
+    return max(waits)
+
+
+class CallFlow:
+    """A flow definition compiled into a dispatch table of states.
+
+    Each input is checked by the state's validators, then its handler; the
+    first outcome returned (or the digits pressed, or "next") picks the
+    transition. Unmatched outcomes replay the prompt up to max_retries times.
+    """
+
+    def __init__(self, definition, handlers, validators):
+        defaults = definition.get('defaults', {})
+        self.default_transitions = defaults.get('transitions', {})
+        self.give_up = defaults.get('give_up')
+        self.start_state = definition['start']
+        self.states = {}
+        self.aliases = {}  # Format: {legacy route: state name}
+        self._metrics = {}  # Format: {state name: StateMetrics}
+
+        names = set(definition['states'])
+        for name, state in definition['states'].items():
+            try:
+                state_validators = [validators[v] for v in state.get('validators', [])]
+                handler = handlers[state['handler']] if 'handler' in state else None
+            except KeyError as e:
+                raise FlowDefinitionError(f"state '{name}' uses unknown validator or handler {e}")
+            if state.get('input', 'none') not in INPUT_FIELDS and state.get('input', 'none') != 'none':
+                raise FlowDefinitionError(f"state '{name}' has unknown input type '{state['input']}'")
+
+            transitions = dict(state.get('transitions', {}))
+            on_timeout = state.get('on_timeout')
+            if on_timeout not in (None, 'retry', 'continue'):
+                transitions.setdefault('timeout', on_timeout)
+            for target in transitions.values():
+                if target not in names:
+                    raise FlowDefinitionError(f"state '{name}' transitions to unknown state '{target}'")
+
+            self.states[name] = CompiledState(
+                name, state, state_validators, handler, transitions,
+                state.get('max_retries', defaults.get('max_retries', 2))
+            )
+            self._metrics[name] = StateMetrics(name)
+            if 'alias' in state:
+                self.aliases[state['alias']] = name
+
+        for target in [self.start_state, self.give_up] + list(self.default_transitions.values()):
+            if target not in names:
+                raise FlowDefinitionError(f"unknown state '{target}'")
+
+    def _enter(self, name, attempt=0):
+        state_metrics = self._metrics[name]
+        if attempt:
+            state_metrics.retry.inc()
+        else:
+            state_metrics.entered.inc()
+            # Prompts without input end the call as soon as they are heard
+            if self.states[name].field is None:
+                state_metrics.exited.inc()
+        return self.states[name].responses[attempt]
+
+    def start(self):
+        return self._enter(self.start_state)
+
+    def _outcome(self, state, call):
+        if not call.value and state.on_timeout != 'continue':
+            return 'timeout'
+        for validator in state.validators:
+            outcome = validator(call)
+            if outcome:
+                return outcome
+        if state.handler:
+            outcome = state.handler(call)
+            if outcome:
+                return outcome
+        return call.value if call.value in state.transitions else 'next'
+
+    def handle(self, name, form, attempt=0):
+        """Process the input posted for state `name` and return the next TwiML as bytes"""
+        state = self.states[name]
+        attempt = min(max(attempt, 0), state.max_retries)
+        start = time.perf_counter()
+        value = (form.get(state.field) or '').strip() if state.field else ''
+        call = CallInput(form.get('CallSid'), form.get('From'), value, form, name)
+        try:
+            outcome = self._outcome(state, call)
+        except Exception as e:
+            logger.exception("Error in call flow state %s: %s", name, e)
+            outcome = 'error'
+
+        target = state.transitions.get(outcome) or self.default_transitions.get(outcome)
+        state_metrics = self._metrics[name]
+        state_metrics.seconds.observe(time.perf_counter() - start)
+        if outcome == 'timeout':
+            state_metrics.timeout.inc()
+        elif outcome == 'error':
+            state_metrics.error.inc()
+        if target is not None or attempt >= state.max_retries:
+            state_metrics.exited.inc()
+
+        if target is not None:
+            return self._enter(target)
+        if attempt < state.max_retries:
+            return self._enter(name, attempt + 1)
+        return self._enter(self.give_up)
+
+    def stats(self):
+        """Per-state figures for the whole deployment, the same numbers /metrics serves"""
+        samples = metrics.deployment_samples()
+        events = {}
+        for (state, event), value in samples[FLOW_EVENTS.name].items():
+            events.setdefault(state, {})[event] = value
+        seconds = samples[FLOW_SECONDS.name]
+        return {name: state_stats(events.get(name, {}), seconds.get((name,))) for name in self.states}
+
+
+def compile_flow(handlers, validators, path=None):
+    return CallFlow(load_flow_definition(path), handlers, validators)
@@ -0,0 +1,104 @@
+import json
+import base64
+
+import db
+
+CALL_COLUMNS = (
+    # Full transcripts are in transcript_archives, see /api/calls/<id>
+    'id', 'call_sid', 'caller_number', 'timestamp', 'transcript_preview',
+    'customer_name', 'account_number', 'issue_type', 'issue_description',
+    'priority', 'status', 'consent_type', 'consent_status'
+)
+
+# Exact-match filters accepted by /api/calls
+FILTER_COLUMNS = ('status', 'priority', 'consent_status', 'caller_number')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def parse_fields(fields):
+    """Turn a comma separated ?fields= value into a validated column list"""
+    if not fields:
+        return list(CALL_COLUMNS)
+    columns = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in columns if name not in CALL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after the given (timestamp, id) row"""
+    payload = json.dumps([row['timestamp'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, call_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return timestamp, int(call_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def build_calls_query(fields, filters=None, since=None, until=None, after=None, limit=None):
+    """Build a keyset-paginated SELECT over calls, newest first.
+
+    after is a decoded cursor: only rows older than that (timestamp, id) are returned.
+    """
+    # id and timestamp are always read so the next cursor can be built
+    columns = list(dict.fromkeys(list(fields) + ['timestamp', 'id']))
+    where = []
+    params = []
+
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Unknown filter: {column}")
+        where.append(f"{column} = ?")
+        params.append(value)
+    if since:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append("timestamp < ?")
+        params.append(until)
+    if after:
+        where.append("(timestamp, id) < (?, ?)")
+        params.extend(after)
+
+    sql = f"SELECT {', '.join(columns)} FROM calls"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def fetch_calls_page(fields, limit=DEFAULT_PAGE_SIZE, **query):
+    """Return (rows as dicts limited to fields, next cursor or None)"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # One extra row tells us whether there is a next page
+    sql, params = build_calls_query(fields, limit=limit + 1, **query)
+    rows = db.query_all(sql, params)
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [{name: row[name] for name in fields} for row in rows[:limit]], next_cursor
+
+
+def iter_calls(fields, batch_size=STREAM_BATCH_SIZE, **query):
+    """Yield matching calls as dicts, reading in bounded batches"""
+    sql, params = build_calls_query(fields, **query)
+    cursor = db.get_connection().execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield {name: row[name] for name in fields}
+    finally:
+        cursor.close()
@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+import db
+import metrics
+import call_flow
+import transcript
+from logging_setup import set_call_sid, reset_call_sid
+
+logger = logging.getLogger(__name__)
+
+# Twilio CallStatus values sent once a call is over
+FINAL_CALL_STATUSES = ('completed', 'busy', 'failed', 'no-answer', 'canceled')
+
+# No webhook for this long means the caller is gone. By default the longest
+# <Record> or <Gather> in the call flow plus this margin for the prompts, so a
+# caller still recording or typing is never reaped.
+IDLE_TTL_MARGIN = 300
+IDLE_TTL_SECONDS = float(
+    os.getenv('CALL_IDLE_TTL_SECONDS')
+    or call_flow.longest_input_wait(call_flow.load_flow_definition()) + IDLE_TTL_MARGIN
+)
+# Sessions beyond this many are finalized least recently active first
+MAX_SESSIONS = int(os.getenv('CALL_SESSION_MAX', '10000'))
+REAPER_INTERVAL = float(os.getenv('CALL_REAPER_INTERVAL', '30'))
+# Sessions finalized per query, so one sweep never holds a long list in memory
+REAP_BATCH_SIZE = 500
+
+FINALIZED = metrics.counter(
+    'ivr_calls_abandoned_total', 'Calls that ended without completing the flow, by how they were found',
+    ('reason',))
+
+
+def finalize_abandoned_call(calls, call_sid, caller=None, reason='status_callback', call_status=None):
+    """Save what a call that never finished said as an abandoned call and free its session.
+
+    calls is the app's transcript.CallTranscripts. Returns False when the
+    session is already gone, e.g. the call completed normally or another
+    worker finalized it first.
+    """
+    if calls.pop(call_sid) is None:
+        return False
+
+    ended = f"Call ended ({call_status})" if call_status else f"Call ended ({reason})"
+    token = set_call_sid(call_sid)
+    try:
+        with db.transaction() as conn:
+            # OR IGNORE: a completed call's analysis row always wins over the partial transcript
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO calls (
+                    call_sid, caller_number, timestamp, customer_name, account_number,
+                    issue_type, issue_description, priority, status
+                ) VALUES (?, ?, ?, 'Unknown', 'Unknown', 'abandoned', ?, 'Low', 'abandoned')
+            ''', (call_sid, caller or 'Unknown', datetime.now().isoformat(),
+                  f"{ended} before the call flow finished"))
+            if cursor.rowcount:
+                segments = transcript.archive(conn, call_sid, None)
+                fields = transcript.flow_fields(segments)
+                conn.execute('''
+                    UPDATE calls SET
+                        transcript_preview = ?, transcript_length = ?,
+                        customer_name = ?, account_number = ?, priority = ?
+                    WHERE call_sid = ?
+                ''', (transcript.preview(segments), len(transcript.render(segments)),
+                      fields.get('customer_name', 'Unknown'), fields.get('account_number', 'Unknown'),
+                      fields.get('priority', 'Low'), call_sid))
+        FINALIZED.labels(reason).inc()
+        logger.info("Finalized abandoned call (%s)", reason)
+    except Exception:
+        # Reopen the session for the next sweep; its segments are still saved
+        calls.create(call_sid)
+        raise
+    finally:
+        reset_call_sid(token)
+    return True
+
+
+def reap_sessions(calls, idle_ttl=IDLE_TTL_SECONDS, max_sessions=MAX_SESSIONS):
+    """One sweep: finalize idle sessions, then the least recently active ones over the cap"""
+    reaped = {'idle': 0, 'evicted': 0}
+    idle_before = time.time() - idle_ttl
+    while True:
+        call_sids = calls.least_recent(REAP_BATCH_SIZE, idle_before=idle_before)
+        for call_sid in call_sids:
+            reaped['idle'] += finalize_abandoned_call(calls, call_sid, reason='idle')
+        if len(call_sids) < REAP_BATCH_SIZE:
+            break
+
+    excess = calls.count() - max_sessions
+    while excess > 0:
+        call_sids = calls.least_recent(min(excess, REAP_BATCH_SIZE))
+        if not call_sids:
+            break
+        for call_sid in call_sids:
+            reaped['evicted'] += finalize_abandoned_call(calls, call_sid, reason='evicted')
+        excess -= len(call_sids)
+    return reaped
+
+
+def start_reaper(calls, interval=REAPER_INTERVAL, idle_ttl=IDLE_TTL_SECONDS, max_sessions=MAX_SESSIONS):
+    """Sweep the session store in a daemon thread every interval seconds"""
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                reaped = reap_sessions(calls, idle_ttl, max_sessions)
+                if reaped['idle'] or reaped['evicted']:
+                    logger.info("Reaped %d idle and %d evicted call sessions", reaped['idle'], reaped['evicted'])
+            except Exception as e:
+                logger.error("Error reaping call sessions: %s", e)
+            finally:
+                db.release_connection()
+
+    threading.Thread(target=run, daemon=True, name="call-reaper").start()
+    return stop_event
@@ -0,0 +1,71 @@
+"""Report figures read from the daily rollup tables.
+
+Triggers on calls, caller_numbers and otp_verification keep the rollups
+current in the same transaction as each write (migration 10). Reading one
+costs one row per day, however many calls there are. The OTP figures only
+cover the SQLite OTP store.
+"""
+import db
+
+DEFAULT_DAYS = 7
+
+DAILY_VOLUME_SQL = '''
+    SELECT day AS call_date, calls AS call_count
+    FROM call_daily_stats
+    WHERE calls > 0
+    ORDER BY day DESC
+    LIMIT ?
+'''
+
+CONSENT_STATUS_SQL = '''
+    SELECT consent_status, SUM(calls) AS count,
+           ROUND(SUM(calls) * 100.0 / (SELECT SUM(calls) FROM call_daily_stats), 2) AS percentage
+    FROM consent_daily_stats
+    GROUP BY consent_status
+    HAVING SUM(calls) > 0
+'''
+
+CONSENT_TYPE_SQL = '''
+    SELECT consent_type, SUM(calls) AS count
+    FROM consent_daily_stats
+    GROUP BY consent_type
+    HAVING SUM(calls) > 0
+'''
+
+UNKNOWN_FIELDS_SQL = '''
+    SELECT IFNULL(SUM(unknown_names), 0) AS unknown_names,
+           IFNULL(SUM(unknown_accounts), 0) AS unknown_accounts,
+           IFNULL(SUM(unknown_consent), 0) AS unknown_consent
+    FROM call_daily_stats
+'''
+
+# unique_callers counts every caller number ever seen, including ones whose calls were since deleted
+TOTALS_SQL = '''
+    SELECT IFNULL(SUM(calls), 0) AS total_calls,
+           ROUND(SUM(transcript_chars) * 1.0 / NULLIF(SUM(transcripts), 0), 1) AS avg_transcript_length,
+           IFNULL(SUM(new_callers), 0) AS unique_callers
+    FROM call_daily_stats
+'''
+
+OTP_SQL = '''
+    SELECT IFNULL(SUM(issued), 0) AS total_otps,
+           IFNULL(SUM(verified), 0) AS verified_otps,
+           IFNULL(SUM(issued) - SUM(verified), 0) AS unverified_otps
+    FROM otp_daily_stats
+'''
+
+
+def rows(sql, params=()):
+    return [dict(row) for row in db.query_all(sql, params)]
+
+
+def summary(days=DEFAULT_DAYS):
+    """Everything view_db reports, as JSON-friendly data for /api/stats"""
+    return {
+        'totals': rows(TOTALS_SQL)[0],
+        'unknown_fields': rows(UNKNOWN_FIELDS_SQL)[0],
+        'daily_volume': rows(DAILY_VOLUME_SQL, (days,)),
+        'consent_status': rows(CONSENT_STATUS_SQL),
+        'consent_type': rows(CONSENT_TYPE_SQL),
+        'otp': rows(OTP_SQL)[0],
+    }
@@ -0,0 +1,191 @@
+"""Bulk consent export for downstream dialers: streamed, sharded and compressed.
+
+Records are read in bounded batches (CONSENT_EXPORT_BATCH_SIZE) and split
+across N shard files by crc32(account_number) % N, so each dialer can own a
+shard. A manifest with each file's row count, size and SHA-256 is written
+last; once it exists, every shard it lists is complete.
+
+    python consent_export.py --shards 8 --format gzip --output exports/
+
+Formats: text (the pipe-delimited dialer format), gzip, and parquet or
+arrow (Arrow IPC file) when the pyarrow package is installed.
+"""
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+
+import migrations
+from dialer_file_processor import (
+    HEADER, EXPORT_BATCH_SIZE, EXPORT_ROWS, WRITE_BUFFER_BYTES,
+    consent_fields, iter_consent_batches, timed_export
+)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Only needed for the parquet and arrow formats
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'text': '.txt', 'gzip': '.txt.gz', 'parquet': '.parquet', 'arrow': '.arrow'}
+COLUMNS = HEADER.strip().split('|')
+# Same text as dialer_file_processor.format_consent_line
+LINE_FORMAT = '|'.join(['%s'] * len(COLUMNS)) + '\n'
+
+
+def shard_for(account_number, shards):
+    """Stable across processes and runs, unlike hash()"""
+    return zlib.crc32(str(account_number).encode('utf-8')) % shards
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(WRITE_BUFFER_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TextShard:
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.rows = 0
+        if compress:
+            self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+        else:
+            self.file = open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES)
+        self.file.write(HEADER)
+
+    def write(self, rows):
+        self.file.write(''.join(LINE_FORMAT % row for row in rows))
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowShard:
+    """Buffers rows and writes them as one record batch or row group per batch_size rows"""
+
+    def __init__(self, path, parquet=False, batch_size=EXPORT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows = 0
+        self.pending = []
+        self.schema = pyarrow.schema([(name, pyarrow.string()) for name in COLUMNS])
+        if parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        self.pending.extend(rows)
+        self.rows += len(rows)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        columns = [[None if value is None else str(value) for value in column] for column in zip(*self.pending)]
+        self.writer.write_table(pyarrow.table(dict(zip(COLUMNS, columns)), schema=self.schema))
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_shard(path, fmt, batch_size=EXPORT_BATCH_SIZE):
+    if fmt in ('text', 'gzip'):
+        return TextShard(path, compress=fmt == 'gzip')
+    return ArrowShard(path, parquet=fmt == 'parquet', batch_size=batch_size)
+
+
+@timed_export('bulk')
+def export_consent_bulk(output_dir='.', shards=1, fmt='gzip', batch_size=EXPORT_BATCH_SIZE):
+    """Write the full consent export as shard files plus a manifest. Returns the manifest path."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt in ('parquet', 'arrow') and pyarrow is None:
+        raise RuntimeError(f"The pyarrow package is required for the {fmt} format")
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = f"consent_bulk_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    names = [f"{prefix}_{shard:03d}_of_{shards:03d}{FORMATS[fmt]}" for shard in range(shards)]
+    # Written as .tmp and renamed at the end, so dialers never read a half-written shard
+    writers = []
+    try:
+        for name in names:
+            writers.append(open_shard(os.path.join(output_dir, f"{name}.tmp"), fmt, batch_size))
+        for records in iter_consent_batches(batch_size):
+            grouped = [[] for _ in range(shards)]
+            for record in records:
+                grouped[shard_for(record[0], shards)].append(consent_fields(record))
+            for writer, rows in zip(writers, grouped):
+                if rows:
+                    writer.write(rows)
+        for writer in writers:
+            writer.close()
+    except BaseException:
+        # Remove every shard, even if closing one fails; the original error is the one raised
+        for writer in writers:
+            try:
+                writer.close()
+            except Exception as e:
+                logger.warning("Error closing %s: %s", writer.path, e)
+            try:
+                os.remove(writer.path)
+            except FileNotFoundError:
+                pass
+        raise
+
+    files = []
+    for shard, (name, writer) in enumerate(zip(names, writers)):
+        path = os.path.join(output_dir, name)
+        os.replace(writer.path, path)
+        files.append({
+            'name': name, 'shard': shard, 'rows': writer.rows,
+            'bytes': os.path.getsize(path), 'sha256': file_sha256(path)
+        })
+
+    total = sum(entry['rows'] for entry in files)
+    manifest = {
+        'created_at': datetime.now().isoformat(),
+        'format': fmt,
+        'columns': COLUMNS,
+        'shards': shards,
+        'sharding': 'crc32(Account_Number) % shards',
+        'total_rows': total,
+        'files': files,
+    }
+    manifest_path = os.path.join(output_dir, f"{prefix}_manifest.json")
+    with open(f"{manifest_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    EXPORT_ROWS.labels('bulk').inc(total)
+    logger.info("Exported %d consent records to %d %s shards, manifest %s", total, shards, fmt, manifest_path)
+    return manifest_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streamed, sharded bulk consent export for dialers")
+    parser.add_argument('--output', default='.', help="directory for the shard files and manifest")
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--format', choices=sorted(FORMATS), default='gzip')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    migrations.migrate()
+    print(export_consent_bulk(args.output, args.shards, args.format, args.batch_size))
@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv('CALL_DB_PATH', 'call_data.db')
+
+# Where sorts and temp b-trees go. The hot queries only build small ones; see
+# spill_to_disk() for the statements that sort a whole table
+TEMP_STORE = 'MEMORY'
+
+# Pragmas applied once per pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",      # WAL makes NORMAL crash-safe, no fsync per commit
+    "PRAGMA busy_timeout=5000",       # Wait for writers instead of raising 'database is locked'
+    "PRAGMA cache_size=-20000",       # ~20MB page cache per connection
+    f"PRAGMA temp_store={TEMP_STORE}",
+)
+
+# sqlite3 keeps compiled statements per connection keyed by SQL text,
+# so reusing connections also reuses prepared statements
+STATEMENT_CACHE_SIZE = 256
+
+QUERY_SECONDS = metrics.histogram(
+    'ivr_sqlite_query_seconds', 'SQLite statement latency by operation and table', ('operation', 'table'))
+# The table a statement reads or writes first, for the metric labels
+STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)', re.IGNORECASE)
+MAX_TIMED_STATEMENTS = 1024
+_query_timers = {}  # Format: {sql: histogram child}
+TRANSACTION_SECONDS = QUERY_SECONDS.labels('transaction', '')
+
+
+class ConnectionPool:
+    """Hands each thread its own connection and recycles them between threads"""
+
+    def __init__(self, path, max_idle=16):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with transaction()
+        conn = sqlite3.connect(
+            self.path,
+            timeout=5,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Give the calling thread's connection back to the pool"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        self.release()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = ConnectionPool(DB_PATH)
+
+
+def configure(path):
+    """Point the shared pool at another database file (used by scripts and benchmarks)"""
+    global _pool, DB_PATH
+    _pool.close_all()
+    DB_PATH = path
+    _pool = ConnectionPool(path)
+
+
+def get_connection():
+    return _pool.acquire()
+
+
+def release_connection():
+    _pool.release()
+
+
+def query_timer(sql):
+    """Histogram child for a statement, labelled once per distinct SQL text"""
+    timer = _query_timers.get(sql)
+    if timer is None:
+        words = sql.split(None, 1)
+        operation = words[0].lower() if words else ''
+        body_start = 0
+        if operation == 'with':
+            # CTEs: label by the statement that follows them
+            match = re.search(r'\)\s*(SELECT|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE)
+            if match:
+                operation, body_start = match.group(1).lower(), match.start(1)
+        table = STATEMENT_TABLE.search(sql, body_start)
+        timer = QUERY_SECONDS.labels(operation, table.group(1) if table else '')
+        if len(_query_timers) < MAX_TIMED_STATEMENTS:
+            _query_timers[sql] = timer
+    return timer
+
+
+def execute(sql, params=()):
+    start = time.perf_counter()
+    try:
+        return get_connection().execute(sql, params)
+    finally:
+        query_timer(sql).observe(time.perf_counter() - start)
+
+
+def query_one(sql, params=()):
+    start = time.perf_counter()
+    try:
+        return get_connection().execute(sql, params).fetchone()
+    finally:
+        query_timer(sql).observe(time.perf_counter() - start)
+
+
+def query_all(sql, params=()):
+    start = time.perf_counter()
+    try:
+        return get_connection().execute(sql, params).fetchall()
+    finally:
+        query_timer(sql).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def transaction():
+    """Run several statements atomically on the thread's pooled connection"""
+    conn = get_connection()
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        # Statements inside a transaction are timed together, including the wait for the write lock
+        TRANSACTION_SECONDS.observe(time.perf_counter() - start)
+
+
+@contextmanager
+def spill_to_disk():
+    """Statements run on the yielded connection sort in temp files, not RAM.
+
+    Past cache_size, SQLite writes a big sort out to temp files. With
+    temp_store=MEMORY those "files" are RAM too, and the process grows with
+    the table.
+    """
+    conn = get_connection()
+    conn.execute("PRAGMA temp_store=FILE")
+    try:
+        yield conn
+    finally:
+        conn.execute(f"PRAGMA temp_store={TEMP_STORE}")
@@ -1,83 +1,307 @@
-import sqlite3
 from datetime import datetime
 import os
 import glob
+import time
+import logging
+import threading
+import functools
+import itertools
+import db
+import metrics
+import migrations
 
-def generate_new_filename():
-    """Generate a new filename with timestamp"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return f'consent_data_{timestamp}.txt'
+logger = logging.getLogger(__name__)
 
-def process_consent_data():
-    """Process consent data and create a new file"""
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
-    
-    # Updated query to include customer_name from database
-    cursor.execute('''
-        SELECT DISTINCT 
+HEADER = "Account_Number|Phone_Number|Customer_Name|Consent_Type|Consent_Flag|Timestamp\n"
+
+# full: rewrite the whole export after every call, incremental: delta files + periodic compaction
+EXPORT_MODE = os.getenv('CONSENT_EXPORT_MODE', 'incremental').lower()
+COMPACTION_INTERVAL = float(os.getenv('CONSENT_COMPACTION_INTERVAL', '3600'))
+# Rows held in memory at a time by the full and bulk exports
+EXPORT_BATCH_SIZE = int(os.getenv('CONSENT_EXPORT_BATCH_SIZE', '5000'))
+WRITE_BUFFER_BYTES = 1 << 20
+
+EXPORT_SECONDS = metrics.histogram(
+    'ivr_consent_export_seconds', 'Consent export duration by mode (full, delta, compact, bulk)', ('mode',))
+EXPORT_ROWS = metrics.counter('ivr_consent_export_rows_total', 'Records written to consent exports', ('mode',))
+
+CONSENT_COLUMNS = '''
             account_number, 
             caller_number, 
             consent_status,
             consent_type,
             timestamp,
-            customer_name  -- Added customer_name field
-        FROM calls
+            customer_name'''
+
+CONSENT_FILTER = '''
         WHERE account_number != 'Unknown'
         AND caller_number != 'Unknown'
         AND consent_status IS NOT NULL
-        AND consent_type IS NOT NULL
-        ORDER BY timestamp DESC
-    ''')
+        AND consent_type IS NOT NULL'''
+
+def generate_new_filename():
+    """Generate a new filename with timestamp"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'consent_data_{timestamp}.txt'
+
+def generate_delta_filename(last_change):
+    """Delta files sort by creation time, the change number keeps names unique"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'consent_delta_{timestamp}_{last_change:012d}.txt'
+
+def consent_fields(record):
+    """The export columns of one record, in HEADER order"""
+    account_number = record[0]
+    phone_number = record[1]
+    consent_type = record[3]
+    consent_flag = '1' if record[2].lower() == 'opt-in' else '0'
+    timestamp = record[4]
+    customer_name = record[5] if record[5] != 'Unknown' else '' 
     
-    records = cursor.fetchall()
+    return (account_number, phone_number, customer_name, consent_type, consent_flag, timestamp)
+
+def format_consent_line(record):
+    account_number, phone_number, customer_name, consent_type, consent_flag, timestamp = consent_fields(record)
+    return f"{account_number}|{phone_number}|{customer_name}|{consent_type}|{consent_flag}|{timestamp}\n"
+
+def delta_last_change(filename):
+    """The change number a delta file's name ends with, see generate_delta_filename"""
+    return int(os.path.splitext(os.path.basename(filename))[0].rsplit('_', 1)[1])
+
+def iter_consent_batches(batch_size=EXPORT_BATCH_SIZE):
+    """The full export's records, batch_size at a time, so memory doesn't grow with the table.
+
+    Only the newest record of each account, phone number and consent type
+    is exported, the same as compacting the delta files gives.
+    """
+    # One statement, so the batches come from a single consistent WAL snapshot.
+    # It sorts every matching row, and that sort spills to disk, not memory.
+    with db.spill_to_disk() as conn:
+        cursor = conn.execute(f'''
+            SELECT {CONSENT_COLUMNS}
+            FROM (
+                SELECT {CONSENT_COLUMNS},
+                    ROW_NUMBER() OVER (
+                        PARTITION BY account_number, caller_number, consent_type
+                        ORDER BY timestamp DESC, change_seq DESC
+                    ) AS newest
+                FROM calls{CONSENT_FILTER}
+            )
+            WHERE newest = 1
+            ORDER BY timestamp DESC
+        ''')
+        try:
+            while True:
+                records = cursor.fetchmany(batch_size)
+                if not records:
+                    return
+                yield records
+        finally:
+            cursor.close()
+
+def write_consent_file(filename, lines):
+    """Write to a temp file and rename so dialers never read a half-written file"""
+    tmp_name = f"{filename}.tmp"
+    with open(tmp_name, 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES) as f:
+        f.write(HEADER)
+        f.writelines(lines)
+    os.replace(tmp_name, filename)
+
+def timed_export(mode):
+    """Record how long each run of an export function takes, whatever it returns"""
+    timer = EXPORT_SECONDS.labels(mode)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def get_export_state(name, default=0):
+    row = db.query_one("SELECT value FROM export_state WHERE name = ?", (name,))
+    return row[0] if row else default
+
+def write_full_export(filename, batches):
+    """Write the records of batches as an export file; returns how many there were"""
+    count = 0
+    def lines():
+        nonlocal count
+        for records in batches:
+            count += len(records)
+            yield ''.join(format_consent_line(record) for record in records)
     
-    if not records:
-        print("No consent records to process")
-        conn.close()
+    write_consent_file(filename, lines())
+    return count
+
+@timed_export('full')
+def process_consent_data():
+    """Process consent data and create a new file"""
+    batches = iter_consent_batches()
+    first = next(batches, None)
+    if first is None:
+        logger.info("No consent records to process")
         return
     
     filename = generate_new_filename()
-    print(f"Creating new file: {filename}")
+    logger.debug("Creating new file: %s", filename)
+    
+    count = write_full_export(filename, itertools.chain([first], batches))
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("Account_Number|Phone_Number|Customer_Name|Consent_Type|Consent_Flag|Timestamp\n")
+    EXPORT_ROWS.labels('full').inc(count)
+    logger.info("Created %s with %d records", filename, count)
+    return filename
+
+@timed_export('delta')
+def process_consent_delta():
+    """Export only consent records added or changed since the last run.
+
+    The high-water mark is calls.change_seq, which triggers bump on every
+    insert and on any update of an exported column (migration 11). The
+    upsert that saves a re-analysed call keeps its rowid, so the rowid
+    alone would miss it.
+    """
+    # The write lock keeps concurrent workers from exporting the same rows twice
+    with db.transaction() as conn:
+        watermark = int(get_export_state('consent_watermark'))
+        records = conn.execute(f'''
+            SELECT {CONSENT_COLUMNS}, change_seq
+            FROM calls{CONSENT_FILTER}
+            AND change_seq > ?
+            ORDER BY change_seq
+        ''', (watermark,)).fetchall()
         
-        for record in records:
-            account_number = record[0]
-            phone_number = record[1]
-            consent_type = record[3]
-            consent_flag = '1' if record[2].lower() == 'opt-in' else '0'
-            timestamp = record[4]
-            customer_name = record[5] if record[5] != 'Unknown' else '' 
-            
-            line = f"{account_number}|{phone_number}|{customer_name}|{consent_type}|{consent_flag}|{timestamp}\n"
-            f.write(line)
+        if not records:
+            logger.debug("No new consent records to process")
+            return
+        
+        last_change = records[-1]['change_seq']
+        filename = generate_delta_filename(last_change)
+        write_consent_file(filename, (format_consent_line(record) for record in records))
+        
+        conn.execute(
+            "INSERT OR REPLACE INTO export_state (name, value) VALUES ('consent_watermark', ?)",
+            (last_change,)
+        )
     
-    print(f"Created new file with {len(records)} records")
-    conn.close()
+    EXPORT_ROWS.labels('delta').inc(len(records))
+    logger.info("Created delta file %s with %d records", filename, len(records))
     return filename
 
+def latest_snapshot():
+    snapshots = sorted(glob.glob('consent_data_*.txt'))
+    return snapshots[-1] if snapshots else None
+
+@timed_export('compact')
+def compact_consent_exports():
+    """Rebuild the full snapshot from the database and remove the delta files it covers.
+
+    A rebuild rather than a merge of the deltas into the last snapshot: a
+    record that leaves the export (re-analysed to another consent type or
+    account) writes no delta line, so a merge would carry its old line
+    forward forever. The export streams, so a rebuild costs time, not
+    memory. Deltas with changes the rebuild didn't see are kept for the
+    next run.
+    """
+    # Read before the export starts, so every change up to it is in the new snapshot
+    covered = int(get_export_state('calls_change_seq'))
+    snapshot = latest_snapshot()
+    if snapshot and covered == get_export_state('consent_snapshot_seq', None):
+        logger.info("No consent changes to compact")
+        return
+    filename = generate_new_filename()
+    if filename == snapshot:
+        # Already compacted this second, the next run will pick up the changes
+        return
+    count = write_full_export(filename, iter_consent_batches())
+    db.execute(
+        "INSERT OR REPLACE INTO export_state (name, value) VALUES ('consent_snapshot_seq', ?)", (covered,)
+    )
+    
+    deltas = [delta for delta in glob.glob('consent_delta_*.txt') if delta_last_change(delta) <= covered]
+    for delta in deltas:
+        os.remove(delta)
+    
+    EXPORT_ROWS.labels('compact').inc(count)
+    logger.info("Compacted %d delta files into %s with %d records", len(deltas), filename, count)
+    return filename
+
+def try_compaction(interval=COMPACTION_INTERVAL):
+    """Compact if due. The conditional update lets only one worker win each interval."""
+    now = time.time()
+    with db.transaction() as conn:
+        last_run = conn.execute(
+            "SELECT value FROM export_state WHERE name = 'consent_compacted_at'"
+        ).fetchone()
+        if last_run and now - last_run[0] < interval:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO export_state (name, value) VALUES ('consent_compacted_at', ?)",
+            (now,)
+        )
+    return compact_consent_exports()
+
+def start_compaction_scheduler(interval=COMPACTION_INTERVAL):
+    """Run compaction in a daemon thread every interval seconds"""
+    stop_event = threading.Event()
+    
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                try_compaction(interval)
+            except Exception as e:
+                logger.exception("Error compacting consent exports: %s", e)
+            finally:
+                db.release_connection()
+    
+    threading.Thread(target=run, daemon=True, name="consent-compaction").start()
+    return stop_event
+
+def export_consent_updates():
+    """Export after a completed call using the configured CONSENT_EXPORT_MODE"""
+    if EXPORT_MODE == 'full':
+        return process_consent_data()
+    return process_consent_delta()
+
 def cleanup_old_files(keep_days=7):
     """Remove files older than specified days"""
     pattern = 'consent_data_*.txt'
     current_time = datetime.now()
+    # Never remove the newest snapshot, compaction builds on it
+    newest = latest_snapshot()
     
     for file in glob.glob(pattern):
+        if file == newest:
+            continue
         file_time = datetime.fromtimestamp(os.path.getctime(file))
         if (current_time - file_time).days > keep_days:
             try:
                 os.remove(file)
-                print(f"Removed old file: {file}")
+                logger.info("Removed old file: %s", file)
             except Exception as e:
-                print(f"Error removing {file}: {str(e)}")
+                logger.error("Error removing %s: %s", file, e)
 
 if __name__ == "__main__":
+    import sys
+    
+    # Plain progress lines on the console for manual runs
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     print("\n=== Consent Data Processor ===")
     print(f"Starting process at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
-        new_file = process_consent_data()
+        migrations.migrate()
+        
+        # --delta: export new records only, --compact: merge deltas into a snapshot
+        if '--delta' in sys.argv:
+            new_file = process_consent_delta()
+        elif '--compact' in sys.argv:
+            new_file = compact_consent_exports()
+        else:
+            new_file = process_consent_data()
         if new_file:
             print(f"\nMost recent entries from {new_file}:")
             with open(new_file, 'r', encoding='utf-8') as f:
@@ -0,0 +1,129 @@
+import re
+
+from llm_cache import CALL_SID_PATTERN
+
+FIELDS = ('customer_name', 'loan_number', 'consent_type', 'consent_status')
+
+# Transcript lines written by the IVR itself rather than spoken by the caller
+BOILERPLATE_PREFIXES = ('Client caller, using number:', 'No caller ID, using default:', 'Priority:')
+SPEAKER_LABEL = re.compile(r'^(?:User|Technical issue|Billing issue|Other issue):\s*')
+
+NAME_PATTERNS = (
+    (re.compile(r"\bmy name is ([a-z][a-z'.-]*(?: [a-z][a-z'.-]*){0,2})", re.IGNORECASE), 0.9),
+    (re.compile(r"\b(?:this is|i am|i'm) ([a-z][a-z'.-]*(?: [a-z][a-z'.-]*){0,2})", re.IGNORECASE), 0.6),
+)
+# Words that end a spoken name, or show "I am ..." wasn't a name at all
+NAME_STOP_WORDS = {
+    'and', 'my', 'i', 'calling', 'here', 'not', 'from', 'with', 'the', 'a', 'an',
+    'account', 'loan', 'number', 'looking', 'trying', 'having', 'speaking', 'to',
+    'want', 'would', 'like', 'interested', 'ok', 'okay', 'sorry', 'fine', 'good'
+}
+
+# Digits may be spoken with pauses: "4 8 2 1 3"
+DIGIT_RUN = r'\d(?:[\s-]?\d){3,}'
+LOAN_NUMBER_PATTERN = re.compile(
+    r'\b(?:loan|account)\s*(?:number|no\.?|#)?\s*(?:is|:)?\s*(' + DIGIT_RUN + ')', re.IGNORECASE
+)
+BARE_NUMBER_PATTERN = re.compile(DIGIT_RUN)
+
+CONSENT_TYPE_KEYWORDS = {
+    'email': re.compile(r'\b(?:e-?mails?|mail)\b', re.IGNORECASE),
+    'mobile': re.compile(r'\b(?:mobile|phone|cell|sms|text(?: message)?s?)\b', re.IGNORECASE),
+}
+
+OPT_IN_EXPLICIT = re.compile(r'\bopt(?:ing)?[\s-]?in\b', re.IGNORECASE)
+OPT_OUT_EXPLICIT = re.compile(r'\bopt(?:ing)?[\s-]?out\b', re.IGNORECASE)
+# Unambiguous ways of saying opt-in/opt-out without the words themselves
+OPT_IN_STRONG = re.compile(r'\b(?:subscribe me|i agree|i consent|sign me up)\b', re.IGNORECASE)
+OPT_OUT_STRONG = re.compile(
+    r"\b(?:unsubscribe|stop (?:sending|calling|texting|emailing)|remove me|(?:don'?t|do not) (?:call|text|email|contact))\b",
+    re.IGNORECASE
+)
+# Hints that usually mean opt-in/opt-out but depend on context
+OPT_IN_WEAK = re.compile(r'\b(?:subscribe|yes,? please|happy to receive|that\'s fine)\b', re.IGNORECASE)
+OPT_OUT_WEAK = re.compile(r'\b(?:no longer|not interested|stop)\b', re.IGNORECASE)
+
+
+def caller_speech(transcript):
+    """The caller's own words, without IVR boilerplate, CallSids or speaker labels"""
+    lines = []
+    for line in CALL_SID_PATTERN.sub('', transcript).splitlines():
+        line = line.strip()
+        if not line or line.startswith(BOILERPLATE_PREFIXES):
+            continue
+        lines.append(SPEAKER_LABEL.sub('', line))
+    return '\n'.join(lines)
+
+
+def extract_name(text):
+    for pattern, confidence in NAME_PATTERNS:
+        for match in pattern.finditer(text):
+            words = []
+            for word in match.group(1).split():
+                if word.lower() in NAME_STOP_WORDS:
+                    break
+                words.append(word.capitalize())
+            if words:
+                return ' '.join(words), confidence
+    return 'Unknown', 0.0
+
+
+def extract_loan_number(text):
+    match = LOAN_NUMBER_PATTERN.search(text)
+    if match:
+        return re.sub(r'\D', '', match.group(1)), 0.95
+    numbers = {re.sub(r'\D', '', found) for found in BARE_NUMBER_PATTERN.findall(text)}
+    if len(numbers) == 1:
+        return numbers.pop(), 0.6
+    if numbers:
+        # Several candidates, let the LLM decide
+        return max(numbers, key=len), 0.3
+    return 'Unknown', 0.0
+
+
+def extract_consent_type(text):
+    found = [consent_type for consent_type, pattern in CONSENT_TYPE_KEYWORDS.items() if pattern.search(text)]
+    if len(found) == 1:
+        return found[0], 0.9
+    if found:
+        return found[0], 0.4
+    return 'Unknown', 0.0
+
+
+def extract_consent_status(text):
+    explicit_in = bool(OPT_IN_EXPLICIT.search(text))
+    explicit_out = bool(OPT_OUT_EXPLICIT.search(text))
+    if explicit_in != explicit_out:
+        return ('Opt-in' if explicit_in else 'Opt-out'), 0.95
+    if explicit_in and explicit_out:
+        # "opt out of calls but opt in to email" needs the LLM
+        return 'Unknown', 0.0
+
+    for opt_in, opt_out, confidence in ((OPT_IN_STRONG, OPT_OUT_STRONG, 0.85), (OPT_IN_WEAK, OPT_OUT_WEAK, 0.5)):
+        found_in = bool(opt_in.search(text))
+        found_out = bool(opt_out.search(text))
+        if found_in != found_out:
+            return ('Opt-in' if found_in else 'Opt-out'), confidence
+        if found_in:
+            break
+    return 'Unknown', 0.0
+
+
+def extract_fields(transcript):
+    """Return {field: (value, confidence)} for every field in FIELDS"""
+    text = caller_speech(transcript)
+    return {
+        'customer_name': extract_name(text),
+        'loan_number': extract_loan_number(text),
+        'consent_type': extract_consent_type(text),
+        'consent_status': extract_consent_status(text),
+    }
+
+
+def min_confidence(fields):
+    return min(confidence for _, confidence in fields.values())
+
+
+def confident_values(fields, threshold):
+    """Field values, with anything below threshold reported as Unknown"""
+    return {name: (value if confidence >= threshold else 'Unknown') for name, (value, confidence) in fields.items()}
@@ -0,0 +1,349 @@
+import os
+import time
+import random
+import socket
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+
+import db
+import metrics
+import migrations
+import transcript
+from logging_setup import configure_logging, set_call_sid, reset_call_sid
+from ai_service import analyze_transcript_with_llm
+from dialer_file_processor import export_consent_updates
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv('ANALYSIS_MAX_ATTEMPTS', '5'))
+RETRY_BASE_SECONDS = float(os.getenv('ANALYSIS_RETRY_BASE_SECONDS', '5'))
+RETRY_MAX_SECONDS = float(os.getenv('ANALYSIS_RETRY_MAX_SECONDS', '300'))
+POLL_INTERVAL = float(os.getenv('ANALYSIS_POLL_INTERVAL', '1'))
+# A job stuck in 'running' this long belonged to a worker that died
+STALE_AFTER_SECONDS = float(os.getenv('ANALYSIS_STALE_AFTER_SECONDS', '600'))
+# How often the pool's supervisor requeues stale jobs, purges old ones and replaces dead workers
+SUPERVISE_INTERVAL = float(os.getenv('ANALYSIS_SUPERVISE_INTERVAL', '30'))
+# Done and failed jobs are deleted this many days after they finished
+JOB_RETENTION_DAYS = float(os.getenv('ANALYSIS_JOB_RETENTION_DAYS', '7'))
+# Rows deleted per purge transaction, so workers aren't locked out for long
+PURGE_BATCH_SIZE = 1000
+
+# Lets in-process thread workers pick up new jobs without waiting a poll interval
+_wakeup = threading.Event()
+
+
+def enqueue_analysis(call_sid, caller_number, transcript):
+    """Persist an analysis job for a completed call and return its id"""
+    now = time.time()
+    cursor = db.execute('''
+        INSERT INTO analysis_jobs (
+            call_sid, caller_number, transcript, status, attempts,
+            max_attempts, next_run_at, created_at, updated_at
+        ) VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?)
+    ''', (call_sid, caller_number, transcript, MAX_ATTEMPTS, now, now, now))
+    _wakeup.set()
+    return cursor.lastrowid
+
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest due job to 'running' for this worker"""
+    now = time.time()
+    # fetchall so the UPDATE ... RETURNING statement finishes and its write commits
+    rows = db.query_all('''
+        UPDATE analysis_jobs
+        SET status = 'running', attempts = attempts + 1, locked_by = ?, updated_at = ?
+        WHERE id = (
+            SELECT id FROM analysis_jobs
+            WHERE status = 'queued' AND next_run_at <= ?
+            ORDER BY next_run_at
+            LIMIT 1
+        )
+        RETURNING *
+    ''', (worker_id, now, now))
+    return rows[0] if rows else None
+
+
+def complete_job(job_id):
+    # The transcript now lives in transcript_archives
+    db.execute(
+        "UPDATE analysis_jobs SET status = 'done', transcript = NULL, locked_by = NULL, last_error = NULL, "
+        "updated_at = ? WHERE id = ?",
+        (time.time(), job_id)
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with full jitter"""
+    delay = min(RETRY_BASE_SECONDS * (2 ** (attempts - 1)), RETRY_MAX_SECONDS)
+    return random.uniform(delay / 2, delay)
+
+
+def fail_job(job, error):
+    """Reschedule a failed job, or mark it failed once it is out of attempts"""
+    now = time.time()
+    if job['attempts'] >= job['max_attempts']:
+        db.execute(
+            "UPDATE analysis_jobs SET status = 'failed', locked_by = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+            (error, now, job['id'])
+        )
+        return
+    db.execute(
+        "UPDATE analysis_jobs SET status = 'queued', locked_by = NULL, last_error = ?, next_run_at = ?, updated_at = ? WHERE id = ?",
+        (error, now + retry_delay(job['attempts']), now, job['id'])
+    )
+
+
+def requeue_stale_jobs():
+    """Put back jobs left 'running' by a crashed worker, or mark them failed once out of attempts.
+
+    Returns (requeued, failed) counts.
+    """
+    now = time.time()
+    # A job that kills or hangs its worker every time would otherwise be retried forever
+    rows = db.query_all('''
+        UPDATE analysis_jobs
+        SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            last_error = CASE WHEN attempts >= max_attempts THEN 'worker died or hung running the job'
+                              ELSE last_error END,
+            locked_by = NULL, next_run_at = ?, updated_at = ?
+        WHERE status = 'running' AND updated_at < ?
+        RETURNING status
+    ''', (now, now, now - STALE_AFTER_SECONDS))
+    failed = sum(1 for row in rows if row['status'] == 'failed')
+    return len(rows) - failed, failed
+
+
+def purge_finished_jobs(retention_days=None):
+    """Delete done and failed jobs that finished more than retention_days ago, returning the count"""
+    if retention_days is None:
+        retention_days = JOB_RETENTION_DAYS
+    cutoff = time.time() - retention_days * 86400
+    purged = 0
+    while True:
+        cursor = db.execute('''
+            DELETE FROM analysis_jobs WHERE id IN (
+                SELECT id FROM analysis_jobs
+                WHERE status IN ('done', 'failed') AND updated_at < ?
+                LIMIT ?
+            )
+        ''', (cutoff, PURGE_BATCH_SIZE))
+        purged += cursor.rowcount
+        if cursor.rowcount < PURGE_BATCH_SIZE:
+            return purged
+
+
+def known(value):
+    return value if value not in (None, '', 'Unknown') else None
+
+
+def save_call_analysis(call_sid, caller, text, analysis):
+    with db.transaction() as conn:
+        # The transcript is stored once, compressed; calls only keeps a preview
+        segments = transcript.archive(conn, call_sid, text)
+        fields = transcript.flow_fields(segments)
+        # Insert or update the call record. An upsert rather than INSERT OR REPLACE,
+        # whose implicit delete would skip the rollup triggers (migration 10).
+        conn.execute('''
+            INSERT INTO calls (
+                call_sid,
+                caller_number,
+                timestamp,
+                transcript_preview,
+                transcript_length,
+                customer_name,
+                account_number,
+                issue_type,
+                issue_description,
+                priority,
+                status,
+                consent_type,
+                consent_status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (call_sid) DO UPDATE SET
+                caller_number = excluded.caller_number,
+                timestamp = excluded.timestamp,
+                transcript_preview = excluded.transcript_preview,
+                transcript_length = excluded.transcript_length,
+                customer_name = excluded.customer_name,
+                account_number = excluded.account_number,
+                issue_type = excluded.issue_type,
+                issue_description = excluded.issue_description,
+                priority = excluded.priority,
+                status = excluded.status,
+                consent_type = excluded.consent_type,
+                consent_status = excluded.consent_status
+        ''', (
+            call_sid,
+            caller,
+            datetime.now().isoformat(),
+            transcript.preview(segments),
+            len(transcript.render(segments)),
+            # A name said on its own is only used when the LLM found none, but the flow's billing
+            # account answer beats an account number the LLM picked out of the whole call
+            known(analysis.get('customer_name')) or fields.get('customer_name', 'Unknown'),
+            known(fields.get('account_number')) or analysis.get('loan_number', 'Unknown'),
+            'consent',
+            fields.get('issue_description'),
+            fields.get('priority', 'Low'),
+            'new',
+            analysis.get('consent_type', 'Unknown'),
+            analysis.get('consent_status', 'Unknown')
+        ))
+
+
+def process_analysis_job(job):
+    """Analyze the transcript, store the call and refresh the consent export"""
+    # Let LLM errors bubble up for a retry, but settle for the fallback on the last attempt
+    last_attempt = job['attempts'] >= job['max_attempts']
+    analysis = analyze_transcript_with_llm(job['transcript'], fallback_on_error=last_attempt)
+    logger.debug("LLM analysis: %s", analysis)
+
+    save_call_analysis(job['call_sid'], job['caller_number'], job['transcript'], analysis)
+    logger.info("Saved call data for job %s", job['id'])
+
+    # Process consent data and update file
+    try:
+        export_consent_updates()
+    except Exception as e:
+        logger.exception("Error processing consent data: %s", e)
+
+
+def run_worker(stop_event, worker_id=None):
+    """Claim and process jobs until stop_event is set"""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    # Worker processes start from a fresh interpreter: set up logging and metrics there too
+    configure_logging()
+    migrations.migrate()
+    metrics.start_publisher()
+
+    while not stop_event.is_set():
+        job = claim_next_job(worker_id)
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        token = set_call_sid(job['call_sid'])
+        try:
+            process_analysis_job(job)
+            complete_job(job['id'])
+        except Exception as e:
+            logger.warning("Analysis job %s failed (attempt %s): %s", job['id'], job['attempts'], e)
+            fail_job(job, str(e))
+        finally:
+            reset_call_sid(token)
+
+    db.release_connection()
+
+
+class WorkerPool:
+    """Background analysis workers, either threads in this process or separate processes"""
+
+    def __init__(self, mode='thread', size=2, supervise_interval=SUPERVISE_INTERVAL):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.mode = mode
+        self.size = size
+        self.supervise_interval = supervise_interval
+        self.workers = []
+        self._supervisor = None
+        if mode == 'process':
+            # spawn so children don't inherit this process's sqlite connections
+            self._context = multiprocessing.get_context('spawn')
+            self.stop_event = self._context.Event()
+        else:
+            self.stop_event = threading.Event()
+
+    def _start_worker(self, i):
+        if self.mode == 'process':
+            worker = self._context.Process(target=run_worker, args=(self.stop_event,), daemon=True,
+                                           name=f"analysis-worker-{i}")
+        else:
+            worker = threading.Thread(target=run_worker, args=(self.stop_event,), daemon=True,
+                                      name=f"analysis-worker-{i}")
+        worker.start()
+        return worker
+
+    def start(self):
+        requeue_stale_jobs()
+        self.workers = [self._start_worker(i) for i in range(self.size)]
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True, name="analysis-supervisor")
+        self._supervisor.start()
+        return self
+
+    def _supervise(self):
+        """Requeue jobs whose worker died mid-job, purge old finished jobs and replace dead workers,
+        until the pool stops"""
+        while not self.stop_event.wait(self.supervise_interval):
+            try:
+                requeued, failed = requeue_stale_jobs()
+                if requeued:
+                    logger.warning("Requeued %d stale analysis jobs", requeued)
+                if failed:
+                    logger.error("Failed %d stale analysis jobs that were out of attempts", failed)
+                purged = purge_finished_jobs()
+                if purged:
+                    logger.info("Purged %d finished analysis jobs", purged)
+                for i, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        logger.error("Analysis worker %s exited, starting a replacement", worker.name)
+                        self.workers[i] = self._start_worker(i)
+            except Exception as e:
+                logger.error("Error supervising analysis workers: %s", e)
+            finally:
+                db.release_connection()
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        _wakeup.set()
+        # The supervisor first, so it can't start a replacement while the workers wind down
+        if self._supervisor is not None:
+            self._supervisor.join(timeout)
+            self._supervisor = None
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+
+def start_worker_pool():
+    """Start the pool configured by ANALYSIS_WORKER_MODE / ANALYSIS_WORKERS, or None when off"""
+    mode = os.getenv('ANALYSIS_WORKER_MODE', 'thread').lower()
+    if mode == 'off':
+        return None
+    return WorkerPool(mode, int(os.getenv('ANALYSIS_WORKERS', '2'))).start()
+
+
+def queue_stats():
+    rows = db.query_all("SELECT status, COUNT(*) AS count FROM analysis_jobs GROUP BY status")
+    counts = {status: 0 for status in ('queued', 'running', 'done', 'failed')}
+    counts.update({row['status']: row['count'] for row in rows})
+
+    oldest = db.query_one("SELECT MIN(created_at) FROM analysis_jobs WHERE status IN ('queued', 'running')")[0]
+    return {
+        'depth': counts['queued'] + counts['running'],
+        'by_status': counts,
+        'oldest_pending_age_seconds': round(time.time() - oldest, 1) if oldest else 0
+    }
+
+
+def get_job(job_id):
+    row = db.query_one(
+        "SELECT id, call_sid, status, attempts, max_attempts, next_run_at, last_error, created_at, updated_at "
+        "FROM analysis_jobs WHERE id = ?",
+        (job_id,)
+    )
+    return dict(row) if row else None
+
+
+if __name__ == "__main__":
+    # Dedicated worker process, for deployments running with ANALYSIS_WORKER_MODE=off
+    configure_logging()
+    logger.info("Analysis worker starting")
+    migrations.migrate()
+    requeue_stale_jobs()
+    try:
+        run_worker(threading.Event())
+    except KeyboardInterrupt:
+        logger.info("Worker stopped")
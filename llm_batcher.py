@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCHES = metrics.counter('ivr_llm_batches_total', 'Batched LLM requests sent, by outcome (ok, failed)', ('outcome',))
+BATCH_ITEMS = metrics.counter(
+    'ivr_llm_batch_items_total', 'Items through the batcher, by how they were answered (batched, single)', ('answer',))
+BATCH_OK, BATCH_FAILED = BATCHES.labels('ok'), BATCHES.labels('failed')
+ITEMS_BATCHED, ITEMS_SINGLE = BATCH_ITEMS.labels('batched'), BATCH_ITEMS.labels('single')
+
+
+class MicroBatcher:
+    """Collects items submitted from many threads and hands them to
+    process_batch in groups of up to max_size, waiting at most `window`
+    seconds for a group to fill.
+
+    process_batch(items) returns one result per item, None for any item it
+    could not answer. A future resolving to None tells the caller to send
+    that item on its own; lone items are never batched.
+    """
+
+    def __init__(self, process_batch, window=0.05, max_size=8, concurrency=4):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_size = max_size
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='llm-batch')
+        self._pending = []  # Format: [(item, future)]
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, item):
+        future = Future()
+        with self._cond:
+            self._pending.append((item, future))
+            # Started on first use so spawned worker processes get their own thread
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name='llm-batcher', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+            # Flush on the pool so the next batch can fill while this one is in flight
+            self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        if len(batch) == 1:
+            ITEMS_SINGLE.inc()
+            batch[0][1].set_result(None)
+            return
+
+        try:
+            results = self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"expected {len(batch)} results, got {len(results)}")
+        except Exception as e:
+            logger.warning("LLM batch of %d failed, sending singly: %s", len(batch), e)
+            results = [None] * len(batch)
+            BATCH_FAILED.inc()
+        else:
+            BATCH_OK.inc()
+
+        answered = sum(result is not None for result in results)
+        ITEMS_BATCHED.inc(answered)
+        ITEMS_SINGLE.inc(len(batch) - answered)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self, samples):
+        """This batcher's settings, and the figures of deployment_samples() as /metrics reports them"""
+        batches = {values[0]: value for values, value in samples[BATCHES.name].items()}
+        items = {values[0]: value for values, value in samples[BATCH_ITEMS.name].items()}
+        sent = batches.get('ok', 0) + batches.get('failed', 0)
+        return {
+            'batches': sent,
+            'batched_items': items.get('batched', 0),
+            'avg_batch_size': round(items.get('batched', 0) / sent, 2) if sent else 0.0,
+            'single_requests': items.get('single', 0),
+            'failed_batches': batches.get('failed', 0),
+            'window_ms': round(self.window * 1000, 1),
+            'max_size': self.max_size
+        }
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import db
+import metrics
+
+# Twilio CallSids differ on every call and would defeat the cache
+CALL_SID_PATTERN = re.compile(r'CA[0-9a-f]{32}', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+PURGE_EVERY_WRITES = 100
+
+CACHE_LOOKUPS = metrics.counter(
+    'ivr_llm_cache_lookups_total', 'Analysis cache lookups by result (memory_hit, sqlite_hit, miss)', ('result',))
+CACHE_SAVED_SECONDS = metrics.counter(
+    'ivr_llm_cache_saved_seconds_total', 'LLM latency the analysis cache saved, as the cached calls took')
+CACHE_ENTRIES = metrics.gauge('ivr_llm_cache_memory_entries', 'Analyses held in the in-process LRUs')
+MEMORY_HITS, SQLITE_HITS, MISSES = (CACHE_LOOKUPS.labels(result) for result in ('memory_hit', 'sqlite_hit', 'miss'))
+
+
+def normalize_transcript(transcript):
+    text = CALL_SID_PATTERN.sub(' ', transcript)
+    return WHITESPACE_PATTERN.sub(' ', text).strip().lower()
+
+
+def cache_key(transcript, prompt_version, model_name):
+    payload = f"{prompt_version}\n{model_name}\n{normalize_transcript(transcript)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """In-process LRU in front of the llm_cache table shared by all workers"""
+
+    def __init__(self, max_entries=1024, ttl=86400, persistent=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self._entries = OrderedDict()  # Format: {key: (expires_at, analysis, latency)}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _remember(self, key, expires_at, analysis, latency):
+        with self._lock:
+            self._entries[key] = (expires_at, analysis, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def get(self, key):
+        """Return a copy of the cached analysis, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                MEMORY_HITS.inc()
+                CACHE_SAVED_SECONDS.inc(entry[2])
+                return dict(entry[1])
+            if entry:
+                del self._entries[key]
+                CACHE_ENTRIES.set(len(self._entries))
+
+        if self.persistent:
+            row = db.query_one(
+                "SELECT value, latency, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            )
+            if row:
+                analysis = json.loads(row['value'])
+                self._remember(key, row['expires_at'], analysis, row['latency'])
+                SQLITE_HITS.inc()
+                CACHE_SAVED_SECONDS.inc(row['latency'])
+                return dict(analysis)
+
+        MISSES.inc()
+        return None
+
+    def set(self, key, analysis, latency):
+        """Store an analysis along with how long the LLM took to produce it"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, dict(analysis), latency)
+        if self.persistent:
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, latency, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(analysis), latency, expires_at)
+            )
+            # Keep the table bounded without a separate purge thread
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                self.purge_expired()
+
+    def purge_expired(self):
+        if not self.persistent:
+            return 0
+        return db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+def cache_stats(samples):
+    """The cache figures of deployment_samples(), as /metrics reports them"""
+    lookups = {values[0]: value for values, value in samples[CACHE_LOOKUPS.name].items()}
+    hits = lookups.get('memory_hit', 0) + lookups.get('sqlite_hit', 0)
+    total = hits + lookups.get('miss', 0)
+    return {
+        'memory_hits': lookups.get('memory_hit', 0),
+        'sqlite_hits': lookups.get('sqlite_hit', 0),
+        'misses': lookups.get('miss', 0),
+        'hit_rate': round(hits / total, 3) if total else 0.0,
+        'llm_calls_saved': hits,
+        'latency_saved_seconds': round(samples[CACHE_SAVED_SECONDS.name].get((), 0), 3),
+        'memory_entries': samples[CACHE_ENTRIES.name].get((), 0)
+    }
+
+
+def create_analysis_cache():
+    return AnalysisCache(
+        max_entries=int(os.getenv('LLM_CACHE_SIZE', '1024')),
+        ttl=int(os.getenv('LLM_CACHE_TTL', '86400')),
+        persistent=os.getenv('LLM_CACHE_PERSISTENT', 'true').lower() == 'true'
+    )
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import google.generativeai as genai
+from google.generativeai.types import GenerationConfig
+
+import metrics
+
+# Upper bounds in seconds of a single Gemini request
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CIRCUIT_STATES = ('closed', 'open', 'half_open')
+
+GEMINI_SECONDS = metrics.histogram(
+    'ivr_gemini_request_seconds', 'Gemini generate() latency, including queueing and hedges, by outcome',
+    ('outcome',))
+GEMINI_ATTEMPT_SECONDS = metrics.histogram(
+    'ivr_gemini_attempt_seconds', 'Latency of each Gemini request that got a reply, hedges included',
+    buckets=LATENCY_BUCKETS)
+GEMINI_HEDGES = metrics.counter('ivr_gemini_hedges_total', 'Hedged Gemini requests sent')
+GEMINI_HEDGE_WINS = metrics.counter('ivr_gemini_hedge_wins_total', 'Gemini calls the hedged request answered first')
+CIRCUIT_OPENED = metrics.counter('ivr_gemini_circuit_opened_total', 'Times the Gemini circuit breaker tripped')
+CIRCUIT_STATE = metrics.gauge(
+    'ivr_gemini_circuit_state', 'Processes whose Gemini circuit is closed, open or half_open (trial call in flight)',
+    ('state',))
+# generate() outcome label -> stats() counter
+OUTCOME_COUNTERS = {
+    'success': 'successes', 'error': 'errors', 'timeout': 'timeouts',
+    'short_circuited': 'short_circuited', 'rejected': 'rejected'
+}
+OUTCOME_TIMERS = {outcome: GEMINI_SECONDS.labels(outcome) for outcome in OUTCOME_COUNTERS}
+
+
+class LLMUnavailableError(Exception):
+    """The request was not sent because the circuit is open or no slot freed up in time"""
+
+
+class LLMTimeoutError(Exception):
+    """No reply arrived before the per-call deadline"""
+
+
+class CircuitBreaker:
+    """Opens when the failure rate over the last `window` calls reaches `threshold`.
+
+    After `cooldown` seconds one trial call is let through (half-open); it
+    closes the circuit on success and reopens it on failure.
+
+    allow() hands out a token that record() and cancel() take back. Every
+    open and close starts a new generation, and an outcome is only applied
+    if its token is from the current one, so a call sent before the circuit
+    tripped can neither close it nor start a second trial.
+    """
+
+    def __init__(self, window=20, min_calls=10, threshold=0.5, cooldown=30.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)  # True for success
+        self._opened_at = None
+        self._generation = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        publish_circuit_state('closed')
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """A token for record() or cancel(), or None if the call must not be sent"""
+        with self._lock:
+            if self._opened_at is None:
+                return (self._generation, False)
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial_running:
+                return None
+            self._trial_running = True
+            publish_circuit_state('half_open')
+            return (self._generation, True)
+
+    def _is_trial(self, token):
+        return self._trial_running and token == (self._generation, True)
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._generation += 1
+        publish_circuit_state('open')
+
+    def cancel(self, token):
+        """A call that was allowed through but never sent"""
+        with self._lock:
+            if self._is_trial(token):
+                self._trial_running = False
+                publish_circuit_state('open')
+
+    def record(self, success, token):
+        with self._lock:
+            if token[0] != self._generation:
+                # Sent before the circuit last opened or closed; says nothing about it now
+                return
+            if self._opened_at is not None:
+                if not self._is_trial(token):
+                    return
+                self._trial_running = False
+                if success:
+                    self._opened_at = None
+                    self._generation += 1
+                    self._outcomes.clear()
+                    publish_circuit_state('closed')
+                else:
+                    self._open()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+                self._open()
+                CIRCUIT_OPENED.inc()
+
+
+def publish_circuit_state(state):
+    for name in CIRCUIT_STATES:
+        CIRCUIT_STATE.labels(name).set(1 if name == state else 0)
+
+
+class LLMClient:
+    """Long-lived Gemini client with deadlines, a concurrency cap, a circuit
+    breaker and optional hedged requests."""
+
+    def __init__(self, model_name, timeout=15.0, max_in_flight=8, hedge_after=None,
+                 breaker=None, temperature=0.7):
+        self.model_name = model_name
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.temperature = temperature
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+        # Room for a hedge next to every primary request
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight * 2, thread_name_prefix='llm')
+        self._models = {}  # Format: {(max_output_tokens, schema json): GenerativeModel}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, model_name):
+        hedge_after_ms = float(os.getenv('LLM_HEDGE_AFTER_MS', '0'))
+        return cls(
+            model_name,
+            timeout=float(os.getenv('LLM_TIMEOUT_SECONDS', '15')),
+            max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '8')),
+            hedge_after=hedge_after_ms / 1000 if hedge_after_ms > 0 else None,
+            breaker=CircuitBreaker(
+                window=int(os.getenv('LLM_BREAKER_WINDOW', '20')),
+                threshold=float(os.getenv('LLM_BREAKER_THRESHOLD', '0.5')),
+                cooldown=float(os.getenv('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+            )
+        )
+
+    def _finish(self, outcome, start):
+        OUTCOME_TIMERS[outcome].observe(time.perf_counter() - start)
+
+    def model(self, max_output_tokens, response_schema=None):
+        """GenerativeModel for this output budget and schema, built once and reused"""
+        key = (max_output_tokens, json.dumps(response_schema, sort_keys=True) if response_schema else None)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                config = {
+                    'temperature': self.temperature,
+                    'max_output_tokens': max_output_tokens,
+                    'top_p': 1,
+                    'top_k': 1
+                }
+                if response_schema:
+                    # Gemini constrains decoding to the schema, so replies always parse
+                    config['response_mime_type'] = 'application/json'
+                    config['response_schema'] = response_schema
+                model = genai.GenerativeModel(
+                    model_name=self.model_name,
+                    generation_config=GenerationConfig(**config)
+                )
+                self._models[key] = model
+            return model
+
+    def _attempt(self, model, prompt, timeout):
+        """Runs on the executor and gives its slot back when the request finishes"""
+        start = time.perf_counter()
+        try:
+            text = model.generate_content(prompt, request_options={'timeout': timeout}).text
+            GEMINI_ATTEMPT_SECONDS.observe(time.perf_counter() - start)
+            return text
+        finally:
+            self._slots.release()
+
+    def generate(self, prompt, max_output_tokens=1000, response_schema=None):
+        """Return the reply text. Raises LLMUnavailableError, LLMTimeoutError or the API error."""
+        start = time.perf_counter()
+        token = self.breaker.allow()
+        if token is None:
+            self._finish('short_circuited', start)
+            raise LLMUnavailableError("circuit open")
+
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            self._finish('rejected', start)
+            # Local congestion says nothing about Gemini's health
+            self.breaker.cancel(token)
+            raise LLMUnavailableError(f"{self.max_in_flight} requests already in flight")
+
+        model = self.model(max_output_tokens, response_schema)
+        # Time spent waiting for a slot counts against the deadline
+        primary = self._executor.submit(self._attempt, model, prompt, max(deadline - time.monotonic(), 0.1))
+        attempts = [primary]
+        if self.hedge_after is not None:
+            done, _ = wait(attempts, timeout=self.hedge_after)
+            # Hedge only with a spare slot, never by queueing behind other calls
+            if not done and self._slots.acquire(blocking=False):
+                GEMINI_HEDGES.inc()
+                remaining = max(deadline - time.monotonic(), 0.1)
+                attempts.append(self._executor.submit(self._attempt, model, prompt, remaining))
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    self._finish('success', start)
+                    if future is not primary:
+                        GEMINI_HEDGE_WINS.inc()
+                    self.breaker.record(True, token)
+                    return future.result()
+                error = future.exception()
+
+        self.breaker.record(False, token)
+        if pending:
+            self._finish('timeout', start)
+            raise LLMTimeoutError(f"no reply within {self.timeout}s")
+        self._finish('error', start)
+        raise error
+
+    def stats(self):
+        """This client's settings, and the deployment's figures as /metrics reports them"""
+        samples = metrics.deployment_samples()
+        outcomes = {values[0]: sum(counts) for values, (counts, _) in samples[GEMINI_SECONDS.name].items()}
+        counters = {name: outcomes.get(outcome, 0) for outcome, name in OUTCOME_COUNTERS.items()}
+        # Sent to Gemini, i.e. not short-circuited or rejected locally
+        counters['requests'] = counters['successes'] + counters['errors'] + counters['timeouts']
+        counters['hedges'] = samples[GEMINI_HEDGES.name].get((), 0)
+        counters['hedge_wins'] = samples[GEMINI_HEDGE_WINS.name].get((), 0)
+        circuits = {values[0]: value for values, value in samples[CIRCUIT_STATE.name].items()}
+        return {
+            'counters': counters,
+            'latency_seconds': metrics.histogram_summary(
+                GEMINI_ATTEMPT_SECONDS, samples[GEMINI_ATTEMPT_SECONDS.name].get(())),
+            # How many processes' circuits are in each state
+            'circuit': {state: circuits.get(state, 0) for state in CIRCUIT_STATES},
+            'circuit_opened': samples[CIRCUIT_OPENED.name].get((), 0),
+            'max_in_flight': self.max_in_flight,
+            'timeout_seconds': self.timeout,
+            'hedge_after_ms': round(self.hedge_after * 1000) if self.hedge_after else None
+        }
@@ -0,0 +1,150 @@
+"""Process-wide logging: JSON lines written by a background thread.
+
+configure_logging() runs once at startup. Loggers hand records to a bounded
+queue and return; a QueueListener thread formats and writes them, so a slow
+stdout never adds to a webhook's response time. When the queue is full,
+records are dropped and counted rather than blocking the caller.
+
+Records carry the CallSid of the call being handled (set_call_sid), and
+DEBUG records are sampled, since the per-step lines are the high-volume ones.
+
+    LOG_LEVEL=INFO                                  root level
+    LOG_LEVELS=ai_service=DEBUG,werkzeug=WARNING    per-module levels
+    LOG_FORMAT=json                                 json or text
+    LOG_DEBUG_SAMPLE_RATE=0.1                       share of DEBUG records kept
+    LOG_QUEUE_SIZE=10000
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# The call a record belongs to: set per webhook request and per analysis job
+call_sid_var = contextvars.ContextVar('call_sid', default=None)
+
+DROPPED = metrics.counter('ivr_log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+# Attributes every LogRecord has; anything else was passed with extra= and goes into the JSON
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'call_sid'}
+
+# Overridable with LOG_LEVELS; the Twilio client dumps every request's headers at INFO
+DEFAULT_LEVELS = {'twilio.http_client': 'WARNING'}
+
+_listener = None
+_listener_pid = None
+
+
+def set_call_sid(call_sid):
+    """Tag records logged from this context with call_sid; returns a token for reset_call_sid"""
+    return call_sid_var.set(call_sid)
+
+
+def reset_call_sid(token):
+    call_sid_var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps the CallSid and samples DEBUG records, in the thread that logs"""
+
+    def __init__(self, debug_sample_rate=1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        # extra={'sample_rate': ...} overrides the rate for one very chatty line
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None:
+            rate = self.debug_sample_rate if record.levelno <= logging.DEBUG else 1.0
+        if rate < 1.0 and random.random() >= rate:
+            return False
+        record.call_sid = call_sid_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not in the request
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        call_sid = getattr(record, 'call_sid', None)
+        if call_sid:
+            entry['call_sid'] = call_sid
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and key != 'sample_rate':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(call_sid)s] %(message)s')
+
+    def format(self, record):
+        if not getattr(record, 'call_sid', None):
+            record.call_sid = '-'
+        return super().format(record)
+
+
+def parse_levels(text):
+    """'ai_service=DEBUG,werkzeug=WARNING' -> {'ai_service': 'DEBUG', 'werkzeug': 'WARNING'}"""
+    levels = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(stream=None):
+    """Install the queue handler on the root logger. Later calls in the same process do nothing."""
+    global _listener, _listener_pid
+    # A forked worker inherits _listener but not its thread, so it sets up its own
+    if _listener is not None and _listener_pid == os.getpid():
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if os.getenv('LOG_FORMAT', 'json').lower() == 'json' else TextFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000'))))
+    handler.addFilter(ContextFilter(float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.1'))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    levels = dict(DEFAULT_LEVELS, **parse_levels(os.getenv('LOG_LEVELS')))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(handler.queue, output)
+    _listener_pid = os.getpid()
+    _listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
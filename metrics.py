@@ -0,0 +1,415 @@
+"""In-process counters, gauges and histograms exposed in the Prometheus text format.
+
+Modules declare their metrics at import time and keep the labelled child
+they observe into. Counters and histograms add into a per-thread shard,
+so an observation is a bucket search and two list adds, with no lock.
+
+Every process publishes a snapshot of its metrics to the metrics_snapshots
+table (METRICS_SNAPSHOT_INTERVAL). /metrics serves this process's live
+values summed with the other processes' snapshots, so any web worker can
+be scraped and reports the whole deployment.
+"""
+import os
+import json
+import time
+import socket
+import atexit
+import logging
+import weakref
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a fast SQLite query to a slow Gemini call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '5'))
+# Snapshots of processes gone this long are dropped, and their counters with them
+SNAPSHOT_RETENTION = float(os.getenv('METRICS_SNAPSHOT_RETENTION', '86400'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Shard(list):
+    """One thread's values for a child. Only that thread writes them, so no lock is taken."""
+    __slots__ = ('child', '__weakref__')
+
+    def __init__(self, child, size):
+        super().__init__([0] * size)
+        self.child = child
+
+    def __del__(self):
+        # The thread has exited; fold its values into the child so they are kept
+        try:
+            self.child.retire(self)
+        except Exception:
+            pass
+
+
+class ShardedChild:
+    """Values summed over per-thread shards, so observing never waits on another thread"""
+    __slots__ = ('size', '_local', '_shards', '_retired', '_lock')
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._shards = {}  # Format: {id(shard): weakref to shard}, for threads still running
+        self._retired = [0] * size
+        # Reentrant: a shard can be freed, and retired, while totals() holds the lock
+        self._lock = threading.RLock()
+
+    def _new_shard(self):
+        shard = Shard(self, self.size)
+        with self._lock:
+            self._shards[id(shard)] = weakref.ref(shard)
+        self._local.shard = shard
+        return shard
+
+    def retire(self, shard):
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            for i, value in enumerate(shard):
+                self._retired[i] += value
+
+    def totals(self):
+        with self._lock:
+            shards = [ref() for ref in self._shards.values()]
+            totals = list(self._retired)
+        for shard in shards:
+            if shard is None:
+                continue
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class CounterChild(ShardedChild):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[0] += amount
+
+    @property
+    def value(self):
+        return self.totals()[0]
+
+
+class GaugeChild:
+    # Not sharded: set() has to replace the value every thread sees
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild(ShardedChild):
+    __slots__ = ('bounds',)
+
+    def __init__(self, bounds):
+        # One count per bound, one for +Inf, then the sum
+        super().__init__(len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    @property
+    def value(self):
+        totals = self.totals()
+        return totals[:-1], totals[-1]
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}  # Format: {label values: child}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics are observed directly, e.g. counter.inc()
+            child = self.labels()
+            for method in ('inc', 'dec', 'set', 'observe'):
+                if hasattr(child, method):
+                    setattr(self, method, getattr(child, method))
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values; keep it around on hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            values = tuple(str(value) for value in values)
+            child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        """{label values: value} for counters and gauges, {label values: (counts, sum)} for histograms"""
+        with self._lock:
+            children = list(self._children.items())
+        return {values: child.value for values, child in children}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # Read at scrape time in the scraping process only, for values that are already shared
+        self.function = function
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def samples(self):
+        if self.function is not None:
+            return {(): self.function()}
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramChild(self.bounds)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # Format: {name: Metric}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                # Re-importing a module (e.g. reloading in a shell) keeps the first definition
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """This process's values as JSON-friendly data; scrape-time gauges are left out"""
+        data = {}
+        for name, metric in list(self.metrics.items()):
+            if getattr(metric, 'function', None) is not None:
+                continue
+            data[name] = [[list(values), value] for values, value in metric.samples().items()]
+        return data
+
+    def collect(self, shared=()):
+        """Merge live samples with other processes' snapshots: [(metric, {label values: value})]"""
+        collected = []
+        for name, metric in list(self.metrics.items()):
+            samples = metric.samples()
+            for snapshot, live in shared:
+                for values, value in snapshot.get(name, ()):
+                    values = tuple(values)
+                    if metric.kind == 'gauge' and not live:
+                        continue
+                    samples[values] = merge_values(metric.kind, samples.get(values), value)
+            collected.append((metric, samples))
+        return collected
+
+    def expose(self, shared=()):
+        lines = []
+        for metric, samples in self.collect(shared):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, value in sorted(samples.items()):
+                labels = list(zip(metric.labelnames, values))
+                if metric.kind != 'histogram':
+                    lines.append(f"{metric.name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.bounds + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{metric.name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def merge_values(kind, current, other):
+    if kind == 'histogram':
+        counts, total = other
+        if current is None:
+            return list(counts), total
+        if len(current[0]) != len(counts):
+            # Published by a process running different buckets, e.g. mid-deploy
+            return current
+        return [a + b for a, b in zip(current[0], counts)], current[1] + total
+    return (current or 0) + other
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(format_value(value) if name == "le" else value)}"'
+                          for name, value in labels) + '}'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def process_id():
+    # Read per call: forked workers get their own pid after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish():
+    """Write this process's snapshot so other processes' /metrics include it"""
+    import db
+    db.execute(
+        "INSERT OR REPLACE INTO metrics_snapshots (process, data, updated_at) VALUES (?, ?, ?)",
+        (process_id(), json.dumps(REGISTRY.snapshot()), time.time())
+    )
+
+
+def shared_snapshots(interval=SNAPSHOT_INTERVAL):
+    """[(snapshot, live)] for every other process; gauges only count while it is still publishing"""
+    import db
+    now = time.time()
+    db.execute("DELETE FROM metrics_snapshots WHERE updated_at < ?", (now - SNAPSHOT_RETENTION,))
+    rows = db.query_all(
+        "SELECT data, updated_at FROM metrics_snapshots WHERE process != ?", (process_id(),)
+    )
+    return [(json.loads(row['data']), now - row['updated_at'] < interval * 3) for row in rows]
+
+
+def shared_or_local():
+    try:
+        return shared_snapshots()
+    except Exception as e:
+        # Still serve this process's own numbers
+        logger.error("Error reading shared metrics: %s", e)
+        return []
+
+
+def render():
+    """The /metrics response body for the whole deployment"""
+    return REGISTRY.expose(shared_or_local())
+
+
+def deployment_samples():
+    """{metric name: {label values: value}} for the whole deployment, the numbers /metrics serves.
+
+    For the admin APIs, so they report the same figures as a scrape.
+    """
+    return {metric.name: samples for metric, samples in REGISTRY.collect(shared_or_local())}
+
+
+def process_samples():
+    """Like deployment_samples(), for this process alone"""
+    return {metric.name: samples for metric, samples in REGISTRY.collect()}
+
+
+def histogram_summary(metric, value):
+    """A histogram sample as JSON: cumulative counts keyed by upper bound, count and sum"""
+    counts, total = value if value is not None else ([0] * (len(metric.bounds) + 1), 0.0)
+    buckets = {}
+    cumulative = 0
+    for bound, count in zip(metric.bounds + (float('inf'),), counts):
+        cumulative += count
+        buckets[format_value(bound)] = cumulative
+    return {'buckets': buckets, 'count': cumulative, 'sum': round(total, 3)}
+
+
+_publisher_pid = None
+
+
+def start_publisher(interval=SNAPSHOT_INTERVAL):
+    """Publish snapshots every interval seconds from a daemon thread. Once per process."""
+    global _publisher_pid
+    if _publisher_pid == os.getpid() or interval <= 0:
+        return
+    _publisher_pid = os.getpid()
+
+    def run():
+        import db
+        while True:
+            time.sleep(interval)
+            try:
+                publish()
+            except Exception as e:
+                logger.error("Error publishing metrics: %s", e)
+            finally:
+                db.release_connection()
+
+    threading.Thread(target=run, daemon=True, name="metrics-publisher").start()
+    # Keep the counters of a process that exits cleanly
+    atexit.register(publish_quietly)
+
+
+def publish_quietly():
+    try:
+        publish()
+    except Exception:
+        pass
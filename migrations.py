@@ -0,0 +1,425 @@
+from datetime import datetime
+
+import db
+
+
+
+def call_rollup(row, sign):
+    """Trigger statements adding (sign '+') or removing (sign '-') one calls row from the daily rollups"""
+    day = f"substr({row}.timestamp, 1, 10)"
+    return f'''
+        INSERT INTO call_daily_stats (
+            day, calls, unknown_names, unknown_accounts, unknown_consent, transcripts, transcript_chars
+        ) VALUES (
+            {day}, {sign}1, {sign}({row}.customer_name IS 'Unknown'), {sign}({row}.account_number IS 'Unknown'),
+            {sign}({row}.consent_status IS 'Unknown'), {sign}({row}.transcript_length IS NOT NULL),
+            {sign}IFNULL({row}.transcript_length, 0)
+        )
+        ON CONFLICT (day) DO UPDATE SET
+            calls = calls + excluded.calls,
+            unknown_names = unknown_names + excluded.unknown_names,
+            unknown_accounts = unknown_accounts + excluded.unknown_accounts,
+            unknown_consent = unknown_consent + excluded.unknown_consent,
+            transcripts = transcripts + excluded.transcripts,
+            transcript_chars = transcript_chars + excluded.transcript_chars;
+        INSERT INTO consent_daily_stats (day, consent_type, consent_status, calls)
+        VALUES ({day}, IFNULL({row}.consent_type, ''), IFNULL({row}.consent_status, ''), {sign}1)
+        ON CONFLICT (day, consent_type, consent_status) DO UPDATE SET calls = calls + excluded.calls;
+    '''
+
+
+# Not INSERT OR IGNORE: in a trigger, the outer statement's conflict policy would override it
+CALLER_SEEN = '''
+    INSERT INTO caller_numbers (caller_number, first_day)
+    SELECT NEW.caller_number, substr(NEW.timestamp, 1, 10)
+    WHERE NEW.caller_number IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM caller_numbers WHERE caller_number = NEW.caller_number);
+'''
+
+# Stamp the row with the next calls change number. Writers hold SQLite's write lock
+# while the trigger runs, so the numbers are assigned in commit order.
+NEXT_CHANGE_SEQ = '''
+    UPDATE export_state SET value = value + 1 WHERE name = 'calls_change_seq';
+    UPDATE calls SET change_seq = (SELECT value FROM export_state WHERE name = 'calls_change_seq')
+    WHERE id = NEW.id;
+'''
+
+
+# (version, description, statements). Append new migrations, never edit applied ones.
+MIGRATIONS = [
+    (1, "calls and otp_verification tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            call_sid TEXT,
+            caller_number TEXT,
+            timestamp TEXT,
+            full_transcript TEXT,
+            customer_name TEXT,
+            account_number TEXT,
+            issue_type TEXT,
+            issue_description TEXT,
+            priority TEXT,
+            status TEXT DEFAULT 'new',
+            consent_type TEXT,
+            consent_status TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS otp_verification (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT,
+            otp TEXT,
+            created_at TEXT,
+            verified BOOLEAN DEFAULT FALSE
+        )
+        ''',
+    ]),
+    (2, "analysis job queue and export state", [
+        '''
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            call_sid TEXT,
+            caller_number TEXT,
+            transcript TEXT,
+            status TEXT DEFAULT 'queued',  -- queued, running, done, failed
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER,
+            next_run_at REAL,
+            locked_by TEXT,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status_next_run
+        ON analysis_jobs (status, next_run_at)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            value REAL
+        )
+        ''',
+    ]),
+    (3, "indexes for hot queries, unique call_sid", [
+        # Keep the newest row per call_sid so the unique index can be built
+        '''
+        DELETE FROM calls
+        WHERE call_sid IS NOT NULL
+        AND id NOT IN (SELECT MAX(id) FROM calls WHERE call_sid IS NOT NULL GROUP BY call_sid)
+        ''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_calls_call_sid ON calls (call_sid)",
+        "CREATE INDEX IF NOT EXISTS idx_calls_timestamp ON calls (timestamp, id)",
+        # Equality columns first, created_at last for the 5 minute range check
+        '''
+        CREATE INDEX IF NOT EXISTS idx_otp_lookup
+        ON otp_verification (phone_number, otp, verified, created_at)
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_otp_created_at ON otp_verification (created_at)",
+    ]),
+    (4, "OTP expiry and attempt counting", [
+        "ALTER TABLE otp_verification ADD COLUMN expires_at REAL",
+        "ALTER TABLE otp_verification ADD COLUMN attempts INTEGER DEFAULT 0",
+        # Legacy codes were valid for 5 minutes from created_at
+        "UPDATE otp_verification SET expires_at = CAST(strftime('%s', created_at) AS REAL) + 300",
+        "DROP INDEX IF EXISTS idx_otp_lookup",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_otp_active
+        ON otp_verification (phone_number, verified, expires_at)
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_otp_expires_at ON otp_verification (expires_at)",
+    ]),
+    (5, "outbound SMS delivery tracking", [
+        '''
+        CREATE TABLE IF NOT EXISTS sms_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            call_sid TEXT,
+            to_number TEXT,
+            status TEXT,  -- queued, sent/accepted, delivered, undelivered, failed
+            twilio_sid TEXT,
+            attempts INTEGER DEFAULT 0,
+            error_code INTEGER,
+            error_message TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_sms_messages_twilio_sid ON sms_messages (twilio_sid)",
+    ]),
+    (6, "shared LLM analysis cache", [
+        '''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            latency REAL,
+            expires_at REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache (expires_at)",
+    ]),
+    (7, "metrics snapshots shared between processes", [
+        '''
+        CREATE TABLE IF NOT EXISTS metrics_snapshots (
+            process TEXT PRIMARY KEY,  -- hostname:pid
+            data TEXT,
+            updated_at REAL
+        )
+        ''',
+    ]),
+    (8, "transcript segments", [
+        '''
+        CREATE TABLE IF NOT EXISTS transcript_segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            call_sid TEXT NOT NULL,
+            kind TEXT,  -- caller, system, technical_issue, billing_issue, other_issue, priority
+            text TEXT,
+            confidence REAL,  -- speech recognition confidence, NULL for DTMF
+            source TEXT,  -- call flow state that recorded it
+            created_at REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_transcript_segments_call_sid ON transcript_segments (call_sid, id)",
+    ]),
+    (9, "transcripts stored once, compressed, outside calls", [
+        '''
+        CREATE TABLE IF NOT EXISTS transcript_archives (
+            call_sid TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,  -- zlib, zstd or json (uncompressed)
+            body BLOB NOT NULL,  -- JSON list of [kind, text, confidence, source, created_at] segments
+            length INTEGER  -- characters in the rendered transcript
+        )
+        ''',
+        "ALTER TABLE calls ADD COLUMN transcript_preview TEXT",
+        # Existing transcripts move over as one verbatim segment; python transcript.py --compress compresses them
+        '''
+        INSERT OR IGNORE INTO transcript_archives (call_sid, codec, body, length)
+        SELECT call_sid, 'json', CAST(json_array(json_array('text', full_transcript)) AS BLOB), LENGTH(full_transcript)
+        FROM calls WHERE call_sid IS NOT NULL AND full_transcript IS NOT NULL
+        ''',
+        # issue_description held a second copy of the transcript for consent calls
+        '''
+        UPDATE calls SET
+            transcript_preview = substr(trim(replace(full_transcript, char(10), ' ')), 1, 120),
+            issue_description = CASE WHEN issue_description = full_transcript THEN NULL ELSE issue_description END,
+            full_transcript = NULL
+        WHERE call_sid IS NOT NULL AND full_transcript IS NOT NULL
+        ''',
+        "UPDATE analysis_jobs SET transcript = NULL WHERE status = 'done'",
+    ]),
+    (10, "daily report rollups kept up to date by triggers", [
+        "ALTER TABLE calls ADD COLUMN transcript_length INTEGER",
+        '''
+        UPDATE calls SET transcript_length = (
+            SELECT length FROM transcript_archives WHERE transcript_archives.call_sid = calls.call_sid
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS call_daily_stats (
+            day TEXT PRIMARY KEY,  -- YYYY-MM-DD of calls.timestamp
+            calls INTEGER NOT NULL DEFAULT 0,
+            unknown_names INTEGER NOT NULL DEFAULT 0,
+            unknown_accounts INTEGER NOT NULL DEFAULT 0,
+            unknown_consent INTEGER NOT NULL DEFAULT 0,
+            transcripts INTEGER NOT NULL DEFAULT 0,
+            transcript_chars INTEGER NOT NULL DEFAULT 0,
+            new_callers INTEGER NOT NULL DEFAULT 0  -- caller numbers first seen that day
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS consent_daily_stats (
+            day TEXT,
+            consent_type TEXT,
+            consent_status TEXT,
+            calls INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, consent_type, consent_status)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS otp_daily_stats (
+            day TEXT PRIMARY KEY,  -- YYYY-MM-DD of otp_verification.created_at
+            issued INTEGER NOT NULL DEFAULT 0,
+            verified INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS caller_numbers (
+            caller_number TEXT PRIMARY KEY,
+            first_day TEXT
+        )
+        ''',
+        # Backfill from the existing rows, then let the triggers below keep the rollups current
+        '''
+        INSERT INTO call_daily_stats (
+            day, calls, unknown_names, unknown_accounts, unknown_consent, transcripts, transcript_chars
+        )
+        SELECT substr(timestamp, 1, 10), COUNT(*), SUM(customer_name IS 'Unknown'),
+               SUM(account_number IS 'Unknown'), SUM(consent_status IS 'Unknown'),
+               COUNT(transcript_length), IFNULL(SUM(transcript_length), 0)
+        FROM calls GROUP BY 1
+        ''',
+        '''
+        INSERT INTO consent_daily_stats (day, consent_type, consent_status, calls)
+        SELECT substr(timestamp, 1, 10), IFNULL(consent_type, ''), IFNULL(consent_status, ''), COUNT(*)
+        FROM calls GROUP BY 1, 2, 3
+        ''',
+        '''
+        INSERT INTO caller_numbers (caller_number, first_day)
+        SELECT caller_number, MIN(substr(timestamp, 1, 10)) FROM calls
+        WHERE caller_number IS NOT NULL GROUP BY caller_number
+        ''',
+        '''
+        INSERT INTO call_daily_stats (day, new_callers)
+        SELECT first_day, COUNT(*) FROM caller_numbers WHERE true GROUP BY first_day
+        ON CONFLICT (day) DO UPDATE SET new_callers = excluded.new_callers
+        ''',
+        '''
+        INSERT INTO otp_daily_stats (day, issued, verified)
+        SELECT substr(created_at, 1, 10), COUNT(*), SUM(verified IS 1) FROM otp_verification GROUP BY 1
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS calls_rollup_insert AFTER INSERT ON calls BEGIN
+            {call_rollup('NEW', '+')}
+            {CALLER_SEEN}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS calls_rollup_delete AFTER DELETE ON calls BEGIN
+            {call_rollup('OLD', '-')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS calls_rollup_update
+        AFTER UPDATE OF timestamp, caller_number, customer_name, account_number, consent_type, consent_status,
+            transcript_length
+        ON calls BEGIN
+            {call_rollup('OLD', '-')}
+            {call_rollup('NEW', '+')}
+            {CALLER_SEEN}
+        END
+        ''',
+        # Unique callers ever seen, counted once, on the day they first called
+        '''
+        CREATE TRIGGER IF NOT EXISTS caller_numbers_rollup AFTER INSERT ON caller_numbers BEGIN
+            INSERT INTO call_daily_stats (day, new_callers) VALUES (NEW.first_day, 1)
+            ON CONFLICT (day) DO UPDATE SET new_callers = new_callers + 1;
+        END
+        ''',
+        # Purging expired codes leaves the rollup alone: it counts codes ever issued
+        '''
+        CREATE TRIGGER IF NOT EXISTS otp_rollup_insert AFTER INSERT ON otp_verification BEGIN
+            INSERT INTO otp_daily_stats (day, issued, verified)
+            VALUES (substr(NEW.created_at, 1, 10), 1, NEW.verified IS 1)
+            ON CONFLICT (day) DO UPDATE SET issued = issued + 1, verified = verified + excluded.verified;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS otp_rollup_verify AFTER UPDATE OF verified ON otp_verification
+        WHEN NEW.verified IS 1 AND OLD.verified IS NOT 1 BEGIN
+            INSERT INTO otp_daily_stats (day, verified) VALUES (substr(NEW.created_at, 1, 10), 1)
+            ON CONFLICT (day) DO UPDATE SET verified = verified + 1;
+        END
+        ''',
+    ]),
+    (11, "change numbers on calls for the consent delta export", [
+        "ALTER TABLE calls ADD COLUMN change_seq INTEGER",
+        # Existing rows keep their rowid, so a consent_watermark saved before this migration still applies
+        "UPDATE calls SET change_seq = id",
+        "CREATE INDEX IF NOT EXISTS idx_calls_change_seq ON calls (change_seq)",
+        '''
+        INSERT OR REPLACE INTO export_state (name, value)
+        SELECT 'calls_change_seq', MAX(
+            IFNULL((SELECT MAX(id) FROM calls), 0),
+            IFNULL((SELECT value FROM export_state WHERE name = 'consent_watermark'), 0)
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS calls_change_seq_insert AFTER INSERT ON calls BEGIN
+            {NEXT_CHANGE_SEQ}
+        END
+        ''',
+        # Any change to an exported column, e.g. a re-analysed call's upsert
+        f'''
+        CREATE TRIGGER IF NOT EXISTS calls_change_seq_update
+        AFTER UPDATE OF account_number, caller_number, customer_name, consent_type, consent_status, timestamp
+        ON calls BEGIN
+            {NEXT_CHANGE_SEQ}
+        END
+        ''',
+    ]),
+    (12, "transcript archives keyed by call_sid alone, shorter previews", [
+        # WITHOUT ROWID stores each call_sid once instead of in the table and its index again
+        '''
+        CREATE TABLE IF NOT EXISTS transcript_archives_by_sid (
+            call_sid TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,  -- packed, zlib, zstd or json (uncompressed), see transcript.py
+            body BLOB NOT NULL,
+            length INTEGER  -- characters in the rendered transcript
+        ) WITHOUT ROWID
+        ''',
+        "INSERT INTO transcript_archives_by_sid SELECT call_sid, codec, body, length FROM transcript_archives",
+        "DROP TABLE transcript_archives",
+        "ALTER TABLE transcript_archives_by_sid RENAME TO transcript_archives",
+        # transcript.PREVIEW_CHARS
+        '''
+        UPDATE calls SET transcript_preview = substr(transcript_preview, 1, 45) || '...'
+        WHERE length(transcript_preview) > 48
+        ''',
+    ]),
+    (13, "index for purging finished analysis jobs", [
+        # job_queue.purge_finished_jobs and requeue_stale_jobs filter on status and updated_at
+        '''
+        CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status_updated
+        ON analysis_jobs (status, updated_at)
+        ''',
+    ]),
+]
+
+
+def current_version(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT
+    )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate():
+    """Apply pending migrations. Safe to call from every worker on start-up."""
+    applied = []
+    # One write transaction, so concurrent workers apply each migration exactly once
+    with db.transaction() as conn:
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (number, description, datetime.now().isoformat())
+            )
+            applied.append(number)
+    return applied
+
+
+def full_scans(sql, params=()):
+    """Return the EXPLAIN QUERY PLAN steps that read a whole table or sort in a temp b-tree"""
+    plan = db.query_all(f"EXPLAIN QUERY PLAN {sql}", params)
+    bad_steps = []
+    for step in plan:
+        detail = step['detail']
+        if (detail.startswith('SCAN') and 'USING' not in detail) or 'TEMP B-TREE' in detail:
+            bad_steps.append(detail)
+    return bad_steps
+
+
+if __name__ == "__main__":
+    # python migrations.py   apply pending migrations
+    # Hot-path query plans are checked by tests/test_query_plans.py
+    applied = migrate()
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
@@ -0,0 +1,155 @@
+import os
+import hmac
+import time
+import secrets
+import logging
+import threading
+from datetime import datetime
+
+import db
+
+logger = logging.getLogger(__name__)
+
+OTP_LENGTH = 6
+OTP_TTL_SECONDS = int(os.getenv('OTP_TTL_SECONDS', '300'))
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', '3'))
+# Expired rows stay this long for the reports in view_db.py, then get purged
+OTP_RETENTION_SECONDS = int(os.getenv('OTP_RETENTION_SECONDS', '86400'))
+PURGE_INTERVAL = float(os.getenv('OTP_PURGE_INTERVAL', '300'))
+
+
+def generate_otp():
+    return ''.join(secrets.choice('0123456789') for _ in range(OTP_LENGTH))
+
+
+class OTPStore:
+    """Issues and checks one-time codes per phone number.
+
+    Only the newest unexpired code for a number is valid, and it is
+    locked after OTP_MAX_ATTEMPTS wrong guesses.
+    """
+
+    def issue(self, phone_number, otp):
+        raise NotImplementedError
+
+    def verify(self, phone_number, otp):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Remove codes past their retention. Returns how many were removed."""
+        raise NotImplementedError
+
+
+class _PendingOTP:
+    __slots__ = ('otp', 'expires_at', 'attempts')
+
+    def __init__(self, otp, expires_at):
+        self.otp = otp
+        self.expires_at = expires_at
+        self.attempts = 0
+
+
+class InMemoryOTPStore(OTPStore):
+    """TTL map for single-node deployments"""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def issue(self, phone_number, otp):
+        with self._lock:
+            self._pending[phone_number] = _PendingOTP(otp, time.time() + self.ttl)
+
+    def verify(self, phone_number, otp):
+        with self._lock:
+            pending = self._pending.get(phone_number)
+            if pending is None or pending.expires_at <= time.time():
+                return False
+            if hmac.compare_digest(pending.otp, otp or ''):
+                del self._pending[phone_number]
+                return True
+            pending.attempts += 1
+            if pending.attempts >= self.max_attempts:
+                del self._pending[phone_number]
+            return False
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [phone for phone, pending in self._pending.items() if pending.expires_at <= now]
+            for phone in expired:
+                del self._pending[phone]
+        return len(expired)
+
+
+class SQLiteOTPStore(OTPStore):
+    """otp_verification table shared by all workers"""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS, retention=OTP_RETENTION_SECONDS):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+    def issue(self, phone_number, otp):
+        now = time.time()
+        db.execute(
+            "INSERT INTO otp_verification (phone_number, otp, created_at, expires_at, attempts) VALUES (?, ?, ?, ?, 0)",
+            (phone_number, otp, datetime.now().isoformat(), now + self.ttl)
+        )
+
+    def verify(self, phone_number, otp):
+        # Only the newest live code is looked at, so cost doesn't depend on history size
+        with db.transaction() as conn:
+            row = conn.execute(
+                """SELECT id, otp, attempts FROM otp_verification
+                   WHERE phone_number = ? AND verified = FALSE AND expires_at > ?
+                   ORDER BY expires_at DESC
+                   LIMIT 1""",
+                (phone_number, time.time())
+            ).fetchone()
+            if row is None or row['attempts'] >= self.max_attempts:
+                return False
+
+            if hmac.compare_digest(row['otp'], otp or ''):
+                conn.execute("UPDATE otp_verification SET verified = TRUE WHERE id = ?", (row['id'],))
+                return True
+            conn.execute("UPDATE otp_verification SET attempts = attempts + 1 WHERE id = ?", (row['id'],))
+            return False
+
+    def purge_expired(self):
+        cursor = db.execute(
+            "DELETE FROM otp_verification WHERE expires_at < ?",
+            (time.time() - self.retention,)
+        )
+        return cursor.rowcount
+
+
+def create_otp_store():
+    """Build the OTP store selected by the OTP_STORE environment variable"""
+    backend = os.getenv('OTP_STORE', 'sqlite').lower()
+    if backend == 'memory':
+        return InMemoryOTPStore()
+    if backend == 'sqlite':
+        return SQLiteOTPStore()
+    raise ValueError(f"Unknown OTP_STORE backend: {backend}")
+
+
+def start_purge_thread(store, interval=PURGE_INTERVAL):
+    """Purge expired codes in a daemon thread every interval seconds"""
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                removed = store.purge_expired()
+                if removed:
+                    logger.info("Purged %d expired OTPs", removed)
+            except Exception as e:
+                logger.error("Error purging OTPs: %s", e)
+            finally:
+                db.release_connection()
+
+    threading.Thread(target=run, daemon=True, name="otp-purge").start()
+    return stop_event
@@ -0,0 +1,124 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_LEVELS = {'low': 1, 'medium': 2, 'high': 3}
+
+# Words with their contraction ("don't"), minus a possessive 's: "bomb's" is the token "bomb"
+TOKEN_PATTERN = re.compile(r"([a-z0-9]+(?:['\u2019](?!s\b)[a-z]+)?)(?:['\u2019]s\b)?")
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'risk_lexicon.json')
+
+RiskMatch = namedtuple('RiskMatch', ['term', 'severity', 'matched'])
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def inflections(word):
+    """Regular English inflections of a word: attack -> attacks, attacked, attacking, attacker"""
+    forms = {word, word + 's', word + 'es', word + 'ed', word + 'ing', word + 'er', word + 'ers'}
+    if word.endswith('e'):
+        # damage -> damaged, damaging
+        forms.update((word + 'd', word[:-1] + 'ing', word + 'r', word + 'rs'))
+    if (len(word) >= 3 and word[-1] not in 'aeiouwxy'
+            and word[-2] in 'aeiou' and word[-3] not in 'aeiou'):
+        # gun -> gunned, gunning
+        doubled = word + word[-1]
+        forms.update((doubled + 'ed', doubled + 'ing', doubled + 'er', doubled + 'ers'))
+    return forms
+
+
+class RiskLexicon:
+    """Lexicon compiled into hash tables of word forms.
+
+    Inflected forms are expanded when the lexicon is built, so matching is
+    one dict lookup per word (plus phrase lookups for words that start a
+    multi-word term) no matter how many terms there are.
+    """
+
+    def __init__(self, entries):
+        self.words = {}
+        self.phrases = {}
+        self.phrase_starts = set()
+        self.max_words = 1
+        for entry in entries:
+            words = tuple(tokenize(entry['term']))
+            if not words:
+                continue
+            severity = entry.get('severity', 'high')
+            if severity not in SEVERITY_LEVELS:
+                raise ValueError(f"Unknown severity '{severity}' for term '{entry['term']}'")
+            compiled = (entry['term'], severity)
+            # Only the last word of a phrase is inflected: "blow up", "blowing up" is its own term
+            last_forms = inflections(words[-1]) if entry.get('inflections', True) else {words[-1]}
+            for form in last_forms:
+                if len(words) == 1:
+                    self.words[form] = compiled
+                else:
+                    self.phrases[words[:-1] + (form,)] = compiled
+            if len(words) > 1:
+                self.phrase_starts.add(words[0])
+                self.max_words = max(self.max_words, len(words))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)['terms'])
+
+    def match(self, text):
+        tokens = tokenize(text)
+        matches = []
+        for start, token in enumerate(tokens):
+            found = self.words.get(token)
+            if found:
+                matches.append(RiskMatch(found[0], found[1], token))
+            if token not in self.phrase_starts:
+                continue
+            for end in range(start + 2, min(start + self.max_words, len(tokens)) + 1):
+                words = tuple(tokens[start:end])
+                found = self.phrases.get(words)
+                if found:
+                    matches.append(RiskMatch(found[0], found[1], ' '.join(words)))
+        return matches
+
+
+class RiskDetector:
+    """Lexicon-backed detector that picks up edits to the lexicon file without a restart"""
+
+    def __init__(self, path=DEFAULT_LEXICON_PATH, reload_interval=5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = os.path.getmtime(path)
+        self._checked = time.monotonic()
+        self.lexicon = RiskLexicon.load(path)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime != self._mtime:
+                    self.lexicon = RiskLexicon.load(self.path)
+                    self._mtime = mtime
+                    logger.info("Reloaded risk lexicon from %s", self.path)
+            except (OSError, ValueError, KeyError) as e:
+                # Keep serving the last good lexicon
+                logger.error("Error reloading risk lexicon: %s", e)
+
+    def check(self, text, min_severity='low'):
+        """Return the RiskMatches at or above min_severity"""
+        self._maybe_reload()
+        threshold = SEVERITY_LEVELS[min_severity]
+        return [m for m in self.lexicon.match(text) if SEVERITY_LEVELS[m.severity] >= threshold]
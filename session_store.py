@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from call_reaper import IDLE_TTL_SECONDS
+
+try:
+    import redis
+except ImportError:  # Only needed for the redis backend
+    redis = None
+
+# Redis keys outlive the reaper's idle TTL by this much, so the reaper finalizes
+# an idle call before its session can expire on its own
+SESSION_TTL_MARGIN = 300
+
+
+class SessionStore:
+    """Interface for per-call session state shared between webhook workers.
+
+    A session records that the call is live, when it was last active and the
+    transcript segments added so far, as [kind, text, confidence, source,
+    created_at] rows (transcript.py), so a webhook handled by any worker sees
+    the whole call.
+    """
+
+    def create(self, call_sid):
+        """Open a session; segments already added to it are kept"""
+        raise NotImplementedError
+
+    def append(self, call_sid, row):
+        """Add a segment row and mark the session active now. Returns False if the call is unknown."""
+        raise NotImplementedError
+
+    def segments(self, call_sid):
+        raise NotImplementedError
+
+    def pop(self, call_sid):
+        """Remove a session and return its segment rows, or None if it was already gone,
+        e.g. another worker got there first."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def least_recent(self, limit, idle_before=None):
+        """Up to `limit` call SIDs, least recently active first, optionally only those idle since idle_before"""
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Single-process store, only safe with one worker"""
+
+    def __init__(self):
+        self._activity = OrderedDict()  # Format: {call_sid: last activity}, least recent first
+        self._segments = {}  # Format: {call_sid: [segment row, ...]}
+        self._lock = threading.Lock()
+
+    def _touch(self, call_sid):
+        self._activity[call_sid] = time.time()
+        self._activity.move_to_end(call_sid)
+
+    def create(self, call_sid):
+        with self._lock:
+            self._touch(call_sid)
+            self._segments.setdefault(call_sid, [])
+
+    def append(self, call_sid, row):
+        with self._lock:
+            if call_sid not in self._activity:
+                return False
+            self._touch(call_sid)
+            self._segments.setdefault(call_sid, []).append(list(row))
+            return True
+
+    def segments(self, call_sid):
+        with self._lock:
+            return list(self._segments.get(call_sid, ()))
+
+    def pop(self, call_sid):
+        with self._lock:
+            if self._activity.pop(call_sid, None) is None:
+                return None
+            return self._segments.pop(call_sid, [])
+
+    def count(self):
+        return len(self._activity)
+
+    def least_recent(self, limit, idle_before=None):
+        call_sids = []
+        with self._lock:
+            for call_sid, updated_at in self._activity.items():
+                if len(call_sids) >= limit or (idle_before is not None and updated_at >= idle_before):
+                    break
+                call_sids.append(call_sid)
+        return call_sids
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared by all workers on one machine through a WAL-mode SQLite file"""
+
+    def __init__(self, path='call_sessions.db'):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS call_sessions (
+            call_sid TEXT PRIMARY KEY,
+            updated_at REAL
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_call_sessions_updated_at ON call_sessions (updated_at)")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS call_session_segments (
+            id INTEGER PRIMARY KEY,
+            call_sid TEXT NOT NULL,
+            kind TEXT, text TEXT, confidence REAL, source TEXT, created_at REAL
+        )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_call_session_segments_call_sid ON call_session_segments (call_sid, id)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode: every statement below is a single atomic write
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def create(self, call_sid):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO call_sessions (call_sid, updated_at) VALUES (?, ?)", (call_sid, time.time())
+        )
+
+    def append(self, call_sid, row):
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE call_sessions SET updated_at = ? WHERE call_sid = ?", (time.time(), call_sid))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT INTO call_session_segments (call_sid, kind, text, confidence, source, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (call_sid, *row)
+            )
+        return True
+
+    def segments(self, call_sid):
+        rows = self._connection().execute(
+            "SELECT kind, text, confidence, source, created_at FROM call_session_segments "
+            "WHERE call_sid = ? ORDER BY id", (call_sid,)
+        ).fetchall()
+        return [list(row) for row in rows]
+
+    def pop(self, call_sid):
+        # The write lock makes sure only one worker sees the session go
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM call_sessions WHERE call_sid = ?", (call_sid,))
+            if cursor.rowcount == 0:
+                return None
+            rows = conn.execute(
+                "SELECT kind, text, confidence, source, created_at FROM call_session_segments "
+                "WHERE call_sid = ? ORDER BY id", (call_sid,)
+            ).fetchall()
+            conn.execute("DELETE FROM call_session_segments WHERE call_sid = ?", (call_sid,))
+        return [list(row) for row in rows]
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM call_sessions").fetchone()[0]
+
+    def least_recent(self, limit, idle_before=None):
+        rows = self._connection().execute(
+            "SELECT call_sid FROM call_sessions WHERE updated_at < ? ORDER BY updated_at LIMIT ?",
+            (idle_before if idle_before is not None else float('inf'), limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisSessionStore(SessionStore):
+    """Store shared across machines through any server speaking the Redis protocol"""
+
+    # Only append while the key exists, so a late webhook can't resurrect a finished call
+    _APPEND_IF_EXISTS = """
+    if redis.call('EXPIRE', KEYS[1], ARGV[1]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[4])
+        redis.call('EXPIRE', KEYS[2], ARGV[1])
+        redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='ivr:call:', ttl=IDLE_TTL_SECONDS + SESSION_TTL_MARGIN,
+                 client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("The redis package is required for SESSION_STORE=redis")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        # Sorted set of call SIDs scored by last activity, for the reaper
+        self.activity_key = f"{prefix}_activity"
+        self._append = self.client.register_script(self._APPEND_IF_EXISTS)
+
+    def _key(self, call_sid):
+        return f"{self.prefix}{call_sid}"
+
+    def _segments_key(self, call_sid):
+        # A list of JSON rows, expiring with the session key
+        return f"{self.prefix}{call_sid}:segments"
+
+    def create(self, call_sid):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(call_sid), 1, ex=self.ttl)
+        pipe.expire(self._segments_key(call_sid), self.ttl)
+        pipe.zadd(self.activity_key, {call_sid: time.time()})
+        pipe.execute()
+
+    def append(self, call_sid, row):
+        return bool(self._append(
+            keys=[self._key(call_sid), self._segments_key(call_sid), self.activity_key],
+            args=[self.ttl, time.time(), call_sid, json.dumps(list(row), separators=(',', ':'))]
+        ))
+
+    def segments(self, call_sid):
+        return [json.loads(row) for row in self.client.lrange(self._segments_key(call_sid), 0, -1)]
+
+    def pop(self, call_sid):
+        # MULTI/EXEC, so exactly one worker sees the session go. A session whose key
+        # expired is still in the activity set, and its segments still need saving.
+        pipe = self.client.pipeline()
+        pipe.lrange(self._segments_key(call_sid), 0, -1)
+        pipe.delete(self._key(call_sid), self._segments_key(call_sid))
+        pipe.zrem(self.activity_key, call_sid)
+        rows, deleted, untracked = pipe.execute()
+        if deleted + untracked == 0:
+            return None
+        return [json.loads(row) for row in rows]
+
+    def count(self):
+        return self.client.zcard(self.activity_key)
+
+    def least_recent(self, limit, idle_before=None):
+        # Sessions that expired through the TTL are still listed, so the reaper finalizes them
+        call_sids = self.client.zrangebyscore(
+            self.activity_key, '-inf', f"({idle_before}" if idle_before is not None else '+inf', start=0, num=limit
+        )
+        return [call_sid.decode('utf-8') for call_sid in call_sids]
+
+
+def create_session_store():
+    """Build the session store selected by the SESSION_STORE environment variable"""
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+
+    if backend == 'memory':
+        return InMemorySessionStore()
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_STORE_PATH', 'call_sessions.db'))
+    if backend == 'redis':
+        ttl = int(os.getenv('SESSION_STORE_TTL', str(int(IDLE_TTL_SECONDS + SESSION_TTL_MARGIN))))
+        if ttl <= IDLE_TTL_SECONDS:
+            raise ValueError(
+                f"SESSION_STORE_TTL ({ttl}s) must be longer than CALL_IDLE_TTL_SECONDS ({IDLE_TTL_SECONDS:g}s), "
+                "or sessions expire before the reaper can finalize them"
+            )
+        return RedisSessionStore(os.getenv('SESSION_STORE_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
@@ -0,0 +1,201 @@
+import os
+import time
+import queue
+import random
+import logging
+import threading
+
+import requests
+from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+
+import db
+import metrics
+from logging_setup import set_call_sid, reset_call_sid
+
+logger = logging.getLogger(__name__)
+
+# Twilio error codes worth retrying: rate limited, internal error, service unavailable
+TRANSIENT_ERROR_CODES = {20429, 20500, 20503}
+TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+FINAL_STATUSES = ('delivered', 'undelivered', 'failed')
+
+SEND_SECONDS = metrics.histogram(
+    'ivr_sms_send_seconds', 'Twilio Messages API latency per attempt, by outcome (sent, retry, failed)',
+    ('outcome',))
+QUEUE_FULL = metrics.counter('ivr_sms_queue_full_total', 'SMS dropped because the send queue was full')
+
+
+class TokenBucket:
+    """Allows `rate` sends per second on average with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient(error):
+    if isinstance(error, TwilioRestException):
+        return error.code in TRANSIENT_ERROR_CODES or error.status in TRANSIENT_HTTP_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class SMSDispatcher:
+    """Sends SMS from a bounded queue so webhooks never wait on the Twilio API"""
+
+    def __init__(self, account_sid, auth_token, from_number, workers=4, queue_size=1000,
+                 rate=10.0, burst=10, max_attempts=4, retry_base=0.5,
+                 base_url=None, status_callback=None, timeout=10):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.base_url = base_url
+        self.status_callback = status_callback
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('TWILIO_ACCOUNT_SID'),
+            os.getenv('TWILIO_AUTH_TOKEN'),
+            os.getenv('TWILIO_PHONE_NUMBER'),
+            workers=int(os.getenv('SMS_WORKERS', '4')),
+            queue_size=int(os.getenv('SMS_QUEUE_SIZE', '1000')),
+            rate=float(os.getenv('SMS_RATE_PER_SECOND', '10')),
+            burst=int(os.getenv('SMS_RATE_BURST', '10')),
+            max_attempts=int(os.getenv('SMS_MAX_ATTEMPTS', '4')),
+            # Point at a local stub of the Messages API for testing
+            base_url=os.getenv('TWILIO_API_BASE_URL'),
+            status_callback=os.getenv('SMS_STATUS_CALLBACK_URL')
+        )
+
+    def _make_client(self):
+        # One client per sender thread, its HTTP session keeps connections alive
+        http_client = TwilioHttpClient(pool_connections=True, timeout=self.timeout)
+        client = Client(self.account_sid, self.auth_token, http_client=http_client)
+        if self.base_url:
+            client.api.base_url = self.base_url
+        return client
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True, name=f"sms-sender-{i}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=10):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send(self, to, body, call_sid=None):
+        """Queue a message and return its sms_messages id, or None if the queue is full"""
+        now = time.time()
+        message_id = db.execute(
+            "INSERT INTO sms_messages (call_sid, to_number, status, attempts, created_at, updated_at) VALUES (?, ?, 'queued', 0, ?, ?)",
+            (call_sid, to, now, now)
+        ).lastrowid
+        try:
+            self._queue.put_nowait((message_id, to, body, call_sid))
+        except queue.Full:
+            QUEUE_FULL.inc()
+            self._record(message_id, 'failed', error_message='Send queue full')
+            return None
+        return message_id
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        client = self._make_client()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            message_id, to, body, call_sid = item
+            token = set_call_sid(call_sid)
+            try:
+                self._deliver(client, message_id, to, body)
+            except Exception as e:
+                logger.exception("Unexpected SMS sender error: %s", e)
+            finally:
+                reset_call_sid(token)
+                db.release_connection()
+
+    def _deliver(self, client, message_id, to, body):
+        for attempt in range(1, self.max_attempts + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                params = {'to': to, 'from_': self.from_number, 'body': body}
+                if self.status_callback:
+                    params['status_callback'] = self.status_callback
+                message = client.messages.create(**params)
+                SEND_SECONDS.labels('sent').observe(time.perf_counter() - start)
+                self._record(message_id, message.status or 'sent', attempts=attempt, twilio_sid=message.sid)
+                logger.info("Message %s sent with SID %s", message_id, message.sid)
+                return
+            except Exception as e:
+                code = getattr(e, 'code', None)
+                if not is_transient(e) or attempt == self.max_attempts:
+                    SEND_SECONDS.labels('failed').observe(time.perf_counter() - start)
+                    logger.error("SMS %s to %s failed after %d attempts: %s", message_id, to, attempt, e)
+                    self._record(message_id, 'failed', attempts=attempt, error_code=code, error_message=str(e))
+                    return
+                SEND_SECONDS.labels('retry').observe(time.perf_counter() - start)
+                # Exponential backoff with jitter so retries from all senders don't line up
+                delay = self.retry_base * (2 ** (attempt - 1))
+                time.sleep(random.uniform(0, delay))
+
+    def _record(self, message_id, status, attempts=None, twilio_sid=None, error_code=None, error_message=None):
+        db.execute(
+            """UPDATE sms_messages
+               SET status = ?, attempts = COALESCE(?, attempts), twilio_sid = COALESCE(?, twilio_sid),
+                   error_code = ?, error_message = ?, updated_at = ?
+               WHERE id = ?""",
+            (status, attempts, twilio_sid, error_code, error_message, time.time(), message_id)
+        )
+
+
+def update_delivery_status(twilio_sid, status, error_code=None):
+    """Apply a Twilio status callback. Returns False for unknown messages."""
+    cursor = db.execute(
+        "UPDATE sms_messages SET status = ?, error_code = COALESCE(?, error_code), updated_at = ? WHERE twilio_sid = ?",
+        (status, error_code, time.time(), twilio_sid)
+    )
+    return cursor.rowcount > 0
+
+
+def get_message_status(message_id):
+    row = db.query_one(
+        "SELECT id, call_sid, to_number, status, twilio_sid, attempts, error_code, error_message FROM sms_messages WHERE id = ?",
+        (message_id,)
+    )
+    return dict(row) if row else None
@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before any app module is imported: nothing touches the checkout's database
+# or starts analysis workers and metric snapshots behind the tests' backs
+os.environ['CALL_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='ivr-tests-'), 'call_data.db')
+os.environ.setdefault('ANALYSIS_WORKER_MODE', 'off')
+os.environ.setdefault('METRICS_SNAPSHOT_INTERVAL', '0')
+
+import db
+import migrations
+
+
+@pytest.fixture
+def call_db(tmp_path, monkeypatch):
+    """A migrated call database in a temp dir, which is also the working directory for export files"""
+    monkeypatch.chdir(tmp_path)
+    previous = db.DB_PATH
+    db.configure(str(tmp_path / 'call_data.db'))
+    migrations.migrate()
+    yield db
+    db.configure(previous)
@@ -0,0 +1,133 @@
+import pytest
+
+from job_queue import save_call_analysis
+
+
+@pytest.fixture
+def client(call_db):
+    import app
+    return app.app.test_client()
+
+
+def test_get_call(client, call_db):
+    save_call_analysis('CA1', '+15550001', 'User: hello\n', {'customer_name': 'Ada'})
+    call_id = call_db.query_one("SELECT id FROM calls WHERE call_sid = 'CA1'")[0]
+
+    response = client.get(f'/api/calls/{call_id}')
+    assert response.status_code == 200
+    assert response.json['customer_name'] == 'Ada'
+    assert response.json['full_transcript'] == 'User: hello\n'
+
+
+@pytest.mark.parametrize('path', ['/api/calls/999', '/api/calls/999/transcript'])
+def test_unknown_call_is_404(client, path):
+    response = client.get(path)
+    assert response.status_code == 404
+    assert response.json == {'error': 'Not found'}
+
+
+def flow_answers(app, call_sid):
+    """Answer the billing and name questions the way the flow engine calls the handlers"""
+    from call_flow import CallInput
+    app.call_transcripts.create(call_sid)
+    answers = [
+        (app.record_billing_issue, 'billing_issue', 'I was charged twice'),
+        (app.record_billing_account, 'billing_account', 'it is 4 8 2 1 3 3 7 7'),
+        (app.record_name, 'other_name', 'Priya Sharma'),
+        (app.record_priority, 'billing_priority', '1'),
+    ]
+    for handler, state, value in answers:
+        handler(CallInput(call_sid, '+15550001', value, {'Confidence': '0.9'}, state))
+    return CallInput(call_sid, '+15550001', '', {}, 'goodbye')
+
+
+def test_flow_answers_are_saved(client, call_db):
+    import app
+    from job_queue import claim_next_job
+    app.complete_call(flow_answers(app, 'CA7'))
+
+    job = claim_next_job('worker-1')
+    assert 'Priya Sharma' in job['transcript'] and '48213377' not in job['transcript']
+    save_call_analysis(job['call_sid'], job['caller_number'], job['transcript'],
+                       {'customer_name': 'Unknown', 'loan_number': '999', 'consent_type': 'Unknown'})
+
+    row = call_db.query_one("SELECT * FROM calls WHERE call_sid = 'CA7'")
+    assert row['account_number'] == '48213377'
+    assert row['customer_name'] == 'Priya Sharma'
+    assert row['issue_description'] == 'I was charged twice'
+    assert row['priority'] == 'Urgent'
+
+
+def test_abandoned_flow_answers_are_saved(client, call_db):
+    import app
+    import call_reaper
+    flow_answers(app, 'CA8')
+    assert call_reaper.finalize_abandoned_call(app.call_transcripts, 'CA8', reason='idle')
+
+    row = call_db.query_one("SELECT * FROM calls WHERE call_sid = 'CA8'")
+    assert (row['status'], row['account_number'], row['customer_name'], row['priority']) \
+        == ('abandoned', '48213377', 'Priya Sharma', 'Urgent')
+
+
+@pytest.mark.parametrize('answers', [
+    [('main_menu', 'Digits', '2'), ('technical_issue', 'SpeechResult', 'the app logs me out')],
+    [('main_menu', 'Digits', '1'), ('account_info', 'SpeechResult', 'Priya Sharma 48213377'),
+     ('account_issue', 'SpeechResult', 'the app logs me out')],
+], ids=['technical', 'account'])
+def test_issue_description_is_saved_from_every_branch(client, call_db, answers):
+    import app
+    from job_queue import claim_next_job
+    app.call_transcripts.create('CA9')
+    form = {'CallSid': 'CA9', 'From': '+15550001', 'Confidence': '0.9'}
+    for state, field, value in answers + [('issue_priority', 'Digits', '2'),
+                                          ('record_issue', 'RecordingUrl', 'https://example.com/r')]:
+        assert client.post(f'/ivr/{state}', data=dict(form, **{field: value})).status_code == 200
+
+    job = claim_next_job('worker-1')
+    save_call_analysis(job['call_sid'], job['caller_number'], job['transcript'], {'customer_name': 'Unknown'})
+    row = call_db.query_one("SELECT issue_description, priority FROM calls WHERE call_sid = 'CA9'")
+    assert (row['issue_description'], row['priority']) == ('the app logs me out', 'Medium')
+
+
+def scrape(client, sample):
+    """One sample's value from /metrics"""
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+
+def test_admin_apis_report_the_deployment_totals(client, call_db):
+    import json
+    import time
+    # A snapshot another worker process published
+    other = {
+        'ivr_llm_cache_lookups_total': [[['miss'], 3]],
+        'ivr_gemini_hedges_total': [[[], 2]],
+        'ivr_flow_state_events_total': [[['main_menu', 'entered'], 5]],
+    }
+    call_db.execute("INSERT INTO metrics_snapshots (process, data, updated_at) VALUES ('other:1', ?, ?)",
+                    (json.dumps(other), time.time()))
+
+    misses = client.get('/api/llm_cache').json['misses']
+    assert misses >= 3 and misses == scrape(client, 'ivr_llm_cache_lookups_total{result="miss"}')
+    hedges = client.get('/api/llm').json['counters']['hedges']
+    assert hedges >= 2 and hedges == scrape(client, 'ivr_gemini_hedges_total')
+    entered = client.get('/api/flow').json['main_menu']['entered']
+    assert entered >= 5 and entered == scrape(
+        client, 'ivr_flow_state_events_total{state="main_menu",event="entered"}')
+
+
+def test_otp_sms_only_goes_to_phone_numbers(client, call_db, monkeypatch):
+    import app
+    monkeypatch.delenv('OTP_SMS_TO', raising=False)
+    sent = []
+    monkeypatch.setattr(app.sms_dispatcher, 'send', lambda to, body, call_sid=None: sent.append(to) or 1)
+
+    response = client.post('/incoming_call', data={'From': 'client:alice', 'CallSid': 'CA1'})
+    assert b'unable to verify your number' in response.data
+    assert sent == []
+
+    response = client.post('/incoming_call', data={'From': '15550001', 'CallSid': 'CA2'})
+    assert response.status_code == 200
+    assert sent == ['+15550001']
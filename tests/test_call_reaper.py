@@ -0,0 +1,55 @@
+import pytest
+
+import call_flow
+import call_reaper
+import session_store
+import transcript
+from session_store import InMemorySessionStore, RedisSessionStore, create_session_store
+
+
+def test_reaper_saves_idle_call(call_db):
+    calls = transcript.CallTranscripts(InMemorySessionStore())
+    calls.create('CA1')
+    calls.add('CA1', 'caller', 'hello')
+
+    assert call_reaper.reap_sessions(calls, idle_ttl=-1) == {'idle': 1, 'evicted': 0}
+    row = call_db.query_one("SELECT status, transcript_length FROM calls WHERE call_sid = 'CA1'")
+    assert row['status'] == 'abandoned'
+    assert transcript.archived_text('CA1') == 'User: hello\n'
+    assert call_db.query_one("SELECT COUNT(*) FROM transcript_segments")[0] == 0
+
+
+def test_idle_ttl_covers_longest_input_wait():
+    definition = call_flow.load_flow_definition()
+    # record_issue's <Record max_length=300>
+    assert call_flow.longest_input_wait(definition) == 300
+    assert call_reaper.IDLE_TTL_SECONDS == 300 + call_reaper.IDLE_TTL_MARGIN
+
+    # Without a max_length Twilio records for up to an hour
+    del definition['states']['record_issue']['record']
+    assert call_flow.longest_input_wait(definition) == call_flow.RECORD_MAX_LENGTH
+
+
+def test_redis_ttl_outlives_idle_ttl(monkeypatch):
+    pytest.importorskip('redis')
+    monkeypatch.setenv('SESSION_STORE', 'redis')
+    monkeypatch.setenv('SESSION_STORE_TTL', str(int(call_reaper.IDLE_TTL_SECONDS)))
+    with pytest.raises(ValueError, match='SESSION_STORE_TTL'):
+        create_session_store()
+
+    monkeypatch.delenv('SESSION_STORE_TTL')
+    store = create_session_store()
+    assert store.ttl == call_reaper.IDLE_TTL_SECONDS + session_store.SESSION_TTL_MARGIN
+
+
+def test_reaper_saves_call_whose_redis_key_expired(call_db):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # fakeredis runs Lua scripts with it
+    calls = transcript.CallTranscripts(RedisSessionStore(client=fakeredis.FakeRedis()))
+    calls.create('CA1')
+    calls.add('CA1', 'caller', 'still here')
+    calls.sessions.client.delete(calls.sessions._key('CA1'))  # as if the TTL ran out
+
+    assert call_reaper.reap_sessions(calls, idle_ttl=-1)['idle'] == 1
+    assert transcript.archived_text('CA1') == 'User: still here\n'
+    assert calls.count() == 0
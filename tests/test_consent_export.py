@@ -0,0 +1,87 @@
+import os
+import gzip
+import json
+
+import pytest
+
+import consent_export
+import dialer_file_processor as dfp
+from job_queue import save_call_analysis
+
+
+def seed_calls(count):
+    for i in range(count):
+        save_call_analysis(f'CA{i}', f'+1555{i:07d}', 'User: yes\n', {
+            'customer_name': 'Ada', 'loan_number': f'{i:08d}',
+            'consent_type': 'email', 'consent_status': 'opt-in' if i % 2 else 'opt-out'
+        })
+
+
+def test_bulk_export_matches_full_export(call_db, tmp_path):
+    seed_calls(25)
+    manifest_path = consent_export.export_consent_bulk(str(tmp_path / 'out'), shards=3, fmt='gzip', batch_size=4)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    lines = []
+    for entry in manifest['files']:
+        path = str(tmp_path / 'out' / entry['name'])
+        assert consent_export.file_sha256(path) == entry['sha256']
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            shard_lines = f.readlines()[1:]
+        assert len(shard_lines) == entry['rows']
+        lines.extend(shard_lines)
+
+    with open(dfp.process_consent_data(), encoding='utf-8') as f:
+        assert sorted(lines) == sorted(f.readlines()[1:])
+    assert manifest['total_rows'] == 25
+    assert not [name for name in os.listdir(tmp_path / 'out') if name.endswith('.tmp')]
+
+
+def test_failed_export_removes_every_shard(call_db, tmp_path, monkeypatch):
+    seed_calls(10)
+    shards = []
+    real_open_shard = consent_export.open_shard
+
+    def open_shard(path, fmt, batch_size):
+        shard = real_open_shard(path, fmt, batch_size)
+        shards.append(shard)
+        return shard
+
+    def write(self, rows):
+        raise RuntimeError('disk full')
+
+    def close(self):
+        self.file.close()
+        if self is shards[0]:
+            raise OSError('close failed')
+
+    monkeypatch.setattr(consent_export, 'open_shard', open_shard)
+    monkeypatch.setattr(consent_export.TextShard, 'write', write)
+    monkeypatch.setattr(consent_export.TextShard, 'close', close)
+
+    with pytest.raises(RuntimeError, match='disk full'):
+        consent_export.export_consent_bulk(str(tmp_path / 'out'), shards=3, fmt='text')
+    assert len(shards) == 3
+    assert os.listdir(tmp_path / 'out') == []
+
+
+def test_full_export_memory_does_not_grow_with_the_table():
+    pytest.importorskip('resource')
+    from benchmarks.export_memory import measure_in_subprocess
+    # A 2MB page cache: past that, the export's sort has to go to disk. Held
+    # in RAM instead, 300k rows raise the peak RSS by about 28MB.
+    result = measure_in_subprocess(300000, cache_kib=2000)
+    assert result['rows'] == 300000
+    assert result['rss_growth_mb'] < 12
+
+
+def test_arrow_shard_flushes_every_batch_size_rows(tmp_path):
+    pytest.importorskip('pyarrow')
+    shard = consent_export.open_shard(str(tmp_path / 'shard.arrow'), 'arrow', batch_size=2)
+    shard.write([('1', '+1', '', 'email', '1', 't')] * 3)
+    assert len(shard.pending) == 0
+    shard.write([('2', '+2', '', 'email', '0', 't')])
+    assert len(shard.pending) == 1
+    shard.close()
+    assert shard.rows == 4
@@ -0,0 +1,91 @@
+import os
+
+import dialer_file_processor as dfp
+from job_queue import save_call_analysis
+
+
+def analysis(consent_status, account='12345'):
+    return {
+        'customer_name': 'Ada', 'loan_number': account,
+        'consent_type': 'email', 'consent_status': consent_status
+    }
+
+
+def read_records(filename):
+    with open(filename, encoding='utf-8') as f:
+        next(f)  # Header
+        return [line.rstrip('\n').split('|') for line in f]
+
+
+def test_delta_exports_reanalysed_call(call_db):
+    save_call_analysis('CA1', '+15550001', 'User: yes\n', analysis('opt-in'))
+    first = dfp.process_consent_delta()
+    assert [record[4] for record in read_records(first)] == ['1']
+    assert dfp.process_consent_delta() is None
+
+    # Same call, same rowid, analysed again with the opposite answer
+    save_call_analysis('CA1', '+15550001', 'User: no\n', analysis('opt-out'))
+    second = dfp.process_consent_delta()
+    assert second and second != first
+    records = read_records(second)
+    assert [(record[0], record[4]) for record in records] == [('12345', '0')]
+    assert dfp.process_consent_delta() is None
+
+
+def test_compaction_matches_full_export(call_db, monkeypatch):
+    # Distinct snapshot names, even within one second
+    names = iter(f'consent_data_{i:04d}.txt' for i in range(100))
+    monkeypatch.setattr(dfp, 'generate_new_filename', lambda: next(names))
+
+    def compacted_equals_full_export():
+        compacted = dfp.compact_consent_exports()
+        full = dfp.process_consent_data()
+        with open(compacted, encoding='utf-8') as a, open(full, encoding='utf-8') as b:
+            assert a.read() == b.read()
+        os.remove(full)  # Keep the compacted file as the latest snapshot
+        return read_records(compacted)
+
+    save_call_analysis('CA1', '+15550001', 'User: yes\n', analysis('opt-in', '111'))
+    save_call_analysis('CA2', '+15550002', 'User: no\n', analysis('opt-out', '222'))
+    dfp.process_consent_delta()
+    save_call_analysis('CA1', '+15550001', 'User: no\n', analysis('opt-out', '111'))  # Re-analysed
+    dfp.process_consent_delta()
+    save_call_analysis('CA3', '+15550001', 'User: yes\n', analysis('opt-in', '111'))  # Same key, newer call
+    dfp.process_consent_delta()
+
+    records = compacted_equals_full_export()
+    assert [(record[0], record[4]) for record in records] == [('111', '1'), ('222', '0')]
+
+    # Deltas on top of a snapshot
+    save_call_analysis('CA2', '+15550002', 'User: yes\n', analysis('opt-in', '222'))
+    save_call_analysis('CA4', '+15550004', 'User: yes\n', analysis('opt-in', '444'))
+    dfp.process_consent_delta()
+
+    records = compacted_equals_full_export()
+    assert [(record[0], record[4]) for record in records] == [('444', '1'), ('222', '1'), ('111', '1')]
+
+
+def test_compaction_drops_records_that_left_the_export(call_db, monkeypatch):
+    names = iter(f'consent_data_{i:04d}.txt' for i in range(100))
+    monkeypatch.setattr(dfp, 'generate_new_filename', lambda: next(names))
+    save_call_analysis('CA1', '+15550001', 'User: yes\n', analysis('opt-in', '111'))
+    dfp.process_consent_delta()
+    assert [record[3] for record in read_records(dfp.compact_consent_exports())] == ['email']
+    assert dfp.compact_consent_exports() is None  # Nothing changed since
+
+    # Re-analysed: the email opt-in was really a mobile one
+    save_call_analysis('CA1', '+15550001', 'User: yes\n', dict(analysis('opt-in', '111'), consent_type='mobile'))
+    delta = dfp.process_consent_delta()
+    compacted = dfp.compact_consent_exports()
+    assert [(record[0], record[3]) for record in read_records(compacted)] == [('111', 'mobile')]
+    assert not os.path.exists(delta)
+
+    # A delta with changes the snapshot didn't see is kept for the next run
+    save_call_analysis('CA2', '+15550002', 'User: yes\n', analysis('opt-in', '222'))
+    # as if it was written while the rebuild ran
+    read_state = dfp.get_export_state
+    monkeypatch.setattr(dfp, 'get_export_state',
+                        lambda name, default=0: 0 if name == 'calls_change_seq' else read_state(name, default))
+    late = dfp.process_consent_delta()
+    dfp.compact_consent_exports()
+    assert os.path.exists(late)
@@ -0,0 +1,75 @@
+import time
+import threading
+
+import job_queue
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_supervisor_requeues_stale_jobs(call_db, monkeypatch):
+    pool = job_queue.WorkerPool('thread', size=0, supervise_interval=0.05).start()
+    try:
+        # Claimed by a worker that then died, after the pool had started
+        job_id = job_queue.enqueue_analysis('CA1', '+15550001', 'User: hi\n')
+        job_queue.claim_next_job('dead-worker')
+        monkeypatch.setattr(job_queue, 'STALE_AFTER_SECONDS', 0)
+
+        assert wait_for(lambda: job_queue.get_job(job_id)['status'] == 'queued')
+    finally:
+        pool.stop()
+
+
+def test_supervisor_replaces_dead_workers(call_db, monkeypatch):
+    started = []
+
+    def run_worker(stop_event):
+        started.append(threading.current_thread().name)
+        if len(started) > 1:
+            stop_event.wait()  # The replacement keeps running
+
+    monkeypatch.setattr(job_queue, 'run_worker', run_worker)
+    pool = job_queue.WorkerPool('thread', size=1, supervise_interval=0.05).start()
+    try:
+        assert wait_for(lambda: len(started) == 2)
+        assert started == ['analysis-worker-0', 'analysis-worker-0']
+        assert pool.workers[0].is_alive()
+    finally:
+        pool.stop()
+    assert not pool.workers
+
+
+def test_stale_job_out_of_attempts_is_failed(call_db, monkeypatch):
+    monkeypatch.setattr(job_queue, 'MAX_ATTEMPTS', 1)
+    job_id = job_queue.enqueue_analysis('CA1', '+15550001', 'User: hi\n')
+    job_queue.claim_next_job('dead-worker')
+    monkeypatch.setattr(job_queue, 'STALE_AFTER_SECONDS', -1)
+
+    assert job_queue.requeue_stale_jobs() == (0, 1)
+    job = job_queue.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert 'worker died' in job['last_error']
+    # Not claimed again
+    assert job_queue.claim_next_job('worker-2') is None
+
+
+def test_purge_finished_jobs(call_db, monkeypatch):
+    monkeypatch.setattr(job_queue, 'PURGE_BATCH_SIZE', 2)
+    old = [job_queue.enqueue_analysis(f'CA{i}', '+15550001', 'User: hi\n') for i in range(5)]
+    queued = job_queue.enqueue_analysis('CA9', '+15550001', 'User: hi\n')
+    for job_id in old[:3]:
+        job_queue.complete_job(job_id)
+    call_db.execute("UPDATE analysis_jobs SET status = 'failed' WHERE id = ?", (old[3],))
+    call_db.execute("UPDATE analysis_jobs SET updated_at = 0 WHERE id != ?", (old[4],))
+    call_db.execute("UPDATE analysis_jobs SET status = 'done' WHERE id = ?", (old[4],))
+
+    assert job_queue.purge_finished_jobs(retention_days=1) == 4
+    # Recently finished and unfinished jobs stay
+    assert job_queue.get_job(old[4])['status'] == 'done'
+    assert job_queue.get_job(queued)['status'] == 'queued'
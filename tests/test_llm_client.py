@@ -0,0 +1,47 @@
+import pytest
+
+from llm_client import CircuitBreaker
+
+
+def tripped(cooldown=60.0):
+    breaker = CircuitBreaker(window=4, min_calls=2, threshold=0.5, cooldown=cooldown)
+    tokens = [breaker.allow() for _ in range(3)]
+    breaker.record(False, tokens[0])
+    breaker.record(False, tokens[1])
+    assert breaker.state != 'closed'
+    return breaker, tokens[2]
+
+
+def test_late_success_cannot_close_an_open_circuit():
+    breaker, late = tripped()
+    breaker.record(True, late)
+    assert breaker.state == 'open'
+    assert breaker.allow() is None
+
+
+def test_late_failure_cannot_start_a_second_trial():
+    breaker, late = tripped(cooldown=0)
+    trial = breaker.allow()
+    assert trial is not None
+    breaker.record(False, late)
+    assert breaker.allow() is None  # The trial is still running
+    breaker.record(True, trial)
+    assert breaker.state == 'closed'
+
+
+@pytest.mark.parametrize('success, state', [(True, 'closed'), (False, 'open')])
+def test_trial_outcome(success, state):
+    breaker, _ = tripped(cooldown=0)
+    trial = breaker.allow()
+    breaker.cooldown = 60.0
+    breaker.record(success, trial)
+    assert breaker.state == state
+
+
+def test_cancelled_trial_frees_the_slot():
+    breaker, late = tripped(cooldown=0)
+    trial = breaker.allow()
+    breaker.cancel(late)
+    assert breaker.allow() is None
+    breaker.cancel(trial)
+    assert breaker.allow() is not None
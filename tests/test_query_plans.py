@@ -0,0 +1,109 @@
+"""Hot-path statements must use an index: no full table scans, no temp b-tree sorts.
+
+The statements are the ones the code actually runs, captured with a trace
+callback on the pooled connection (bound values are inlined), so a query
+edited in its module is checked as it now is.
+"""
+import pytest
+
+import call_queries
+import call_reaper
+import dialer_file_processor
+import job_queue
+import migrations
+import sms_dispatcher
+import transcript
+from otp_service import SQLiteOTPStore
+from session_store import InMemorySessionStore
+
+# Transaction control and the markers the trace reports for trigger bodies have no plan of their own
+NO_PLAN = ('--', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')
+
+
+@pytest.fixture
+def traced(call_db):
+    """Statements run on this thread's connection while the test body runs"""
+    statements = []
+    conn = call_db.get_connection()
+    conn.set_trace_callback(statements.append)
+    yield statements
+    conn.set_trace_callback(None)
+
+
+def assert_indexed(statements):
+    captured = [sql for sql in statements if not sql.lstrip().upper().startswith(NO_PLAN)]
+    assert captured, "nothing was traced"
+    failures = {sql: migrations.full_scans(sql) for sql in dict.fromkeys(captured)}
+    assert {sql: steps for sql, steps in failures.items() if steps} == {}
+
+
+def seed_call(call_sid='CA1'):
+    calls = transcript.CallTranscripts(InMemorySessionStore())
+    calls.create(call_sid)
+    calls.add(call_sid, 'caller', 'my name is Ada', confidence='0.9', source='account_info')
+    return calls
+
+
+def test_calls_pages(call_db):
+    seed_call()
+    job_queue.save_call_analysis('CA1', '+15550001', None, {})
+    cursor = ('2024-01-01T00:00:00', 10)
+    statements = [
+        call_queries.build_calls_query(call_queries.CALL_COLUMNS, limit=101),
+        call_queries.build_calls_query(['id'], after=cursor, limit=101),
+        call_queries.build_calls_query(['id'], since='2024-01-01', until='2024-02-01', limit=101),
+    ] + [
+        call_queries.build_calls_query(['id'], filters={column: 'x'}, after=cursor, limit=101)
+        for column in call_queries.FILTER_COLUMNS
+    ]
+    for sql, params in statements:
+        assert migrations.full_scans(sql, params) == [], sql
+
+
+def test_call_lifecycle(traced):
+    calls = seed_call()
+    text = calls.pop('CA1')
+    job_id = job_queue.enqueue_analysis('CA1', '+15550001', text)
+    job = job_queue.claim_next_job('worker-1')
+    job_queue.fail_job(job, 'boom')
+    job_queue.requeue_stale_jobs()
+    job_queue.get_job(job_id)
+    job_queue.save_call_analysis('CA1', '+15550001', text, {'loan_number': '123', 'consent_status': 'opt-in',
+                                                             'consent_type': 'email'})
+    job_queue.complete_job(job_id)
+    job_queue.purge_finished_jobs()
+    transcript.call_segments('CA1')
+    dialer_file_processor.process_consent_delta()
+    assert_indexed(traced)
+
+
+def test_abandoned_call(traced):
+    calls = seed_call('CA2')
+    call_reaper.reap_sessions(calls, idle_ttl=-1)
+    assert_indexed(traced)
+
+
+def test_otp_store(traced):
+    store = SQLiteOTPStore()
+    store.issue('+15550001', '123456')
+    store.verify('+15550001', '000000')
+    store.verify('+15550001', '123456')
+    store.purge_expired()
+    assert_indexed(traced)
+
+
+def test_sms_status(traced):
+    sms_dispatcher.update_delivery_status('SM1', 'delivered')
+    sms_dispatcher.get_message_status(1)
+    assert_indexed(traced)
+
+
+def test_admin_api(traced):
+    import app
+    seed_call()
+    job_queue.save_call_analysis('CA1', '+15550001', None, {})
+    client = app.app.test_client()
+    for path in ('/api/calls?limit=10', '/api/calls?status=new&fields=id,call_sid', '/api/calls/1',
+                 '/api/calls/1/transcript'):
+        assert client.get(path).status_code == 200, path
+    assert_indexed(traced)
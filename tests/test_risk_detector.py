@@ -0,0 +1,70 @@
+import os
+import json
+
+import pytest
+
+from risk_detector import RiskDetector, RiskLexicon, DEFAULT_LEXICON_PATH, tokenize
+
+
+@pytest.fixture(scope='module')
+def lexicon():
+    return RiskLexicon.load(DEFAULT_LEXICON_PATH)
+
+
+def matched_terms(lexicon, text):
+    return [match.term for match in lexicon.match(text)]
+
+
+def test_possessive_is_stripped():
+    assert tokenize("The bomb's timer, the bombs' timers") == ['the', 'bomb', 'timer', 'the', 'bombs', 'timers']
+    assert tokenize("Don't worry, it’s the gun’s case") == ["don't", 'worry', 'it', 'the', 'gun', 'case']
+
+
+@pytest.mark.parametrize('text, terms', [
+    ("the bomb's in the car", ['bomb']),
+    ("I'll attack tomorrow", ['attack']),
+    ('they attacked and were attacking', ['attack', 'attack']),
+    ('two killers and a gunner', ['kill', 'gun']),
+    ('he was gunning for me', ['gun']),
+    ('the storm is damaging roofs', ['damage']),
+    ("there's a blast", ['blast']),
+    ("I'm going to blow up", ['blow up']),
+    ('they are blowing up the bridge', ['blowing up']),
+])
+def test_matches(lexicon, text, terms):
+    assert matched_terms(lexicon, text) == terms
+
+
+@pytest.mark.parametrize('text', [
+    'I have a new skill',
+    'she is skilled at billing',
+    'blasting music all night',
+    'the pipes were blasted clean',
+    'my account number is 12345',
+    'bombastic language',
+])
+def test_no_false_positives(lexicon, text):
+    assert matched_terms(lexicon, text) == []
+
+
+def test_min_severity():
+    detector = RiskDetector(DEFAULT_LEXICON_PATH)
+    text = 'a threat to damage the bomb'
+    assert [m.term for m in detector.check(text)] == ['threat', 'damage', 'bomb']
+    assert [m.term for m in detector.check(text, min_severity='medium')] == ['threat', 'bomb']
+    assert [m.term for m in detector.check(text, min_severity='high')] == ['bomb']
+
+
+def test_reload_keeps_last_good_lexicon(tmp_path):
+    path = tmp_path / 'lexicon.json'
+    path.write_text(json.dumps({'terms': [{'term': 'bomb'}]}))
+    detector = RiskDetector(str(path), reload_interval=0)
+    assert [m.term for m in detector.check('a bomb and a fire')] == ['bomb']
+
+    path.write_text(json.dumps({'terms': [{'term': 'fire', 'severity': 'low'}]}))
+    os.utime(path, (1, 1))  # A new mtime even within the filesystem's timestamp resolution
+    assert [m.term for m in detector.check('a bomb and a fire')] == ['fire']
+
+    path.write_text('{"terms": [')
+    os.utime(path, (2, 2))
+    assert [m.term for m in detector.check('a bomb and a fire')] == ['fire']
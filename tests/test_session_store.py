@@ -0,0 +1,119 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from session_store import InMemorySessionStore, SQLiteSessionStore, RedisSessionStore
+from transcript import CallTranscripts
+
+
+def redis_client():
+    """A client of REDIS_TEST_URL when set, else of fakeredis; skips when neither is available"""
+    url = os.getenv('REDIS_TEST_URL')
+    if url:
+        redis = pytest.importorskip('redis')
+        return lambda: redis.Redis.from_url(url)
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # fakeredis runs Lua scripts with it
+    server = fakeredis.FakeServer()
+    return lambda: fakeredis.FakeRedis(server=server)
+
+
+def redis_store(ttl=60):
+    # A fresh prefix per test, so a shared server needs no cleanup between runs
+    return RedisSessionStore(client=redis_client()(), prefix=f"ivr-test:{uuid.uuid4().hex}:", ttl=ttl)
+
+
+def row(text, created_at=1.0):
+    return ['caller', text, 0.9, 'account_info', created_at]
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return InMemorySessionStore()
+    if request.param == 'sqlite':
+        return SQLiteSessionStore(str(tmp_path / 'call_sessions.db'))
+    return redis_store()
+
+
+def test_create_append_pop(store):
+    assert not store.append('CA1', row('too early'))
+    store.create('CA1')
+    assert store.pop('CA2') is None
+    assert store.append('CA1', row('hello'))
+    assert store.append('CA1', row('bye', 2.0))
+    assert store.segments('CA1') == [row('hello'), row('bye', 2.0)]
+    assert store.count() == 1
+
+    assert store.pop('CA1') == [row('hello'), row('bye', 2.0)]
+    # Only the first pop wins, and a late webhook can't reopen the call
+    assert store.pop('CA1') is None
+    assert not store.append('CA1', row('late'))
+    assert store.segments('CA1') == []
+    assert store.count() == 0
+
+
+def test_reopened_session_keeps_its_segments(store):
+    store.create('CA1')
+    store.append('CA1', row('hello'))
+    store.create('CA1')
+    assert store.pop('CA1') == [row('hello')]
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'redis'])
+def test_segments_are_shared_between_workers(backend, tmp_path, call_db):
+    if backend == 'sqlite':
+        path = str(tmp_path / 'call_sessions.db')
+        first, second = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    else:
+        connect = redis_client()
+        prefix = f"ivr-test:{uuid.uuid4().hex}:"
+        first, second = (RedisSessionStore(client=connect(), prefix=prefix) for _ in range(2))
+    # Each webhook of the call lands on another worker
+    answering, recording = CallTranscripts(first), CallTranscripts(second)
+    answering.create('CA1')
+    answering.add('CA1', 'system', 'Client caller, using number: +15550001')
+    recording.add('CA1', 'caller', 'my name is Ada', confidence='0.9', source='account_info')
+    answering.add('CA1', 'priority', 'Urgent', source='issue_priority')
+
+    expected = 'Client caller, using number: +15550001\nUser: my name is Ada\nPriority: Urgent\n'
+    assert recording.text('CA1') == expected
+    assert recording.pop('CA1') == expected
+    assert answering.pop('CA1') is None
+
+
+def test_least_recent(store):
+    for call_sid in ('CA1', 'CA2', 'CA3'):
+        store.create(call_sid)
+        time.sleep(0.01)
+    store.append('CA1', row('hello'))
+
+    assert store.least_recent(2) == ['CA2', 'CA3']
+    assert store.least_recent(10, idle_before=time.time() + 1) == ['CA2', 'CA3', 'CA1']
+    assert store.least_recent(10, idle_before=0) == []
+
+
+def test_redis_append_refreshes_ttl():
+    store = redis_store(ttl=60)
+    store.create('CA1')
+    key = store._key('CA1')
+    store.client.expire(key, 5)
+
+    assert store.append('CA1', row('hello'))
+    assert 55 < store.client.ttl(key) <= 60
+    assert 55 < store.client.ttl(store._segments_key('CA1')) <= 60
+
+
+def test_redis_ttl_expiry():
+    store = redis_store(ttl=1)
+    store.create('CA1')
+    time.sleep(1.2)
+
+    # The key is gone, so the call takes no more segments, but the reaper still finds it once
+    assert not store.append('CA1', row('late'))
+    assert store.least_recent(10) == ['CA1']
+    assert store.pop('CA1') == []
+    assert store.pop('CA1') is None
+    assert store.least_recent(10) == []
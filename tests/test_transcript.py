@@ -0,0 +1,52 @@
+import pytest
+
+import transcript
+from transcript import Segment
+
+
+def sample_call():
+    return [
+        Segment('system', 'Client caller, using number: +1234567890', None, None, 1760000000.123456),
+        Segment('caller', 'my name is Priya Sharma and my loan number is 48213377', 0.89787211, 'account_info',
+                1760000010.6269035),
+        Segment('technical_issue', 'I want to opt in for email updates', 0.79321968, 'technical_issue',
+                1760000015.9225247),
+        Segment('priority', 'Low', None, 'issue_priority', 1760000022.9679444),
+    ]
+
+
+@pytest.mark.parametrize('codec', ['packed', 'zlib', 'json'])
+def test_codecs_round_trip(codec):
+    segments = sample_call()
+    decoded = transcript.decode_segments(codec, transcript.encode_segments(segments, codec))
+    assert transcript.render(decoded) == transcript.render(segments)
+    for original, copy in zip(segments, decoded):
+        assert (copy.kind, copy.source) == (original.kind, original.source)
+        assert copy.created_at == pytest.approx(original.created_at, abs=0.01)
+        assert copy.confidence == pytest.approx(original.confidence, abs=0.001)
+
+
+def test_packed_is_smaller_than_the_text():
+    segments = sample_call()
+    assert len(transcript.encode_segments(segments, 'packed')) < len(transcript.render(segments))
+    # A transcript saved before segments existed has no times or confidences
+    legacy = [Segment('text', 'User: hello\nPriority: Low\n')]
+    assert transcript.render(transcript.decode_segments('packed', transcript.encode_segments(legacy, 'packed'))) \
+        == legacy[0].text
+
+
+def test_preview_is_short():
+    preview = transcript.preview(sample_call())
+    assert len(preview) == transcript.PREVIEW_CHARS
+    assert preview.startswith('my name is Priya Sharma') and preview.endswith('...')
+
+
+def test_compress_archives(call_db):
+    with call_db.transaction() as conn:
+        conn.execute(
+            "INSERT INTO transcript_archives (call_sid, codec, body, length) VALUES ('CA1', 'json', ?, 3)",
+            (transcript.encode_segments([Segment('text', 'hi\n')], 'json'),)
+        )
+    assert transcript.compress_archives('packed') == 1
+    assert call_db.query_one("SELECT codec FROM transcript_archives")[0] == 'packed'
+    assert transcript.archived_text('CA1') == 'hi\n'
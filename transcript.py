@@ -0,0 +1,314 @@
+"""Per-call transcripts as typed, timestamped segments.
+
+Every caller turn is one segment appended to the call's session, so a turn
+costs one small write instead of copying the whole transcript string, and
+with a shared session store any worker or machine sees the whole call. The
+text the LLM and the reports read is rendered from the segments only when
+asked for. When the call ends, its segments move to transcript_segments in
+the call database, next to the analysis job that saves them.
+
+Once a call is saved, its segments move into one compressed transcript_archives
+row and calls keeps only a short preview. The default packed codec stores
+compact rows deflated against a preset dictionary of the IVR's own strings,
+so even a short call shrinks; zlib, zstd (with the zstandard package) and
+json (uncompressed) are still read and can still be written.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+
+import db
+
+try:
+    import zstandard
+except ImportError:  # Only needed for TRANSCRIPT_CODEC=zstd
+    zstandard = None
+
+# Line prefix each kind renders with; fast_extractor.SPEAKER_LABEL parses these back
+SEGMENT_LABELS = {
+    'caller': 'User',
+    'technical_issue': 'Technical issue',
+    'billing_issue': 'Billing issue',
+    'other_issue': 'Other issue',
+    'priority': 'Priority',
+    'system': None,  # Notes from the app itself, rendered as-is
+    'text': None,  # A whole transcript saved before segments existed, rendered verbatim
+}
+
+# Values the flow captured for the calls row (billing account, name), kept with
+# the segments until the call is saved but never rendered into the transcript
+FIELD_KINDS = ('account_number', 'customer_name')
+# Segments whose text is the caller's issue description, one per branch of the
+# flow's main menu (the account branch records a technical_issue too)
+ISSUE_KINDS = ('technical_issue', 'billing_issue', 'other_issue')
+
+SEGMENT_COLUMNS = "kind, text, confidence, source, created_at"
+
+TRANSCRIPT_CODEC = os.getenv('TRANSCRIPT_CODEC', 'packed').lower()
+PREVIEW_CHARS = 48
+ARCHIVE_BATCH_SIZE = 500
+
+# Preset deflate dictionary of the packed codec: state names, segment kinds,
+# the app's own notes and common caller phrases, most frequent last. Archived
+# rows only decode with the exact bytes they were packed with, so never edit
+# it; add a new codec with a new dictionary instead.
+PACKED_DICTIONARY = (
+    b' my name is account number loan number opt in opt out of please I want to for email updates'
+    b' text messages sms phone calls mobile yes no'
+    b'"enter_otp","invalid_otp","main_menu","account_info","account_issue","technical_issue",'
+    b'"issue_priority","billing_issue","billing_account","billing_priority","other_issue","other_name",'
+    b'"other_priority","record_issue","goodbye","no_input","risky_speech","technical_error",'
+    b'["caller","],["technical_issue","],["billing_issue","],["other_issue","],["priority","],'
+    b'["system","],["text","],null,"Low","Medium","Urgent",'
+    b'"Client caller, using number: +","No caller ID, using default: +'
+)
+
+
+class Segment:
+    __slots__ = ('kind', 'text', 'confidence', 'source', 'created_at')
+
+    def __init__(self, kind, text, confidence=None, source=None, created_at=None):
+        self.kind = kind
+        self.text = text
+        self.confidence = confidence
+        self.source = source
+        self.created_at = created_at
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['kind'], row['text'], row['confidence'], row['source'], row['created_at'])
+
+    def render(self):
+        if self.kind == 'text':
+            return self.text
+        if self.kind in FIELD_KINDS:
+            return ''
+        label = SEGMENT_LABELS.get(self.kind)
+        return f"{label}: {self.text}\n" if label else f"{self.text}\n"
+
+    def as_row(self):
+        return [self.kind, self.text, self.confidence, self.source, self.created_at]
+
+    def as_dict(self):
+        return {
+            'kind': self.kind, 'text': self.text, 'confidence': self.confidence,
+            'source': self.source, 'created_at': self.created_at
+        }
+
+
+def render(segments):
+    return ''.join(segment.render() for segment in segments)
+
+
+def preview(segments):
+    """The start of what the caller said, on one line, for listings"""
+    text = ' '.join(
+        ' '.join(segment.text.split()) for segment in segments
+        if segment.kind != 'system' and segment.kind not in FIELD_KINDS
+    )
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 3] + '...'
+
+
+def flow_fields(segments):
+    """calls columns the caller answered in the flow itself; a later answer replaces an earlier one"""
+    fields = {}
+    for segment in segments:
+        if segment.kind in FIELD_KINDS:
+            fields[segment.kind] = segment.text
+        elif segment.kind in ISSUE_KINDS:
+            fields['issue_description'] = segment.text
+        elif segment.kind == 'priority':
+            fields['priority'] = segment.text
+    return fields
+
+
+def parse_confidence(value):
+    """Twilio posts Confidence as a string, and only for speech"""
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def save_segments(call_sid, segments):
+    if not segments:
+        return
+    with db.transaction() as conn:
+        conn.executemany(
+            f"INSERT INTO transcript_segments (call_sid, {SEGMENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            [(call_sid, *segment.as_row()) for segment in segments]
+        )
+
+
+def load_segments(call_sid):
+    """Segments of a finished call that isn't archived yet"""
+    rows = db.query_all(
+        f"SELECT {SEGMENT_COLUMNS} FROM transcript_segments WHERE call_sid = ? ORDER BY id", (call_sid,)
+    )
+    return [Segment.from_row(row) for row in rows]
+
+
+def pack_rows(segments):
+    """[base time, [kind, text, confidence, source, centiseconds after base], ...]
+
+    Confidence is kept to 3 places and times to 10ms, which is all Twilio's
+    figures and the reports need.
+    """
+    base = next((segment.created_at for segment in segments if segment.created_at is not None), 0)
+    base = round(base, 2)
+    rows = [base]
+    for segment in segments:
+        confidence = round(segment.confidence, 3) if segment.confidence is not None else None
+        offset = round((segment.created_at - base) * 100) if segment.created_at is not None else None
+        rows.append([segment.kind, segment.text, confidence, segment.source, offset])
+    return rows
+
+
+def unpack_rows(rows):
+    base = rows[0]
+    return [
+        Segment(kind, text, confidence, source, round(base + offset / 100, 2) if offset is not None else None)
+        for kind, text, confidence, source, offset in rows[1:]
+    ]
+
+
+def encode_segments(segments, codec=TRANSCRIPT_CODEC):
+    if codec == 'packed':
+        payload = json.dumps(pack_rows(segments), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        # Raw deflate: no zlib header or checksum, SQLite pages already have their own
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zdict=PACKED_DICTIONARY)
+        return compressor.compress(payload) + compressor.flush()
+    payload = json.dumps([segment.as_row() for segment in segments], separators=(',', ':')).encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(payload, 6)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is required for TRANSCRIPT_CODEC=zstd")
+        return zstandard.ZstdCompressor().compress(payload)
+    if codec == 'json':
+        return payload
+    raise ValueError(f"Unknown TRANSCRIPT_CODEC: {codec}")
+
+
+def decode_segments(codec, body):
+    if codec == 'packed':
+        decompressor = zlib.decompressobj(-15, zdict=PACKED_DICTIONARY)
+        return unpack_rows(json.loads(decompressor.decompress(body) + decompressor.flush()))
+    if codec == 'zlib':
+        payload = zlib.decompress(body)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is required to read zstd transcripts")
+        payload = zstandard.ZstdDecompressor().decompress(body)
+    elif codec == 'json':
+        payload = bytes(body)
+    else:
+        raise ValueError(f"Unknown transcript codec: {codec}")
+    return [Segment(*row) for row in json.loads(payload)]
+
+
+def archive(conn, call_sid, text):
+    """Move a saved call's segments into its compressed transcript_archives row.
+
+    Runs in the caller's transaction, next to the calls insert, and returns
+    the segments for the calls row's preview, length and flow_fields. A call
+    with no segments (queued before they existed) is archived as its whole text.
+    """
+    rows = conn.execute(
+        f"SELECT {SEGMENT_COLUMNS} FROM transcript_segments WHERE call_sid = ? ORDER BY id", (call_sid,)
+    ).fetchall()
+    segments = [Segment.from_row(row) for row in rows] or [Segment('text', text or '')]
+    conn.execute(
+        "INSERT OR REPLACE INTO transcript_archives (call_sid, codec, body, length) VALUES (?, ?, ?, ?)",
+        (call_sid, TRANSCRIPT_CODEC, encode_segments(segments, TRANSCRIPT_CODEC), len(render(segments)))
+    )
+    conn.execute("DELETE FROM transcript_segments WHERE call_sid = ?", (call_sid,))
+    return segments
+
+
+def load_archived(call_sid):
+    """A saved call's segments, decompressed, or None if it has no archived transcript"""
+    row = db.query_one("SELECT codec, body FROM transcript_archives WHERE call_sid = ?", (call_sid,))
+    return decode_segments(row['codec'], row['body']) if row else None
+
+
+def archived_text(call_sid):
+    segments = load_archived(call_sid)
+    return render(segments) if segments is not None else None
+
+
+def call_segments(call_sid):
+    """Segments of a call waiting for analysis, or of a saved call from its archive"""
+    return load_segments(call_sid) or load_archived(call_sid) or []
+
+
+def compress_archives(codec=TRANSCRIPT_CODEC, batch_size=ARCHIVE_BATCH_SIZE):
+    """Re-encode archives stored in another codec, e.g. the uncompressed ones migration 9 copied over"""
+    converted = 0
+    while True:
+        with db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT call_sid, codec, body FROM transcript_archives WHERE codec != ? LIMIT ?", (codec, batch_size)
+            ).fetchall()
+            for row in rows:
+                segments = decode_segments(row['codec'], row['body'])
+                conn.execute(
+                    "UPDATE transcript_archives SET codec = ?, body = ? WHERE call_sid = ?",
+                    (codec, encode_segments(segments, codec), row['call_sid'])
+                )
+        converted += len(rows)
+        if len(rows) < batch_size:
+            return converted
+
+
+class CallTranscripts:
+    """Transcripts of calls in progress, kept with their sessions in the session store"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def create(self, call_sid):
+        """Open the call's session; segments already added to it are kept"""
+        self.sessions.create(call_sid)
+
+    def add(self, call_sid, kind, text, confidence=None, source=None):
+        """Append a segment. Returns False if the call has no open session."""
+        if kind not in SEGMENT_LABELS and kind not in FIELD_KINDS:
+            raise ValueError(f"Unknown transcript segment kind: {kind}")
+        # Refreshes the call's last activity; a finished call can't be resurrected
+        segment = Segment(kind, text, parse_confidence(confidence), source, time.time())
+        return self.sessions.append(call_sid, segment.as_row())
+
+    def segments(self, call_sid):
+        return [Segment(*row) for row in self.sessions.segments(call_sid)]
+
+    def text(self, call_sid):
+        return render(self.segments(call_sid))
+
+    def pop(self, call_sid):
+        """Close the call's session and return its rendered transcript, or None if it was already closed.
+
+        The segments move to transcript_segments, where the analysis job or
+        the reaper archives them with the calls row.
+        """
+        rows = self.sessions.pop(call_sid)
+        if rows is None:
+            return None
+        save_segments(call_sid, [Segment(*row) for row in rows])
+        # Including any saved by an earlier pop, when the session was reopened after an error
+        return render(load_segments(call_sid))
+
+    def count(self):
+        return self.sessions.count()
+
+    def least_recent(self, limit, idle_before=None):
+        return self.sessions.least_recent(limit, idle_before)
+
+
+if __name__ == "__main__":
+    # python transcript.py --compress   compress archived transcripts, then VACUUM to shrink the file
+    if '--compress' in sys.argv:
+        print(f"Compressed {compress_archives()} transcripts with {TRANSCRIPT_CODEC}")
+        db.get_connection().execute("VACUUM")
@@ -0,0 +1,66 @@
+import re
+from xml.sax.saxutils import escape
+
+from flask import Response
+from twilio.twiml.voice_response import VoiceResponse
+
+# {{name}} marks a value filled in per request
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
+XML_ENTITIES = {'"': '&quot;', "'": '&apos;'}
+
+VOICE = 'Polly.Raveena'
+LANGUAGE = 'en-IN'
+
+
+class TwiMLTemplate:
+    """A TwiML response serialized once; render() only splices in placeholder values"""
+
+    def __init__(self, response):
+        xml = str(response)
+        self.parts = []  # Format: [bytes, placeholder name, bytes, ...]
+        position = 0
+        for match in PLACEHOLDER.finditer(xml):
+            self.parts.append(xml[position:match.start()].encode('utf-8'))
+            self.parts.append(match.group(1))
+            position = match.end()
+        self.parts.append(xml[position:].encode('utf-8'))
+        self.static = self.parts[0] if len(self.parts) == 1 else None
+
+    def render(self, **values):
+        if self.static is not None:
+            return self.static
+        return b''.join(
+            part if isinstance(part, bytes) else escape(str(values[part]), XML_ENTITIES).encode('utf-8')
+            for part in self.parts
+        )
+
+
+def say_response(message, hangup=False, **say_options):
+    response = VoiceResponse()
+    response.say(message, **say_options)
+    if hangup:
+        response.hangup()
+    return response
+
+
+# Responses sent outside the call flow, as functions so benchmarks can rebuild them
+BUILDERS = {
+    'no_caller_id': lambda: say_response(
+        "We're unable to verify your number. Please ensure you're not blocking your caller ID.", hangup=True),
+    'sms_unavailable': lambda: say_response(
+        "We encountered a technical issue. Please try again later.", hangup=True),
+    'technical_error': lambda: say_response(
+        "We encountered a technical issue. Please try your call again.", hangup=True),
+}
+
+# Rendered once at import
+TEMPLATES = {name: TwiMLTemplate(build()) for name, build in BUILDERS.items()}
+
+
+def xml_response(body):
+    return Response(body, mimetype='text/xml')
+
+
+def twiml(name, **values):
+    """Flask response for a cached TwiML template"""
+    return xml_response(TEMPLATES[name].render(**values))
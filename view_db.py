@@ -1,15 +1,16 @@
 import sqlite3
+import db
+import call_stats
 from tabulate import tabulate
 from datetime import datetime
 
 def view_database():
-    conn = sqlite3.connect('call_data.db')
-    cursor = conn.cursor()
+    cursor = db.get_connection().cursor()
     
-    def print_table(query, title):
+    def print_table(query, title, params=()):
         print(f"\n=== {title} ===")
         try:
-            cursor.execute(query)
+            cursor.execute(query, params)
             headers = [description[0] for description in cursor.description]
             rows = cursor.fetchall()
             if rows:
@@ -28,13 +29,7 @@ def view_database():
     """, "Recent OTP Verifications")
     
     # OTP Statistics
-    print_table("""
-        SELECT 
-            COUNT(*) as total_otps,
-            SUM(CASE WHEN verified = 1 THEN 1 ELSE 0 END) as verified_otps,
-            SUM(CASE WHEN verified = 0 THEN 1 ELSE 0 END) as pending_otps
-        FROM otp_verification
-    """, "OTP Statistics")
+    print_table(call_stats.OTP_SQL, "OTP Statistics")
     
     # Recent Calls with Consent Info
     print_table("""
@@ -43,7 +38,7 @@ def view_database():
             caller_number,
             customer_name,
             account_number,
-            full_transcript || '...' as transcript_preview,
+            transcript_preview,
             consent_type,
             consent_status,
             timestamp
@@ -53,54 +48,21 @@ def view_database():
     """, "Recent Calls with Consent Information")
     
     # Consent Status Distribution
-    print_table("""
-        SELECT 
-            consent_status,
-            COUNT(*) as count,
-            ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM calls), 2) as percentage
-        FROM calls 
-        GROUP BY consent_status
-    """, "Consent Status Distribution")
+    print_table(call_stats.CONSENT_STATUS_SQL, "Consent Status Distribution")
     
     # Consent Type Distribution
-    print_table("""
-        SELECT 
-            consent_type,
-            COUNT(*) as count
-        FROM calls 
-        GROUP BY consent_type
-    """, "Consent Type Distribution")
+    print_table(call_stats.CONSENT_TYPE_SQL, "Consent Type Distribution")
     
     # Daily Call Volume
-    print_table("""
-        SELECT 
-            date(timestamp) as call_date,
-            COUNT(*) as call_count
-        FROM calls 
-        GROUP BY date(timestamp)
-        ORDER BY call_date DESC
-        LIMIT 7
-    """, "Daily Call Volume (Last 7 Days)")
+    print_table(call_stats.DAILY_VOLUME_SQL, "Daily Call Volume (Last 7 Days)", (7,))
     
     # Unknown Information Stats
-    print_table("""
-        SELECT 
-            SUM(CASE WHEN customer_name = 'Unknown' THEN 1 ELSE 0 END) as unknown_names,
-            SUM(CASE WHEN account_number = 'Unknown' THEN 1 ELSE 0 END) as unknown_accounts,
-            SUM(CASE WHEN consent_status = 'Unknown' THEN 1 ELSE 0 END) as unknown_consent
-        FROM calls
-    """, "Unknown Information Statistics")
+    print_table(call_stats.UNKNOWN_FIELDS_SQL, "Unknown Information Statistics")
     
     # System Performance
-    print_table("""
-        SELECT 
-            COUNT(*) as total_calls,
-            AVG(LENGTH(full_transcript)) as avg_transcript_length,
-            COUNT(DISTINCT caller_number) as unique_callers
-        FROM calls
-    """, "System Performance Metrics")
+    print_table(call_stats.TOTALS_SQL, "System Performance Metrics")
     
-    conn.close()
+    db.release_connection()
 
 if __name__ == "__main__":
     print(f"\nDatabase View Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")